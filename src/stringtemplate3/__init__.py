@@ -20,3 +20,4 @@ from stringtemplate3.templates import *
 from stringtemplate3.groups import *
 from stringtemplate3.interfaces import *
 from stringtemplate3.grouploaders import *
+from stringtemplate3.caches import *
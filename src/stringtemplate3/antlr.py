@@ -9,7 +9,7 @@ from builtins import object
 from collections import abc
 # import curses.ascii
 import sys
-from io import IOBase
+from io import IOBase, TextIOBase
 import logging
 
 logger = logging.getLogger(__name__)
@@ -761,28 +761,60 @@ class CommonHiddenStreamToken(CommonToken):
 
 
 class Queue(object):
-    """ Queue: Shall be a circular buffer on tokens ... """
+    """ Queue: a circular buffer on tokens (or chars).
+    The capacity is always a power of two so the physical slot of
+    an element is found with a mask instead of a modulo.
+    Removing the first element just advances the head,
+    rather than shifting the whole list as list.pop(0) does.
+    """
+    INITIAL_CAPACITY = 16
 
     def __init__(self):
-        self._buffer = []  # empty list
+        self._buffer = [None] * self.INITIAL_CAPACITY
+        self._mask = self.INITIAL_CAPACITY - 1
+        self._head = 0
+        self._size = 0
 
     def append(self, item):
-        self._buffer.append(item)
+        if self._size > self._mask:
+            self._grow()
+        self._buffer[(self._head + self._size) & self._mask] = item
+        self._size += 1
+
+    def _grow(self):
+        """ Double the capacity, unrolling the ring so the head is at slot 0. """
+        items = self.toList()
+        capacity = len(self._buffer) * 2
+        self._buffer = items + [None] * (capacity - len(items))
+        self._mask = capacity - 1
+        self._head = 0
 
     def elementAt(self, index):
-        return self._buffer[index]
+        if index >= self._size or index < 0:
+            raise IndexError(index)
+        return self._buffer[(self._head + index) & self._mask]
 
     def reset(self):
-        self._buffer = []
+        self._buffer = [None] * self.INITIAL_CAPACITY
+        self._mask = self.INITIAL_CAPACITY - 1
+        self._head = 0
+        self._size = 0
 
     def removeFirst(self):
-        self._buffer.pop(0)
+        if not self._size:
+            raise IndexError("removeFirst from empty queue")
+        self._buffer[self._head] = None
+        self._head = (self._head + 1) & self._mask
+        self._size -= 1
 
     def length(self):
-        return len(self._buffer)
+        return self._size
+
+    def toList(self):
+        return [self._buffer[(self._head + i) & self._mask] for i in range(self._size)]
 
     def __str__(self):
-        return str(self._buffer)
+        return str(self.toList())
 
 
 class InputBuffer(object):
@@ -915,6 +947,76 @@ class CharBuffer(InputBuffer):
         # assert 0
 
 
+class StringCharBuffer(InputBuffer):
+    """ StringCharBuffer
+    An input buffer over a string that is held in memory as a whole.
+    Rather than pulling the characters one at a time through a queue,
+    the text is indexed with an integer cursor.
+    The cursor plays the role of the queue head;
+    the marker offset and the pending consume count keep
+    the same meaning as they have in the InputBuffer.
+    Lookahead beyond the end of the text yields the EOF char.
+    """
+    def __init__(self, text):
+        super(StringCharBuffer, self).__init__()
+        if not isinstance(text, str):
+            text = str(text)
+        self._text = text
+        self._length = len(text)
+        self._cursor = 0
+
+    @classmethod
+    def fromStream(cls, stream):
+        """ Read everything that remains in the stream into a new buffer. """
+        try:
+            return cls(stream.read())
+        except Exception as e:
+            raise CharStreamIOException(e)
+
+    def __str__(self):
+        base = super(StringCharBuffer, self).__str__()
+        return "StringCharBuffer{%s,%s}" % (base, self._cursor)
+
+    @property
+    def text(self):
+        return self._text
+
+    @property
+    def LAChars(self):
+        start = self._cursor + self._markerOffset
+        return self._text[start:]
+
+    @property
+    def markedChars(self):
+        return self._text[self._cursor:self._cursor + self._markerOffset]
+
+    def fill(self, amount):
+        self.syncConsume()
+
+    def LA(self, k):
+        if self._numToConsume:
+            self.syncConsume()
+        index = self._cursor + self._markerOffset + k - 1
+        if index < self._length:
+            return self._text[index]
+        return EOF_CHAR
+
+    def reset(self):
+        self._nMarkers = 0
+        self._markerOffset = 0
+        self._numToConsume = 0
+
+    def syncConsume(self):
+        if self._numToConsume:
+            if self._nMarkers > 0:
+                # guess mode -- leave leading characters and bump offset.
+                self._markerOffset += self._numToConsume
+            else:
+                # normal mode -- advance the cursor
+                self._cursor += self._numToConsume
+            self._numToConsume = 0
+
+
 class LexerSharedInputState(object):
     """ LexerSharedInputState """
     def __init__(self, in_buf):
@@ -1225,10 +1327,7 @@ class StringBuffer(object):
             assert (a + length) <= len(self._text)
             b = a + length
             L = self._text[a:b]
-        s = ""
-        for x in L:
-            s += x
-        return s
+        return "".join(L)
 
     toString = getString   # alias
 
@@ -1317,7 +1416,15 @@ class CharScanner(TokenStream):
             self.filename = arg1
             return
 
-        # case 3:
+        # case 3a:
+        # if arg1 is a text stream (a StringIO or a file opened in text mode)
+        # read it in one go and index the text with a cursor,
+        # rather than pulling it through a char buffer one char at a time.
+        if isinstance(arg1, TextIOBase):
+            self.setInput(StringCharBuffer.fromStream(arg1))
+            return
+
+        # case 3b:
         # if arg1 is a file we wrap it by a char buffer (
         # some additional checks?? No, can't do this in
         # general).
@@ -0,0 +1,586 @@
+# [The "BSD licence"]
+# Copyright (c) 2003-2006 Terence Parr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. The name of the author may not be used to endorse or promote products
+#    derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+from builtins import object
+import hashlib
+import io
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import stringtemplate3
+from stringtemplate3.errors import StringTemplateErrorListener
+
+__all__ = ['LRUCache', 'NegativeCache', 'AccessorCache', 'DirectoryIndex', 'CompileCache',
+           'dumpCompiled', 'loadCompiled']
+
+logger = logging.getLogger(__name__)
+
+# Kinds of compiled units kept in a compile cache.
+GROUP_FILE = 'group'
+TEMPLATE_FILE = 'template'
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe mapping that forgets its least recently used
+    entries once it holds more than maxSize of them.
+    It counts lookups so the benefit of caching can be measured.
+    """
+
+    def __init__(self, maxSize=4096):
+        self._maxSize = maxSize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def maxSize(self):
+        return self._maxSize
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def hitRate(self):
+        """ The fraction of lookups answered from the cache. """
+        lookups = self._hits + self._misses
+        if lookups == 0:
+            return 0.0
+        return self._hits / lookups
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxSize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hits = 0
+            self._misses = 0
+
+
+class NegativeCache(LRUCache):
+    """
+    Remember keys that were looked up and not found, so the lookup is
+    not repeated: a bounded LRUCache whose entries carry a stamp
+    (anything comparable with ==) that must still match when checked,
+    and optionally expire after ttl seconds.
+    """
+
+    def __init__(self, maxSize=1024, ttl=None):
+        super().__init__(maxSize)
+        self._ttl = ttl
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def remember(self, key, stamp=None):
+        expiry = None if self._ttl is None else time.monotonic() + self._ttl
+        self.put(key, (stamp, expiry))
+
+    def isMissing(self, key, stamp=None):
+        """ Was key remembered as missing with this stamp, not long ago enough to expire? """
+        entry = self.get(key, None)
+        if entry is None:
+            return False
+        rememberedStamp, expiry = entry
+        if rememberedStamp != stamp or (expiry is not None and time.monotonic() >= expiry):
+            self.discard(key)
+            return False
+        return True
+
+
+# Parsed actions shared by every template; see StringTemplate.parseAction.
+#  Maps (template lexer class, action text) to (tree, options).
+ACTION_CACHE = LRUCache(maxSize=4096)
+
+
+class AccessorCache(object):
+    """
+    Remember how ASTExpr.getObjectProperty reads a property from
+    instances of a class: an Aggregate or dict lookup, a template
+    attribute, a getProp()/isProp() method or the prop attribute.
+    Entries are keyed by (class, property name) and chosen by looking
+    at the class, so a class that gains or loses accessors at run time
+    must be invalidated, and a class whose instances differ must be
+    excluded.
+    """
+
+    def __init__(self, maxSize=4096):
+        self._maxSize = maxSize
+        self._entries = {}
+        self._excluded = set()
+        self._lock = threading.Lock()
+
+    @property
+    def maxSize(self):
+        return self._maxSize
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def put(self, key, accessor):
+        """ Remember accessor for key, a (class, property name) pair, unless the class is excluded. """
+        with self._lock:
+            if key[0] in self._excluded:
+                return
+            if len(self._entries) >= self._maxSize:
+                self._entries.clear()
+            self._entries[key] = accessor
+
+    def invalidate(self, cls=None):
+        """ Forget the accessors of cls and its subclasses, or of every class. """
+        with self._lock:
+            if cls is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if issubclass(key[0], cls)]:
+                del self._entries[key]
+
+    def exclude(self, cls):
+        """ Never remember accessors for cls; look its properties up every time. """
+        with self._lock:
+            self._excluded.add(cls)
+        self.invalidate(cls)
+
+
+# Property accessors shared by every template; see ASTExpr.getObjectProperty.
+PROPERTY_ACCESSORS = AccessorCache(maxSize=4096)
+
+
+class DirectoryIndex(object):
+    """
+    Answer "is there a template, group or interface file at this path?"
+    from one os.scandir listing per directory instead of a stat per lookup.
+
+    Directories are listed the first time they are asked about, or all at
+    once with scan(root).  Only files with the SUFFIXES are indexed; other
+    paths are checked on the disk.  refresh() stats each listed directory
+    and lists again only those that changed.
+
+    The listings under a root can be saved with writeManifest, say at
+    deploy time, and read back with fromManifest so no directory is
+    listed at all.
+
+    Register an index for all groups (and PathGroupLoaders) with
+    StringTemplateGroup.registerDirectoryIndex(DirectoryIndex()),
+    or set group.directoryIndex for a single group.
+    """
+
+    SUFFIXES = frozenset(['.st', '.stg', '.sti'])
+
+    # Bump whenever the layout of manifest files changes.
+    MANIFEST_FORMAT = 1
+
+    def __init__(self):
+        # directory -> (mtime in ns or None if missing, frozenset of file names)
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._listings)
+
+    def isFile(self, path):
+        path = Path(path)
+        if path.suffix not in self.SUFFIXES:
+            return path.is_file()
+        return path.name in self._listing(os.path.abspath(path.parent))[1]
+
+    def _listing(self, directory):
+        listing = self._listings.get(directory, None)
+        if listing is None:
+            listing = self._list(directory)
+            with self._lock:
+                self._listings[directory] = listing
+        return listing
+
+    def _list(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as entries:
+                names = frozenset(entry.name for entry in entries
+                                  if os.path.splitext(entry.name)[1] in self.SUFFIXES and
+                                  entry.is_file())
+        except OSError:
+            return None, frozenset()
+        return mtime, names
+
+    def scan(self, root):
+        """ List root and every directory beneath it now; return self. """
+        pending = [os.path.abspath(root)]
+        while pending:
+            directory = pending.pop()
+            listing = self._list(directory)
+            with self._lock:
+                self._listings[directory] = listing
+            try:
+                with os.scandir(directory) as entries:
+                    pending.extend(entry.path for entry in entries if entry.is_dir())
+            except OSError:
+                pass
+        return self
+
+    def refresh(self):
+        """ List again the directories that changed (or appeared, or vanished) since they were listed. """
+        for directory, (mtime, names) in list(self._listings.items()):
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                listing = self._list(directory)
+                with self._lock:
+                    self._listings[directory] = listing
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+
+    def writeManifest(self, path, root):
+        """
+        Save the listings of root and the directories beneath it,
+        relative to root, scanning any that were not listed yet.
+        """
+        root = os.path.abspath(root)
+        self.scan(root)
+        listings = {}
+        for directory, (mtime, names) in self._listings.items():
+            if directory == root or directory.startswith(root + os.sep):
+                relative = Path(os.path.relpath(directory, root)).as_posix()
+                listings[relative] = [mtime, sorted(names)]
+        manifest = {'format': self.MANIFEST_FORMAT, 'listings': listings}
+        with open(path, 'wt', encoding='utf-8') as stream:
+            json.dump(manifest, stream, indent=1, sort_keys=True)
+
+    @classmethod
+    def fromManifest(cls, path, root=None):
+        """
+        Make an index from a manifest written by writeManifest;
+        its listings are relative to root, by default the manifest's directory.
+        """
+        with open(path, 'rt', encoding='utf-8') as stream:
+            manifest = json.load(stream)
+        if manifest.get('format', None) != cls.MANIFEST_FORMAT:
+            raise ValueError(f'{path} is not a format {cls.MANIFEST_FORMAT} directory manifest')
+        root = os.path.abspath(Path(path).parent if root is None else root)
+        index = cls()
+        for relative, (mtime, names) in manifest['listings'].items():
+            directory = os.path.normpath(os.path.join(root, *relative.split('/')))
+            index._listings[directory] = (mtime, frozenset(names))
+        return index
+
+
+class ErrorCountingListener(StringTemplateErrorListener):
+    """
+    Forward errors and warnings to another listener, counting the errors.
+    Used while compiling so a unit that reported errors is never cached;
+    the errors would otherwise be silently lost on the next load.
+    """
+
+    def __init__(self, listener):
+        super().__init__()
+        self._listener = listener
+        self._errors = 0
+
+    @property
+    def listener(self):
+        return self._listener
+
+    @property
+    def errors(self):
+        return self._errors
+
+    def error(self, msg, e=None):
+        self._errors += 1
+        if self._listener is not None:
+            self._listener.error(msg, e)
+
+    def warning(self, msg):
+        if self._listener is not None:
+            self._listener.warning(msg)
+
+
+def referenceFor(group, obj):
+    """
+    Return how a compiled template for group refers to obj
+    when obj is not part of the compiled templates themselves:
+    the group being compiled, other groups, error listeners and the
+    module level sentinel templates.  Return None for anything else.
+    """
+    if obj is group:
+        return ('group',)
+    if isinstance(obj, stringtemplate3.StringTemplateGroup):
+        return ('namedGroup', obj.name, None if obj.root_dir is None else str(obj.root_dir))
+    if isinstance(obj, StringTemplateErrorListener) or obj is group.errorListener:
+        return ('listener',)
+    if obj is stringtemplate3.ASTExpr.MAP_KEY_VALUE:
+        return ('mapKeyValue',)
+    if obj is stringtemplate3.StringTemplateGroup.NOT_FOUND_ST:
+        return ('notFound',)
+    return None
+
+
+def resolveReference(group, reference):
+    """ Find the object a reference made by referenceFor stands for when loading into group. """
+    kind = reference[0]
+    if kind == 'group':
+        return group
+    if kind == 'namedGroup':
+        _, name, rootDir = reference
+        other = stringtemplate3.StringTemplateGroup.nameToGroupMap.get(name, None)
+        if other is None:
+            other = stringtemplate3.StringTemplateGroup(name=name, rootDir=rootDir)
+        return other
+    if kind == 'listener':
+        return group.errorListener
+    if kind == 'mapKeyValue':
+        return stringtemplate3.ASTExpr.MAP_KEY_VALUE
+    if kind == 'notFound':
+        return stringtemplate3.StringTemplateGroup.NOT_FOUND_ST
+    raise ValueError(f'unknown compiled reference {reference!r}')
+
+
+class _CompiledPickler(pickle.Pickler):
+    """
+    Pickle compiled templates without dragging their group along.
+    Objects outside the compiled templates are replaced by references
+    (see referenceFor) that are resolved again against the loading group.
+    """
+
+    def __init__(self, file, group):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._group = group
+
+    def persistent_id(self, obj):
+        return referenceFor(self._group, obj)
+
+
+# Builtins a compiled unit may hold; any other global outside
+#  stringtemplate3 in a pickle is refused, see _CompiledUnpickler.
+_LOADABLE_BUILTINS = frozenset(['dict', 'list', 'tuple', 'set', 'frozenset', 'object'])
+
+
+class _CompiledUnpickler(pickle.Unpickler):
+    """
+    Unpickle what _CompiledPickler wrote.  Only classes defined in a
+    stringtemplate3 module (which includes the antlr runtime) and the
+    builtin containers may be named, so a planted entry cannot run other
+    code.  Dotted names are refused: pickle would follow them through the
+    module's attributes, reaching whatever it imports.
+    """
+
+    def __init__(self, file, group):
+        super().__init__(file)
+        self._group = group
+
+    def find_class(self, module, name):
+        if '.' not in name and (
+                module == 'stringtemplate3' or module.startswith('stringtemplate3.') or
+                (module == 'builtins' and name in _LOADABLE_BUILTINS)):
+            cls = super().find_class(module, name)
+            if isinstance(cls, type) and cls.__module__ == module:
+                return cls
+        raise pickle.UnpicklingError(f'refusing to load {module}.{name} from compiled templates')
+
+    def persistent_load(self, pid):
+        try:
+            return resolveReference(self._group, pid)
+        except ValueError as ex:
+            raise pickle.UnpicklingError(str(ex))
+
+
+def dumpCompiled(group, obj):
+    """
+    Serialize compiled templates (or any structure holding them)
+    belonging to group.
+    """
+    buf = io.BytesIO()
+    _CompiledPickler(buf, group).dump(obj)
+    return buf.getvalue()
+
+
+def loadCompiled(group, data):
+    """
+    Rebuild the structure serialized by dumpCompiled,
+    binding the templates to group.
+    """
+    return _CompiledUnpickler(io.BytesIO(data), group).load()
+
+
+class CompileCache(object):
+    """
+    An opt-in, persistent, on-disk cache of compiled templates.
+
+    Lexing and parsing a template produces a list of chunks
+    (StringRef, NewlineRef, ASTExpr and ConditionalExpr trees)
+    along with the formal arguments, regions and, for group files, maps.
+    None of that depends on anything but the template source,
+    so it is stored here keyed by a hash of the source text,
+    the template lexer class and the library version.
+    A changed source, a different delimiter lexer or a new release
+    simply produces a different key.
+
+    Register a cache for all groups with
+    StringTemplateGroup.registerCompileCache(CompileCache(path)),
+    or set group.compileCache for a single group.
+    Units that reported errors while compiling are not cached.
+
+    Entries are pickles.  Loading refuses anything but stringtemplate3
+    classes and builtin containers, but the directory must still be
+    trusted: only the processes that render should be able to write it.
+    It is created readable by its owner only.
+    """
+
+    SUFFIX = '.stc'
+
+    # Bump whenever the pickled layout of compiled templates changes.
+    FORMAT = 7
+
+    def __init__(self, directory):
+        self._directory = Path(directory)
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def key(self, kind, name, source, lexerClass):
+        digest = hashlib.sha256()
+        for part in (kind,
+                     stringtemplate3.__version__,
+                     str(self.FORMAT),
+                     f'{lexerClass.__module__}.{lexerClass.__qualname__}',
+                     name or ''):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        digest.update(source.encode('utf-8'))
+        return digest.hexdigest()
+
+    def pathFor(self, key):
+        return self._directory / (key + self.SUFFIX)
+
+    def load(self, group, kind, name, source, lexerClass):
+        """
+        Return the compiled unit stored for this source, bound to group,
+        or None if it is not in the cache (or cannot be read back).
+        """
+        path = self.pathFor(self.key(kind, name, source, lexerClass))
+        try:
+            with open(path, 'rb') as stream:
+                data = stream.read()
+        except OSError:
+            self._misses += 1
+            return None
+
+        try:
+            unit = loadCompiled(group, data)
+        except Exception as ex:
+            logger.warning(f'ignoring unreadable compile cache entry {path}: {ex}')
+            self._misses += 1
+            return None
+
+        self._hits += 1
+        return unit
+
+    def store(self, group, kind, name, source, lexerClass, unit):
+        """
+        Save a compiled unit for this source.
+        The file is written under a temporary name and renamed into place,
+        so concurrent processes never see a partial entry.
+        Failing to write the cache is never fatal.
+        """
+        path = self.pathFor(self.key(kind, name, source, lexerClass))
+        try:
+            data = dumpCompiled(group, unit)
+            self._directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+            fd, tmpName = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as stream:
+                    stream.write(data)
+                os.replace(tmpName, path)
+            except BaseException:
+                os.unlink(tmpName)
+                raise
+        except Exception as ex:
+            logger.warning(f'could not write compile cache entry {path}: {ex}')
+            return False
+        return True
+
+    def clear(self):
+        """ Remove every entry from the cache directory. """
+        if not self._directory.is_dir():
+            return
+        for entry in self._directory.iterdir():
+            if entry.suffix == self.SUFFIX:
+                entry.unlink()
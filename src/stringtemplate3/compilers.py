@@ -0,0 +1,834 @@
+# [The "BSD licence"]
+# Copyright (c) 2003-2006 Terence Parr
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. The name of the author may not be used to endorse or promote products
+#    derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Compile a template group ahead of time into a plain Python module.
+
+The generated module builds the group's compiled templates directly,
+without lexing or parsing anything, and has one render function per
+template.  Each template's chunks are written by a generated function,
+and each action by a generated function computing its value, so
+rendering does no tree walking and shows up by template in profiles.
+Template names computed while rendering, as in <(name)()>, are
+evaluated by the interpreter.
+
+    python -m stringtemplate3.compilers templates.stg -o templates_st.py
+
+and then, at runtime:
+
+    import templates_st
+    text = templates_st.page(title="Hello")
+
+The module is tied to the stringtemplate3 release that generated it;
+importing it with another release raises ImportError.
+"""
+
+from builtins import str
+from builtins import object
+import argparse
+import copyreg
+import keyword
+import re
+import sys
+from pathlib import Path
+
+import stringtemplate3
+from stringtemplate3.caches import ErrorCountingListener, referenceFor, resolveReference
+from stringtemplate3.errors import DEFAULT_ERROR_LISTENER
+from stringtemplate3.groups import StringTemplateGroup, DEFAULT_EXTENSION
+from stringtemplate3.templates import (
+    StringTemplate, CompiledTemplate, EMPTY_COMPILED_TEMPLATE, getNextTemplateCounter
+)
+from stringtemplate3.language import ActionEvaluator, ActionCompiler
+from stringtemplate3.language.ActionEvaluator import (
+    APPLY, MULTI_APPLY, ARGS, INCLUDE, VALUE, TEMPLATE, FUNCTION,
+    SINGLEVALUEARG, LIST, ID, ASSIGN, COLON, NOT, PLUS, DOT,
+    LITERAL_first, LITERAL_rest, LITERAL_last, LITERAL_length,
+    LITERAL_strip, LITERAL_trunc, ANONYMOUS_TEMPLATE, STRING, INT,
+    DOTDOTDOT, anonymousTemplateArgument, anonymousTemplateExemplar,
+    anonymousTemplateToApply
+)
+from stringtemplate3.language.ActionCompiler import (
+    EXPRESSION_TYPES, writtenValue, setSoleArgument
+)
+from stringtemplate3.language.ASTExpr import ASTExpr
+from stringtemplate3.language.CatIterator import CatList
+from stringtemplate3.language.ConditionalExpr import ConditionalExpr
+from stringtemplate3.language.FormalArgument import UNKNOWN_ARGS
+from stringtemplate3.language.NewlineRef import NewlineRef
+from stringtemplate3.language.StringRef import StringRef
+from stringtemplate3.language.StringTemplateAST import StringTemplateAST
+
+# Bump whenever generated modules need different support below.
+MODULE_FORMAT = 1
+
+# Module level objects generated code refers to rather than copies.
+CONSTANTS = {
+    id(UNKNOWN_ARGS): '_st.UNKNOWN_ARGS',
+    id(EMPTY_COMPILED_TEMPLATE): '_st.EMPTY_COMPILED_TEMPLATE',
+}
+
+FUNCTION_NAMES = {
+    LITERAL_first: 'first',
+    LITERAL_rest: 'rest',
+    LITERAL_last: 'last',
+    LITERAL_length: 'length',
+    LITERAL_strip: 'strip',
+    LITERAL_trunc: 'trunc',
+}
+
+# Names every generated module defines itself.
+RESERVED_NAMES = frozenset(['group', 'render', 'NAME', 'FORMAT', 'VERSION'])
+
+SCALAR_TYPES = (type(None), bool, int, float, str, bytes)
+
+
+# ----------------------------------------------------------------------------
+#                 S u p p o r t  f o r  g e n e r a t e d  c o d e
+# ----------------------------------------------------------------------------
+
+def checkCompatible(format_, version):
+    """ Refuse to load a module generated for other support code. """
+    if format_ != MODULE_FORMAT or version != stringtemplate3.__version__:
+        raise ImportError(
+            f'template module was generated by stringtemplate3 {version}'
+            f' (format {format_}); regenerate it for {stringtemplate3.__version__}'
+        )
+
+
+def newGroup(name, lexer, lineSeparator):
+    """
+    Make the group a generated module fills in.
+    Like a group file, it never looks for templates on disk, and its
+    actions are evaluated by the closure evaluator so the generated
+    functions attached to the trees are used.
+    """
+    group = StringTemplateGroup(name=name, lexer=lexer, lineSeparator=lineSeparator)
+    group._templatesDefinedInGroupFile = True
+    group.actionEvaluatorClass = ActionCompiler.Evaluator
+    return group
+
+
+def new(cls):
+    return cls.__new__(cls)
+
+
+def build(obj, state):
+    """ Give an object made by new its state, as unpickling does. """
+    setstate = getattr(type(obj), '__setstate__', None)
+    if setstate is not None:
+        setstate(obj, state)
+        return
+
+    slotState = None
+    if isinstance(state, tuple) and len(state) == 2:
+        state, slotState = state
+    if state:
+        obj.__dict__.update(state)
+    if slotState:
+        for name, value in slotState.items():
+            setattr(obj, name, value)
+
+
+def renumber(templates):
+    """ Give templates built by a generated module their own template IDs. """
+    for st in templates:
+        st._templateID = getNextTemplateCounter()
+
+
+def install(group, templates, maps, interfaces=()):
+    """ Add the templates and maps built by a generated module to its group. """
+    for interfaceName in interfaces:
+        group.implementInterface(interfaceName)
+    group._addTemplates(templates)
+    group._maps.update(maps)
+    group.verifyInterfaceImplementations()
+
+
+def interpret(this, chunk, out, node):
+    """ Evaluate an expression the generated code leaves to the tree walker. """
+    walker = ActionEvaluator.Walker()
+    walker.initialize(this, chunk, out)
+    return walker.expr(node)
+
+
+def embeddedInstance(this, name, args):
+    """ The instance of template name to apply, with its arguments to evaluate, or None. """
+    embedded = this.group.getEmbeddedInstanceOf(name, this)
+    if embedded:
+        embedded._argumentsAST = args
+        return embedded
+    return None
+
+
+def anonymousInstance(this, node):
+    """ The anonymous template {...} to apply. """
+    # to properly see overridden templates, always set
+    # anonymous' group to be this group
+    return anonymousTemplateToApply(this, node.stringTemplate)
+
+
+def templatesToApply(*templates):
+    return [t for t in templates if t is not None]
+
+
+def catList(*values):
+    return CatList([v for v in values if v is not None])
+
+
+# ----------------------------------------------------------------------------
+#                       C o d e  g e n e r a t i o n
+# ----------------------------------------------------------------------------
+
+class _CannotGenerate(Exception):
+    """ The tree is not shaped the way the generator expects. """
+    pass
+
+
+def _identifier(name):
+    """ A Python identifier resembling a template name. """
+    ident = re.sub(r'[\W_]+', '_', name or '').strip('_')
+    if not ident:
+        ident = 'anonymous'
+    if ident[0].isdigit():
+        ident = '_' + ident
+    return ident
+
+
+class GroupModuleCompiler(object):
+    """
+    Generate the source of a Python module rebuilding a loaded group.
+
+    The compiled templates and maps are reproduced object by object,
+    the way they would be pickled, and the generated functions are
+    attached to them: CompiledTemplate.writeChunks for the chunks and
+    StringTemplateAST.closure for actions, conditions and arguments.
+    """
+
+    def __init__(self, group, superGroupModule=None, source=None):
+        self._group = group
+        self._superGroupModule = superGroupModule
+        self._source = source
+        self._names = {}
+        self._objects = []
+        self._states = {}
+        self._refCounts = {}
+        self._references = {}
+        self._classes = {}
+        self._usedNames = set(RESERVED_NAMES)
+        self._templateNames = {}
+        self._generated = set()
+        self._functions = []
+        self._attachments = []
+
+    @property
+    def group(self):
+        return self._group
+
+    def ownTemplates(self):
+        """ The templates defined by the group itself, by name. """
+        group = self._group
+        group.compileDeferredTemplates()
+        templates = {}
+        for name, st in group.templates.items():
+            if st is None or st is StringTemplateGroup.NOT_FOUND_ST:
+                continue
+            if st.nativeGroup is not None and st.nativeGroup is not group:
+                # copied down from a super group by a lookup
+                continue
+            templates[name] = st
+        return templates
+
+    def compile(self):
+        """ Return the source of the module. """
+        templates = self.ownTemplates()
+        maps = dict(self._group.maps)
+        self._precompileAnonymousArguments((templates, maps))
+        self._collect((templates, maps))
+
+        for obj in self._objects:
+            if id(obj) in self._states:
+                self._nameOf(obj)
+            if isinstance(obj, StringTemplate):
+                self._templateNames.setdefault(id(obj.compiled), obj.name)
+        for obj in self._objects:
+            if isinstance(obj, CompiledTemplate) and obj.chunks:
+                self._generateWriter(obj)
+
+        return self._module(templates, maps)
+
+    # ---------------------------------------------------------------- objects
+
+    def _reduce(self, obj):
+        """ The class and state of obj, as pickle would see them. """
+        try:
+            rv = obj.__reduce_ex__(4)
+        except TypeError as ex:
+            raise TypeError(f'cannot compile {obj!r} into a module: {ex}')
+        if not (isinstance(rv, tuple) and len(rv) >= 3 and
+                rv[0] is copyreg.__newobj__ and rv[1] == (type(obj),) and
+                all(extra is None for extra in rv[3:])):
+            raise TypeError(f'cannot compile {obj!r} into a module')
+        return rv[2]
+
+    def _children(self, obj):
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            return list(obj)
+        if isinstance(obj, dict):
+            children = []
+            for key, value in obj.items():
+                children.append(key)
+                children.append(value)
+            return children
+        return [self._states[id(obj)]]
+
+    def _isLeaf(self, obj):
+        return (isinstance(obj, SCALAR_TYPES) or isinstance(obj, type) or
+                id(obj) in CONSTANTS or referenceFor(self._group, obj) is not None)
+
+    def _collect(self, root):
+        """ Find every object reachable from root, counting references to each. """
+        self._objects = []
+        self._states = {}
+        self._refCounts = {}
+        stack = [root]
+        while stack:
+            obj = stack.pop()
+            if self._isLeaf(obj):
+                continue
+            key = id(obj)
+            if key in self._refCounts:
+                self._refCounts[key] += 1
+                continue
+            self._refCounts[key] = 1
+            self._objects.append(obj)
+            if isinstance(obj, (list, tuple, set, frozenset, dict)):
+                stack.extend(reversed(self._children(obj)))
+            else:
+                # the state is often made afresh; keeping it here
+                # also keeps its id from being reused
+                self._states[key] = self._reduce(obj)
+                stack.append(self._states[key])
+
+    def _precompileAnonymousArguments(self, root):
+        """
+        Compile the {...} templates passed as argument values now;
+        otherwise they would be compiled by the first render.
+        """
+        while True:
+            self._collect(root)
+            pending = [obj for obj in self._objects
+                       if isinstance(obj, StringTemplateAST) and
+                       obj.type == ANONYMOUS_TEMPLATE and obj.text and
+                       obj.stringTemplate is None]
+            if not pending:
+                return
+            for node in pending:
+                anonymousTemplateExemplar(self._group, node)
+
+    def _isNamed(self, obj):
+        if isinstance(obj, (list, tuple, set, frozenset, dict)):
+            return self._refCounts.get(id(obj), 0) > 1
+        return True
+
+    def _nameOf(self, obj):
+        key = id(obj)
+        name = self._names.get(key, None)
+        if name is None:
+            name = f'_o{len(self._names)}'
+            self._names[key] = name
+        return name
+
+    def _classOf(self, cls):
+        name = self._classes.get(cls, None)
+        if name is None:
+            name = f'_c{len(self._classes)}'
+            self._classes[cls] = name
+        return name
+
+    def _referenceOf(self, reference):
+        if reference == ('group',):
+            return 'group'
+        name = self._references.get(reference, None)
+        if name is None:
+            name = f'_r{len(self._references)}'
+            self._references[reference] = name
+        return name
+
+    def _value(self, obj):
+        """ A Python expression for obj inside the generated module. """
+        if isinstance(obj, SCALAR_TYPES):
+            return repr(obj)
+        if id(obj) in CONSTANTS:
+            return CONSTANTS[id(obj)]
+        if isinstance(obj, type):
+            return self._classOf(obj)
+        reference = referenceFor(self._group, obj)
+        if reference is not None:
+            return self._referenceOf(reference)
+        if self._isNamed(obj):
+            return self._nameOf(obj)
+        return self._literal(obj)
+
+    def _literal(self, obj):
+        if isinstance(obj, list):
+            return '[' + ', '.join(self._value(item) for item in obj) + ']'
+        if isinstance(obj, tuple):
+            if len(obj) == 1:
+                return '(' + self._value(obj[0]) + ',)'
+            return '(' + ', '.join(self._value(item) for item in obj) + ')'
+        if isinstance(obj, frozenset):
+            return 'frozenset(' + self._literal(set(obj)) + ')'
+        if isinstance(obj, set):
+            if not obj:
+                return 'set()'
+            return '{' + ', '.join(self._value(item) for item in obj) + '}'
+        if isinstance(obj, dict):
+            return '{' + ', '.join(self._value(key) + ': ' + self._value(value)
+                                   for key, value in obj.items()) + '}'
+        raise TypeError(f'cannot compile {obj!r} into a module')
+
+    def _containerLines(self):
+        """ Statements making the containers referred to more than once, innermost first. """
+        lines = []
+        done = set()
+
+        def emit(container):
+            if id(container) in done:
+                return
+            done.add(id(container))
+            for child in self._children(container):
+                if (isinstance(child, (list, tuple, set, frozenset, dict)) and
+                        not self._isLeaf(child) and self._isNamed(child)):
+                    emit(child)
+            lines.append(f'{self._nameOf(container)} = {self._literal(container)}')
+
+        for obj in self._objects:
+            if (isinstance(obj, (list, tuple, set, frozenset, dict)) and
+                    id(obj) not in self._states and self._isNamed(obj)):
+                emit(obj)
+        return lines
+
+    # -------------------------------------------------------------- functions
+
+    def _function(self, base, parameters, body):
+        """ Add a generated function made of the lines of body; return its name. """
+        name = '_' + base
+        suffix = 0
+        # steer clear of the names given to objects, classes and references
+        while name in self._usedNames or re.fullmatch(r'_[ocr]\d+', name):
+            suffix += 1
+            name = f'_{base}_{suffix}'
+        self._usedNames.add(name)
+        self._functions.append(f'def {name}({parameters}):\n' + ''.join(f'    {line}\n' for line in body))
+        return name
+
+    def _generateWriter(self, compiled):
+        """ Generate compiled.writeChunks, and functions for the chunks' actions. """
+        templateName = _identifier(self._templateNames.get(id(compiled), None))
+        chunks = compiled.chunks
+
+        def canSkipNext(i):
+            # see StringTemplate.write: an expression with no output
+            # swallows the newline after it when alone on its line
+            return (0 <= i and i + 1 < len(chunks) and
+                    isinstance(chunks[i + 1], NewlineRef) and
+                    (i == 0 or isinstance(chunks[i - 1], NewlineRef)))
+
+        body = ['n = 0']
+        for i, chunk in enumerate(chunks):
+            if chunk is None:
+                write = '0'
+            elif type(chunk) in (StringRef, NewlineRef):
+                write = '0' if chunk._str is None else f'out.write({chunk._str!r})'
+            else:
+                self._generateActions(templateName, chunk)
+                write = f'{self._nameOf(chunk)}.write(this, out)'
+
+            if canSkipNext(i):
+                lines = [f'chunkN = {write}', 'n += chunkN', 'skip = not chunkN']
+            else:
+                lines = [f'n += {write}']
+            if canSkipNext(i - 1):
+                body.append('if skip:')
+                body.append('    skip = False')
+                body.append('else:')
+                body.extend('    ' + line for line in lines)
+            else:
+                body.extend(lines)
+        body.append('return n')
+
+        writer = self._function(f'write_{templateName}', 'this, out', body)
+        self._attachments.append(f'{self._nameOf(compiled)}.writeChunks = {writer}')
+
+    def _generateActions(self, templateName, chunk):
+        if isinstance(chunk, ConditionalExpr):
+            if chunk.AST is not None:
+                self._generateCondition(templateName, chunk.AST.firstChild)
+            for clause in chunk._elseIfSubtemplates or ():
+                self._generateCondition(templateName, clause.expr.AST)
+        elif isinstance(chunk, ASTExpr):
+            self._generateAction(templateName, chunk.AST)
+        else:
+            return
+        for option in (chunk._options or {}).values():
+            if isinstance(option, StringTemplateAST):
+                self._generateAction(templateName, option)
+
+    def _attach(self, node, function):
+        self._attachments.append(f'{self._nameOf(node)}.closure = {function}')
+
+    def _generateAction(self, templateName, node):
+        if node is None or id(node) in self._generated or node.type not in EXPRESSION_TYPES:
+            return
+        self._generated.add(id(node))
+        body = [f'return {self._expression(templateName, node)}']
+        self._attach(node, self._function(templateName, 'this, chunk, out', body))
+
+    def _generateCondition(self, templateName, node):
+        if node is None:
+            return
+        if node.type != NOT:
+            self._generateAction(templateName, node)
+            return
+        if node.firstChild is None or id(node) in self._generated:
+            return
+        self._generated.add(id(node))
+        body = [f'return not chunk.testAttributeTrue({self._expression(templateName, node.firstChild)})']
+        self._attach(node, self._function(f'{templateName}_if', 'this, chunk, out', body))
+
+    def _generateArguments(self, templateName, node):
+        """ Generate the function filling in argument values for node; return node's name. """
+        if id(node) in self._generated:
+            return self._nameOf(node)
+        self._generated.add(id(node))
+        if node.type == ARGS:
+            body = []
+            child = node.firstChild
+            while child is not None and child.type in (ASSIGN, DOTDOTDOT):
+                if child.type == DOTDOTDOT:
+                    body.append('embedded._passThroughAttributes = True')
+                else:
+                    arg = child.firstChild
+                    if arg is None or arg.type != ID:
+                        return self._nameOf(node)
+                    body.append(f'e = {self._expression(templateName, arg.nextSibling)}')
+                    body.append('if e:')
+                    body.append(f'    this.rawSetArgumentAttribute(embedded, argumentContext, {arg.text!r}, e)')
+                child = child.nextSibling
+        elif node.type == SINGLEVALUEARG:
+            value = self._expression(templateName, node.firstChild)
+            body = [f'_st.setSoleArgument(this, embedded, argumentContext, {value})']
+        else:
+            return self._nameOf(node)
+
+        body.append('return argumentContext')
+        parameters = 'this, chunk, out, embedded, argumentContext'
+        self._attach(node, self._function(f'{templateName}_args', parameters, body))
+        return self._nameOf(node)
+
+    def _expression(self, templateName, node):
+        """ Python source computing the value of the expression rooted at node. """
+        if node is not None:
+            try:
+                return self._expressionOf(templateName, node)
+            except _CannotGenerate:
+                return f'_st.interpret(this, chunk, out, {self._nameOf(node)})'
+        return '_st.interpret(this, chunk, out, None)'
+
+    def _expressionOf(self, templateName, node):
+        nodeType = node.type
+        first = node.firstChild
+
+        if nodeType == ID:
+            return f'this.getAttribute({node.text!r})'
+
+        if nodeType == STRING:
+            return repr(node.text)
+
+        if nodeType == INT:
+            try:
+                return repr(int(node.text))
+            except (TypeError, ValueError):
+                raise _CannotGenerate()
+
+        if nodeType == ANONYMOUS_TEMPLATE:
+            if not node.text:
+                return repr(node.text)
+            return f'_st.anonymousTemplateArgument(this, {self._nameOf(node)})'
+
+        if nodeType == PLUS:
+            if first is None or first.nextSibling is None:
+                raise _CannotGenerate()
+            left = self._expression(templateName, first)
+            right = self._expression(templateName, first.nextSibling)
+            return f'chunk.add({left}, {right})'
+
+        if nodeType == DOT:
+            if first is None or first.nextSibling is None:
+                raise _CannotGenerate()
+            obj = self._expression(templateName, first)
+            prop = first.nextSibling
+            if prop.type == ID:
+                return f'chunk.getObjectProperty(this, {obj}, {prop.text!r})'
+            if prop.type == VALUE:
+                propName = self._expression(templateName, prop.firstChild)
+                return f'chunk.getObjectProperty(this, {obj}, {propName})'
+            raise _CannotGenerate()
+
+        if nodeType == APPLY:
+            if first is None:
+                raise _CannotGenerate()
+            attribute = self._expression(templateName, first)
+            templates = []
+            t = first.nextSibling
+            while t is not None and t.type == TEMPLATE:
+                templates.append(self._templateToApply(templateName, t))
+                t = t.nextSibling
+            if not templates:
+                raise _CannotGenerate()
+            return (f'chunk.applyListOfAlternatingTemplates(this, {attribute}, '
+                    f'_st.templatesToApply({", ".join(templates)}))')
+
+        if nodeType == MULTI_APPLY:
+            attributes = []
+            child = first
+            while child is not None and child.type in EXPRESSION_TYPES:
+                attributes.append(self._expression(templateName, child))
+                child = child.nextSibling
+            if not attributes or child is None or child.type != COLON:
+                raise _CannotGenerate()
+            anon = child.nextSibling
+            if anon is None or anon.type != ANONYMOUS_TEMPLATE:
+                raise _CannotGenerate()
+            return (f'chunk.applyTemplateToListOfAttributes(this, [{", ".join(attributes)}], '
+                    f'{self._nameOf(anon)}.stringTemplate)')
+
+        if nodeType == INCLUDE:
+            # <(name)()> names the template while rendering; leave that to the interpreter
+            if first is None or first.type != ID or first.nextSibling is None:
+                raise _CannotGenerate()
+            if not first.text:
+                return 'None'
+            args = self._generateArguments(templateName, first.nextSibling)
+            return f'chunk.getTemplateInclude(this, {first.text!r}, {args})'
+
+        if nodeType == FUNCTION:
+            if first is None or first.type not in FUNCTION_NAMES:
+                raise _CannotGenerate()
+            arg = first.nextSibling
+            if arg is None or arg.type != SINGLEVALUEARG:
+                raise _CannotGenerate()
+            value = self._expression(templateName, arg.firstChild)
+            return f'chunk.{FUNCTION_NAMES[first.type]}({value})'
+
+        if nodeType == LIST:
+            elements = []
+            child = first
+            while child is not None and child.type in EXPRESSION_TYPES:
+                elements.append(self._expression(templateName, child))
+                child = child.nextSibling
+            if not elements or child is not None:
+                # <[a, , b]> and the like are left to the interpreter
+                raise _CannotGenerate()
+            return f'_st.catList({", ".join(elements)})'
+
+        if nodeType == VALUE:
+            if first is None:
+                raise _CannotGenerate()
+            return f'_st.writtenValue(this, chunk, {self._expression(templateName, first)})'
+
+        raise _CannotGenerate()
+
+    def _templateToApply(self, templateName, node):
+        child = node.firstChild
+        if child is None:
+            raise _CannotGenerate()
+        if child.type == ID:
+            if child.nextSibling is None:
+                raise _CannotGenerate()
+            args = self._generateArguments(templateName, child.nextSibling)
+            return f'_st.embeddedInstance(this, {child.text!r}, {args})'
+        if child.type == ANONYMOUS_TEMPLATE:
+            return f'_st.anonymousInstance(this, {self._nameOf(child)})'
+        # <x:(name)()> names the template while rendering; leave that to the interpreter
+        raise _CannotGenerate()
+
+    # ----------------------------------------------------------------- module
+
+    def _module(self, templates, maps):
+        group = self._group
+        lexer = self._value(group.templateLexerClass)
+
+        # build statements; these decide the names used below
+        creates = []
+        builds = []
+        exemplars = []
+        for obj in self._objects:
+            key = id(obj)
+            if key not in self._states:
+                continue
+            name = self._nameOf(obj)
+            creates.append(f'{name} = _st.new({self._classOf(type(obj))})')
+            builds.append(f'_st.build({name}, {self._value(self._states[key])})')
+            if isinstance(obj, StringTemplate):
+                exemplars.append(name)
+        containers = self._containerLines()
+        templatesValue = self._literal(templates)
+        mapsValue = self._literal(maps)
+
+        lines = [
+            f'# Generated by stringtemplate3.compilers from {self._source or group.name}; do not edit.',
+            '"""',
+            f'Templates of group {group.name}.',
+            '',
+            'render(name, attributes) renders any template; each template also has',
+            'a function of its own taking its attributes as keyword arguments.',
+            '"""',
+            '',
+            'from stringtemplate3 import compilers as _st',
+        ]
+        for cls, name in self._classes.items():
+            outer, _, inner = cls.__qualname__.partition('.')
+            lines.append(f'from {cls.__module__} import {outer} as {name}')
+            if inner:
+                lines.append(f'{name} = {name}.{inner}')
+        if self._superGroupModule is not None:
+            lines.append(f'import {self._superGroupModule} as _super')
+        lines += [
+            '',
+            f'NAME = {group.name!r}',
+            f'FORMAT = {MODULE_FORMAT!r}',
+            f'VERSION = {stringtemplate3.__version__!r}',
+            '',
+            '_st.checkCompatible(FORMAT, VERSION)',
+            '',
+            f'group = _st.newGroup(NAME, {lexer}, {group._lineSeparator!r})',
+        ]
+        if group.superGroup is not None:
+            if self._superGroupModule is not None:
+                lines.append('group.superGroup = _super.group')
+            else:
+                lines.append(f'group.superGroup = {group.superGroup.name!r}')
+        for reference, name in self._references.items():
+            lines.append(f'{name} = _st.resolveReference(group, {reference!r})')
+        lines.append('')
+        lines += creates
+        lines += containers
+        lines += builds
+        lines.append(f'_st.renumber([{", ".join(exemplars)}])')
+        lines.append('')
+
+        for function in self._functions:
+            lines.append('')
+            lines.append(function)
+        lines += self._attachments
+        lines += [
+            '',
+            f'_st.install(group, {templatesValue}, {mapsValue}, '
+            f'{[interface.name for interface in group._interfaces]!r})',
+            '',
+            '',
+            'def render(name, attributes=None):',
+            '    """ Render template name with the given attribute values. """',
+            '    st = group.getInstanceOf(name)',
+            '    for attribute, value in (attributes or {}).items():',
+            '        st[attribute] = value',
+            '    return str(st)',
+        ]
+
+        for name in sorted(templates):
+            function = _identifier(name)
+            while (function in self._usedNames or keyword.iskeyword(function) or
+                   function in ('str', '_st', '_super')):
+                function += '_'
+            self._usedNames.add(function)
+            lines += [
+                '',
+                '',
+                f'def {function}(**attributes):',
+                f'    return render({name!r}, attributes)',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+def loadGroupToCompile(path, lexer=None, errors=None):
+    """
+    Load the group to compile: a group file,
+    or a directory whose .st files (and subdirectories) are its templates.
+    """
+    path = Path(path)
+    if path.is_dir():
+        group = StringTemplateGroup(name=path.name, rootDir=str(path), lexer=lexer, errors=errors)
+        for templatePath in sorted(path.rglob('*' + DEFAULT_EXTENSION)):
+            fileName = templatePath.relative_to(path).as_posix()
+            group.lookupTemplate(group.getTemplateNameFromFileName(fileName))
+        return group
+
+    with open(path, 'rt', encoding='utf-8', newline='') as stream:
+        return StringTemplateGroup(file=stream, lexer=lexer, errors=errors)
+
+
+def compileGroup(group, superGroupModule=None, source=None):
+    """
+    Return the source of a Python module rebuilding group.
+    superGroupModule names the generated module of its super group, if any;
+    otherwise the super group is found by name when the module is imported.
+    """
+    return GroupModuleCompiler(group, superGroupModule, source).compile()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m stringtemplate3.compilers',
+        description='Compile a template group file or directory into a Python module.')
+    parser.add_argument('group', help='a .stg group file or a directory of .st templates')
+    parser.add_argument('-o', '--output', help='the module to write; default is standard output')
+    parser.add_argument('--lexer', choices=['default', 'angle-bracket'],
+                        help='template delimiters; default depends on the kind of group')
+    parser.add_argument('--super-module', dest='superGroupModule',
+                        help='the generated module of the super group')
+    args = parser.parse_args(argv)
+
+    errors = ErrorCountingListener(DEFAULT_ERROR_LISTENER)
+    group = loadGroupToCompile(args.group, lexer=args.lexer, errors=errors)
+    compiler = GroupModuleCompiler(group, args.superGroupModule, Path(args.group).name)
+    source = compiler.compile()
+    if errors.errors:
+        sys.stderr.write(f'{args.group}: {errors.errors} error(s); no module written\n')
+        return 1
+
+    if args.output is None:
+        sys.stdout.write(source)
+    else:
+        with open(args.output, 'wt', encoding='utf-8') as stream:
+            stream.write(source)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -74,10 +74,12 @@ class PathGroupLoader(StringTemplateGroupLoader):
     You may specify the char encoding.
     """
 
-    def __init__(self, dirs=None, errors=None):
+    def __init__(self, dirs=None, errors=None, directoryIndex=None):
         """
         Pass a single dir or multiple dirs separated by colons from which
         to load groups/interfaces.
+        Files are looked for in directoryIndex if given, otherwise in the
+        index registered for all groups, if any, otherwise on the disk.
         """
         super().__init__()
 
@@ -92,6 +94,7 @@ class PathGroupLoader(StringTemplateGroupLoader):
         else:
             self._dirs = [dirs]
         self._errors = errors
+        self._directoryIndex = directoryIndex
 
         # # How are the files encoded (ascii, UTF8, ...)?
         #  You might want to read UTF8 for example on an ascii machine.
@@ -145,15 +148,26 @@ class PathGroupLoader(StringTemplateGroupLoader):
         Look in each directory for the file called 'name'.
         Return the decoded stream.
         """
+        index = self.directoryIndex
         for adir in self._dirs:
             path = Path(adir, name)
-            if path.is_file():
+            if path.is_file() if index is None else index.isFile(path):
                 stream = open(path, 'rt', encoding="utf-8", newline='')
                 return stream
                 # return decodeFile(stream, path, self.fileCharEncoding)
 
         return None
 
+    @property
+    def directoryIndex(self):
+        if self._directoryIndex is not None:
+            return self._directoryIndex
+        return StringTemplateGroup._directoryIndex
+
+    @directoryIndex.setter
+    def directoryIndex(self, index):
+        self._directoryIndex = index
+
     @property
     def fileCharEncoding(self):
         return self._file_char_encoding
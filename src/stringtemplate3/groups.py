@@ -26,15 +26,19 @@
 #
 
 import os
+import pickle
 from builtins import str
 from builtins import object
 import sys
+import threading
 import traceback
 import time
 from io import StringIO
 import logging
 from pathlib import Path
 
+from concurrent.futures import ThreadPoolExecutor
+
 from stringtemplate3 import antlr
 from stringtemplate3.utils import decodeFile
 
@@ -42,19 +46,31 @@ from stringtemplate3.language import (
     AngleBracketTemplateLexer,
     DefaultTemplateLexer,
     GroupLexer, GroupParser,
+    ActionEvaluator, ActionCompiler,
 )
 
 from stringtemplate3.errors import (
-    DEFAULT_ERROR_LISTENER
+    DEFAULT_ERROR_LISTENER, StringTemplateErrorListener
 )
 from stringtemplate3.templates import (
-    StringTemplate, REGION_IMPLICIT
+    StringTemplate, REGION_IMPLICIT, _NO_RENDERER, findRenderer
 )
-from stringtemplate3.writers import AutoIndentWriter
+from stringtemplate3.writers import AutoIndentWriter, MemoizingRenderer
 from stringtemplate3.interfaces import StringTemplateGroupInterface
+from stringtemplate3.caches import (
+    GROUP_FILE, TEMPLATE_FILE,
+    ErrorCountingListener, NegativeCache, dumpCompiled, loadCompiled
+)
 
 DEFAULT_EXTENSION = '.st'
 
+# The default refresh interval: templates are never reloaded from disk.
+NEVER_REFRESH = sys.maxsize // 1000
+
+# Groups built while a StringTemplateGroupHandle loads a version, in this
+#  thread; they are registered by name only when that version is swapped in.
+_heldRegistrations = threading.local()
+
 # # Used to indicate that the template doesn't exist.
 #  We don't have to check disk for it; we know it's not there.
 #  Set later to work around cyclic class definitions
@@ -85,6 +101,11 @@ class StringTemplateGroup(object):
 
     10/2005 I am adding a StringTemplateGroupLoader concept so people can
     define supergroups within a group and have it load that group automatically.
+
+    Once its templates are defined, a group may be rendered from many threads
+    at once: each render keeps its state on its own instances, never on the
+    templates the group shares.  Don't share an instance holding attributes
+    between renders running at the same time.
     """
 
     # Track all groups by name; maps name to StringTemplateGroup
@@ -94,17 +115,59 @@ class StringTemplateGroup(object):
     # Track all interfaces by name; maps name to StringTemplateGroupInterface
     nameToInterfaceMap = {}
 
+    # Guards nameToGroupMap and nameToInterfaceMap, so that a group or
+    #  interface looked up from several threads is only loaded once.
+    _registryLock = threading.RLock()
+
     # If a group file indicates it derives from a supergroup, how do we
     #  find it?  Shall we make it so the initial StringTemplateGroup file
     #  can be loaded via this loader?  Right now we pass a Reader to ctor
     #  to distinguish from the other variety.
     _groupLoader = None
 
+    # Where compiled templates are persisted between runs; None disables.
+    #  A group may override this by setting its compileCache property.
+    _compileCache = None
+
+    # Which files exist beneath the root directory and sys.path, listed
+    #  once per directory; None checks the disk on every lookup.
+    #  A group may override this by setting its directoryIndex property.
+    _directoryIndex = None
+
     # You can set the lexer once if you know all of your groups use the
     #  same separator.  If the instance has templateLexerClass set
     #  then it is used as an override.
     defaultTemplateLexerClass = DefaultTemplateLexer.Lexer
 
+    # How actions are evaluated: the tree walker, or the evaluator
+    #  that compiles each action tree into closures once.
+    #  If the instance has actionEvaluatorClass set then it is used as an override.
+    defaultActionEvaluatorClass = ActionEvaluator.Walker
+
+    # How many names of templates that could not be found a group remembers
+    #  (so it does not look for them again), and for how many seconds;
+    #  None remembers them until they are defined.
+    #  If the instance has missingTemplates set then it is used as an override.
+    defaultMissingTemplateCacheSize = 1024
+    defaultMissingTemplateTTL = None
+
+    # Whether templates in group files are compiled when first looked up
+    #  rather than when the group file is loaded.  Loading then only parses
+    #  template names, formal arguments and bodies; errors in a body are
+    #  reported when it is compiled.
+    defaultLazyCompilation = False
+
+    # An executor, say a concurrent.futures.ProcessPoolExecutor, compiling
+    #  the templates of group files with at least minParallelTemplates
+    #  templates in batches; None compiles them in this thread.
+    #  A group may override this by setting its compileExecutor property.
+    _compileExecutor = None
+    minParallelTemplates = 100
+
+    # Bumped whenever a renderer is registered or a super group set in any
+    #  group, which empties every group's resolved renderer cache.
+    _rendererGeneration = 0
+
     def __init__(self, name=None, rootDir=None, lexer=None, 
                  fileName=None, file=None, errors=None,
                  superGroup=None, lineSeparator=os.linesep):
@@ -114,9 +177,20 @@ class StringTemplateGroup(object):
         self._templates = {}
         self._maps = {}
         self._templateLexerClass = None
+        self._actionEvaluatorClass = None
         self._root_dir = None
         self._superGroup = None
 
+        # Guards loading templates into _templates while rendering.
+        self._lock = threading.RLock()
+
+        # Names looked up and not found here nor in a super group, and a
+        #  count of templates defined, which invalidates them in subgroups.
+        self._missingTemplates = NegativeCache(
+            StringTemplateGroup.defaultMissingTemplateCacheSize,
+            StringTemplateGroup.defaultMissingTemplateTTL)
+        self._definitions = 0
+
         # Keep track of all interfaces implemented by this group.
         self._interfaces = []
 
@@ -137,16 +211,26 @@ class StringTemplateGroup(object):
         self._noDebugStartStopStrings = None
 
         self._attributeRenderers = {}
+        # Renderer (or None) resolved for each class, valid while
+        #  _rendererCacheGeneration matches _rendererGeneration.
+        self._rendererCache = {}
+        self._rendererCacheGeneration = StringTemplateGroup._rendererGeneration
 
         if errors is not None:
             self._listener = errors
         else:
             self._listener = DEFAULT_ERROR_LISTENER
 
-        # How long before tossing out all templates in seconds.
+        # How long in seconds before checking the disk for edited templates.
         # default: no refreshing from disk
-        self._refreshInterval = sys.maxsize // 1000
+        self._refreshInterval = NEVER_REFRESH
         self._lastCheckedDisk = 0
+        # When the disk is next due to be checked; None while never.
+        self._nextDiskCheck = None
+
+        # The file each template was loaded from, with its modification time
+        #  and size when it was read; see checkRefreshInterval.
+        self._templateFiles = {}
 
         if name is not None:
             assert isinstance(name, str)
@@ -155,7 +239,7 @@ class StringTemplateGroup(object):
             assert rootDir is None or isinstance(rootDir, str) or isinstance(rootDir, Path)
             self._root_dir = rootDir
             self._lastCheckedDisk = time.time()
-            StringTemplateGroup.nameToGroupMap[self._name] = self
+            self._register()
 
             self.templateLexerClass = lexer
 
@@ -182,9 +266,18 @@ class StringTemplateGroup(object):
 
             self.parseGroup(file)
             assert self._name is not None
-            StringTemplateGroup.nameToGroupMap[self._name] = self
+            self._register()
             self.verifyInterfaceImplementations()
 
+    def _register(self):
+        """ Make this group the one found by its name, unless a handle is building a version. """
+        held = getattr(_heldRegistrations, 'groups', None)
+        if held is not None:
+            held.append(self)
+            return
+        with StringTemplateGroup._registryLock:
+            StringTemplateGroup.nameToGroupMap[self._name] = self
+
     @property
     def groupLoader(self):
         return StringTemplateGroup._groupLoader
@@ -193,6 +286,46 @@ class StringTemplateGroup(object):
     def groupLoader(self, loader):
         StringTemplateGroup.registerGroupLoader(loader)
 
+    @property
+    def compileCache(self):
+        """
+        The CompileCache used to skip lexing and parsing templates
+        whose source has been compiled before, or None.
+        """
+        return self._compileCache
+
+    @compileCache.setter
+    def compileCache(self, cache):
+        self._compileCache = cache
+
+    @property
+    def compileExecutor(self):
+        """ The executor compiling the templates of large group files, or None. """
+        return self._compileExecutor
+
+    @compileExecutor.setter
+    def compileExecutor(self, executor):
+        self._compileExecutor = executor
+
+    @property
+    def directoryIndex(self):
+        """
+        The DirectoryIndex consulted instead of the disk when looking
+        for template files, or None.
+        """
+        return self._directoryIndex
+
+    @directoryIndex.setter
+    def directoryIndex(self, index):
+        self._directoryIndex = index
+
+    def _isFile(self, path):
+        """ Is there a file at path?  Asks the directoryIndex if there is one. """
+        index = self.directoryIndex
+        if index is None:
+            return Path(path).is_file()
+        return index.isFile(path)
+
     @property
     def templateLexerClass(self):
         """
@@ -228,6 +361,37 @@ class StringTemplateGroup(object):
                 % type(lexer).__name__
             )
 
+    @property
+    def actionEvaluatorClass(self):
+        """
+        What evaluator class to use to compute the value of actions.
+        If no evaluator is set for this group, use static default.
+        """
+        if self._actionEvaluatorClass is not None:
+            return self._actionEvaluatorClass
+
+        return self.defaultActionEvaluatorClass
+
+    @actionEvaluatorClass.setter
+    def actionEvaluatorClass(self, evaluator):
+        if isinstance(evaluator, str):
+            try:
+                self._actionEvaluatorClass = {
+                    'walker': ActionEvaluator.Walker,
+                    'closure': ActionCompiler.Evaluator,
+                }[evaluator]
+            except KeyError:
+                raise ValueError('Unknown action evaluator id %r' % evaluator)
+
+        elif isinstance(evaluator, type) or evaluator is None:
+            self._actionEvaluatorClass = evaluator
+
+        else:
+            raise TypeError(
+                "Action evaluator must be string or class, got %r"
+                % type(evaluator).__name__
+            )
+
     @property
     def name(self):
         return self._name
@@ -277,28 +441,30 @@ class StringTemplateGroup(object):
             # for this (sub) group.
 
             superGroupName = superGroup
-            superGroup = StringTemplateGroup.nameToGroupMap.get(
-                superGroupName, None)
-            if superGroup is not None:
-                # we've seen before; just use it
-                self._superGroup = superGroup
-
-            else:
-                # else load it using this group's template lexer
-                superGroup = self.loadGroup(
-                    superGroupName, lexer=self._templateLexerClass)
+            with StringTemplateGroup._registryLock:
+                superGroup = StringTemplateGroup.nameToGroupMap.get(
+                    superGroupName, None)
                 if superGroup is not None:
-                    StringTemplateGroup.nameToGroupMap[superGroup] = superGroup
+                    # we've seen before; just use it
                     self._superGroup = superGroup
 
-                elif self.groupLoader is None:
-                    self._listener.error("no group loader registered", None)
+                else:
+                    # else load it using this group's template lexer
+                    superGroup = self.loadGroup(
+                        superGroupName, lexer=self._templateLexerClass)
+                    if superGroup is not None:
+                        StringTemplateGroup.nameToGroupMap[superGroup] = superGroup
+                        self._superGroup = superGroup
+
+                    elif self.groupLoader is None:
+                        self._listener.error("no group loader registered", None)
 
         else:
             raise TypeError(
                 "Need StringTemplateGroup or string, got %s"
                 % type(superGroup).__name__
             )
+        StringTemplateGroup._renderersChanged()
 
     def getGroupHierarchyStackString(self):
         """Walk up group hierarchy and show top down to this group"""
@@ -335,20 +501,21 @@ class StringTemplateGroup(object):
         else:
             interfaceName = interface
 
-            interface = self.nameToInterfaceMap.get(interfaceName, None)
-            if interface is not None:
-                # we've seen before; just use it
-                self._interfaces.append(interface)
-                return
+            with StringTemplateGroup._registryLock:
+                interface = self.nameToInterfaceMap.get(interfaceName, None)
+                if interface is not None:
+                    # we've seen before; just use it
+                    self._interfaces.append(interface)
+                    return
 
-            # else load it
-            interface = self.loadInterface(interfaceName)
-            if interface is not None:
-                self.nameToInterfaceMap[interfaceName] = interface
-                self._interfaces.append(interface)
+                # else load it
+                interface = self.loadInterface(interfaceName)
+                if interface is not None:
+                    self.nameToInterfaceMap[interfaceName] = interface
+                    self._interfaces.append(interface)
 
-            elif self.groupLoader is None:
-                self._listener.error("no group loader registered", None)
+                elif self.groupLoader is None:
+                    self._listener.error("no group loader registered", None)
 
     def createStringTemplate(self):
         """
@@ -405,8 +572,8 @@ class StringTemplateGroup(object):
         Get the template called 'name' from the group.
         If not found, attempt to load.
         If not found on disk, then try the superGroup,if any.
-        If not even there, then record that it's NOT_FOUND,
-        so we don't waste time looking again later.
+        If not even there, then remember that it's missing (see
+        missingTemplates), so we don't waste time looking again later.
         If we've gone past refresh interval, flush and look again.
 
         If I find a template in a super group, copy an instance down here
@@ -423,60 +590,200 @@ class StringTemplateGroup(object):
 
         self.checkRefreshInterval()
         st = self._templates.get(name, None)
-        if not st:
-            # not there?  Attempt to load
-            if not self._templatesDefinedInGroupFile:
-                # only check the disk for individual template
-                st = self.loadTemplateFromBeneathRootDir(self.getFileNameFromTemplateName(name))
-            if (not st) and self._superGroup:
-                # try to resolve in super group
-                st = self._superGroup.getInstanceOf(name)
-                # make sure that when we inherit a template, that its
-                # group is reset; its nativeGroup will remain where it was
-                if st is not None:
-                    st._group = self
+        if st is None or st.isDeferred:
+            with self._lock:
+                # another thread may have loaded it meanwhile
+                st = self._templates.get(name, None)
+                if st is None and self._compileRegionOwner(name):
+                    st = self._templates.get(name, None)
+                if st is None:
+                    if self._missingTemplates.isMissing(name, self._definitionStamp()):
+                        # known not to exist; don't look again
+                        return None
+                    return self._loadTemplateNamed(name, enclosingInstance)
+                st.compileDeferred()
 
-            if st:  # found in superGroup
-                # insert into this group; refresh will allow super
-                # to change its def later or this group to add
-                # an override.
-                self._templates[name] = st
+        return st
 
-            else:
-                # not found; remember that this sucker doesn't exist
-                self._templates[name] = StringTemplateGroup.NOT_FOUND_ST
-                context = ""
-                if enclosingInstance is not None:
-                    context = (
-                            "; context is " +
-                            enclosingInstance.enclosingInstanceStackString
-                    )
-                hierarchy = self.getGroupHierarchyStackString()
-                context += "; group hierarchy is " + hierarchy
-                raise ValueError(
-                    "Can't load template " +
-                    self.getFileNameFromTemplateName(name) +
-                    context
-                )
+    def _loadTemplateNamed(self, name, enclosingInstance):
+        """
+        Load the template called 'name' into this group, from the disk
+        or from the superGroup; lookupTemplate calls this holding the lock.
+        """
+        st = None
+        # not there?  Attempt to load
+        if not self._templatesDefinedInGroupFile:
+            # only check the disk for individual template
+            st = self.loadTemplateFromBeneathRootDir(self.getFileNameFromTemplateName(name))
+        if (not st) and self._superGroup:
+            # try to resolve in super group; it remembers its own misses
+            try:
+                st = self._superGroup.getInstanceOf(name)
+            except ValueError:
+                st = None
+            # make sure that when we inherit a template, that its
+            # group is reset; its nativeGroup will remain where it was
+            if st is not None:
+                st._group = self
+
+        if st:  # found in superGroup
+            # insert into this group; refresh will allow super
+            # to change its def later or this group to add
+            # an override.
+            self._templates[name] = st
 
-        elif st is StringTemplateGroup.NOT_FOUND_ST:
-            return None
+        else:
+            # not found; remember that this sucker doesn't exist
+            self._missingTemplates.remember(name, self._definitionStamp())
+            context = ""
+            if enclosingInstance is not None:
+                context = (
+                        "; context is " +
+                        enclosingInstance.enclosingInstanceStackString
+                )
+            hierarchy = self.getGroupHierarchyStackString()
+            context += "; group hierarchy is " + hierarchy
+            raise ValueError(
+                "Can't load template " +
+                self.getFileNameFromTemplateName(name) +
+                context
+            )
 
         return st
 
+    def _compileRegionOwner(self, name):
+        """
+        Regions are defined as the template holding them is compiled;
+        if name is a region of a deferred template, compile that now.
+        """
+        if not name.startswith('region__') or name.rfind('__') < len('region__'):
+            return False
+        owner = self._templates.get(self.getUnMangledTemplateName(name), None)
+        if owner is None or not owner.isDeferred:
+            return False
+        with self._lock:
+            owner.compileDeferred()
+        return True
+
+    def compileDeferredTemplates(self):
+        """ Compile every template of this group still waiting to be compiled. """
+        with self._lock:
+            while True:
+                deferred = [st for st in self._templates.values() if st is not None and st.isDeferred]
+                if not deferred:
+                    return
+                for st in deferred:
+                    st.compileDeferred()
+
+    def _setTemplatePattern(self, st, template):
+        """
+        Give a template defined in a group file its pattern, compiling it now,
+        on first lookup, or once the whole file is parsed.
+        """
+        deferred = self.defaultLazyCompilation or self.compileExecutor is not None
+        if deferred and st.nativeGroup is self:
+            st.deferTemplate(template)
+        else:
+            st.template = template
+
+    def _definitionStamp(self):
+        """
+        Changes whenever a template is defined in this group or a super group,
+        so a name remembered as missing is looked for again.
+        """
+        stamp = []
+        group = self
+        while group is not None:
+            stamp.append((group, group._definitions))
+            group = group._superGroup
+        return tuple(stamp)
+
+    def _addTemplates(self, templates):
+        """ Store newly defined templates, forgetting that any of them was missing. """
+        self._templates.update(templates)
+        self._definitions += 1
+        for name in templates:
+            self._missingTemplates.discard(name)
+
+    @property
+    def missingTemplates(self):
+        """ The NegativeCache of names looked up in this group and not found. """
+        return self._missingTemplates
+
+    @missingTemplates.setter
+    def missingTemplates(self, cache):
+        self._missingTemplates = cache
+
+    @property
+    def refreshInterval(self):
+        """ How many seconds pass between checks of the disk for edited templates. """
+        return self._refreshInterval
+
+    @refreshInterval.setter
+    def refreshInterval(self, refreshInterval):
+        self._refreshInterval = refreshInterval
+        if refreshInterval >= NEVER_REFRESH:
+            self._nextDiskCheck = None
+        else:
+            self._nextDiskCheck = self._lastCheckedDisk + refreshInterval
+
     def checkRefreshInterval(self):
         """
-        If the refresh interval has past.
-        Throw away all pre-compiled references.
+        If the refresh interval has past, reload the templates whose files
+        changed on the disk (by modification time or size) and drop those
+        whose files are gone; every other template stays compiled.
+        Templates inherited from a super group are dropped when the
+        super group reloads them, so they are copied down again; the super
+        group is checked first, when this group's check is due.
         """
-        if self._templatesDefinedInGroupFile:
+        nextCheck = self._nextDiskCheck
+        if nextCheck is None or time.time() < nextCheck:
             return
-        # if self._refreshInterval == 0:
-        #     self._templates = {}
-        #     self._lastCheckedDisk = time.time()
-        # elif (time.time() - self._lastCheckedDisk) >= self._refreshInterval:
-        #     self._templates = {}
-        #     self._lastCheckedDisk = time.time()
+        if self._superGroup is not None:
+            self._superGroup.checkRefreshInterval()
+        with self._lock:
+            now = time.time()
+            nextCheck = self._nextDiskCheck
+            if nextCheck is None or now < nextCheck:
+                return  # another thread just checked
+            self._lastCheckedDisk = now
+            self._nextDiskCheck = now + self._refreshInterval
+            self._reloadChangedTemplates()
+
+    def _reloadChangedTemplates(self):
+        index = self.directoryIndex
+        if index is not None:
+            index.refresh()
+        # new files may define templates that were missing
+        self._missingTemplates.clear()
+
+        for name, (path, signature) in list(self._templateFiles.items()):
+            if self._fileSignature(path) != signature:
+                self._forgetTemplate(name)
+                self.loadTemplate(name, path)
+
+        for name, st in list(self._templates.items()):
+            nativeGroup = st.nativeGroup
+            if nativeGroup is not None and nativeGroup is not self:
+                original = nativeGroup._templates.get(name, None)
+                if original is None or original._compiled is not st._compiled:
+                    del self._templates[name]
+
+    def _forgetTemplate(self, name):
+        """ Drop a template loaded from a file, with the regions it defined. """
+        self._templateFiles.pop(name, None)
+        self._templates.pop(name, None)
+        regionPrefix = self.getMangledRegionName(name, '')
+        for key in [key for key in self._templates if key.startswith(regionPrefix)]:
+            del self._templates[key]
+
+    @staticmethod
+    def _fileSignature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
 
     def _loadTemplateFromStream(self, name, stream):
         try:
@@ -485,9 +792,54 @@ class StringTemplateGroup(object):
             if not template:
                 self.error("no text in template '" + name + "'")
                 return None
-            return self.defineTemplate(name, template)
+            return self._defineCompiledTemplate(name, template)
         except Exception as ex:
             pass
+
+    def _defineCompiledTemplate(self, name, template):
+        """
+        Define a template loaded from its own file,
+        reusing the compile cache entry for its source if there is one.
+        Any region templates it defines are cached along with it.
+        """
+        cache = self.compileCache
+        if cache is None:
+            return self.defineTemplate(name, template)
+
+        lexerClass = self.templateLexerClass
+        defined = cache.load(self, TEMPLATE_FILE, name, template, lexerClass)
+        if defined is not None:
+            self._addTemplates(defined)
+            return self._templates[name]
+
+        before = dict(self._templates)
+        errors = self._compileCounted(lambda: self.defineTemplate(name, template))
+        if errors == 0:
+            defined = {key: st for key, st in self._templates.items() if before.get(key, None) is not st}
+            cache.store(self, TEMPLATE_FILE, name, template, lexerClass, defined)
+        return self._templates[name]
+
+    def _compileCounted(self, compile):
+        """
+        Run compile() and return the number of errors it reported.
+        Templates defined meanwhile are left with this group's real listener.
+        """
+        listener = self._listener
+        counter = ErrorCountingListener(listener)
+        self._listener = counter
+        try:
+            compile()
+        finally:
+            self._replaceListener(counter, listener)
+        return counter.errors
+
+    def _replaceListener(self, old, new):
+        """ Make this group and its templates that report to old report to new. """
+        if self._listener is old:
+            self._listener = new
+        for st in self._templates.values():
+            if st is not None and st._listener is old:
+                st._listener = new
     
     def loadTemplate(self, name, src):
         """
@@ -496,11 +848,15 @@ class StringTemplateGroup(object):
         """
         templateFilePath = src if isinstance(src, Path) else Path(src)
         if isinstance(src, str) or isinstance(src, Path):
-            if not templateFilePath.is_file():
+            if not self._isFile(templateFilePath):
                 return None
+            signature = self._fileSignature(templateFilePath)
             # with decodeFile(open(templateFilePath, "rt", encoding="utf-8", newline=''), str) as stream:
             with open(templateFilePath, "rt", encoding="utf-8", newline='') as stream:
-                return self._loadTemplateFromStream(name, stream)
+                st = self._loadTemplateFromStream(name, stream)
+            if st is not None:
+                self._templateFiles[name] = (templateFilePath, signature)
+            return st
 
         if hasattr(src, "read"):
             # with decodeFile(src, f'<template {name} from buffer>') as stream:
@@ -525,12 +881,13 @@ class StringTemplateGroup(object):
                 return template
 
         # Template not found yet so try sys.path
-        templatePaths = [Path(apath, fileName) for apath in sys.path if Path(apath, fileName).is_file()]
-        if len(templatePaths) == 0:
+        templatePath = next((path for path in (Path(apath, fileName) for apath in sys.path)
+                             if self._isFile(path)), None)
+        if templatePath is None:
             self.error(f"Could not find template file: {fileName} in root: {self._root_dir}, or sys.path")
             return None
         try:
-            template = self.loadTemplate(name, templatePaths[0])
+            template = self.loadTemplate(name, templatePath)
         except IOError as ioe:
             self.error("Problem reading template file: " + fileName, ioe)
         if template:
@@ -564,7 +921,7 @@ class StringTemplateGroup(object):
         st.template = template
         st.errorListener = self._listener
 
-        self._templates[name] = st
+        self._addTemplates({name: st})
         return st
 
     def defineRegionTemplate(self, enclosingTemplate, regionName, template, a_type):
@@ -620,10 +977,11 @@ class StringTemplateGroup(object):
             self.error('cannot alias ' + name + ' to undefined template: ' +
                        target)
             return None
-        self._templates[name] = targetST
+        self._addTemplates({name: targetST})
         return targetST
 
     def isDefinedInThisGroup(self, name):
+        self._compileRegionOwner(name)
         st = self._templates.get(name, None)
         if st is not None:
             if st.isRegion:
@@ -649,10 +1007,55 @@ class StringTemplateGroup(object):
             return False
 
     def parseGroup(self, reader):
+        cache = self.compileCache
+        if cache is None:
+            self._parseGroup(reader)
+            return
+
+        source = reader.read()
+        lexerClass = self.templateLexerClass
+        unit = cache.load(self, GROUP_FILE, None, source, lexerClass)
+        if unit is not None:
+            self._restoreCompiledGroup(unit)
+            return
+
+        superGroup = self._superGroup
+        interfaceCount = len(self._interfaces)
+        before = dict(self._templates)
+        errors = self._compileCounted(lambda: self._parseGroup(antlr.StringCharBuffer(source)))
+        if errors != 0:
+            return
+
+        templates = {key: st for key, st in self._templates.items() if before.get(key, None) is not st}
+        unit = {
+            'name': self._name,
+            'superGroup': self._superGroup.name if self._superGroup is not superGroup else None,
+            'interfaces': [interface.name for interface in self._interfaces[interfaceCount:]],
+            # the supergroup must be in place before the templates are
+            # unpickled, so they are serialized separately
+            'compiled': dumpCompiled(self, (templates, self._maps)),
+        }
+        cache.store(self, GROUP_FILE, None, source, lexerClass, unit)
+
+    def _restoreCompiledGroup(self, unit):
+        """ Replay the effect of parsing a group file from its compile cache entry. """
+        self._name = unit['name']
+        if unit['superGroup'] is not None:
+            self.superGroup = unit['superGroup']
+        for interfaceName in unit['interfaces']:
+            self.implementInterface(interfaceName)
+        templates, maps = loadCompiled(self, unit['compiled'])
+        self._addTemplates(templates)
+        self._maps.update(maps)
+        logger.debug(f"read group {self} from compile cache")
+
+    def _parseGroup(self, reader):
         try:
             lexer = GroupLexer.Lexer(reader)
             parser = GroupParser.Parser(lexer)
             parser.group(self)
+            if self.compileExecutor is not None and not self.defaultLazyCompilation:
+                self._compileDeferredInParallel()
             logger.debug(f"read group {self}")
         except "foo" as e:  # FIXME: Exception, e:
             name = "<unknown>"
@@ -660,6 +1063,34 @@ class StringTemplateGroup(object):
                 name = self._name
             self.error('problem parsing group ' + name + ': ' + str(e), e)
 
+    def _compileDeferredInParallel(self):
+        """
+        Compile the deferred templates in batches on the compileExecutor.
+        Each batch is pickled like a compile cache entry, compiled by
+        compileTemplateBatch and loaded back along with the regions it
+        defined; errors are reported here, in template order.
+        Templates referring to super group regions need this group, so
+        they are compiled here afterwards.
+        """
+        deferred = [(name, st) for name, st in self._templates.items()
+                    if st is not None and st.isDeferred and '@super.' not in st.template]
+        if len(deferred) >= self.minParallelTemplates:
+            batchSize = max(16, -(-len(deferred) // (4 * (os.cpu_count() or 1))))
+            futures = [
+                self.compileExecutor.submit(compileTemplateBatch, self._name, self.templateLexerClass,
+                                            dumpCompiled(self, dict(deferred[i:i + batchSize])))
+                for i in range(0, len(deferred), batchSize)
+            ]
+            for future in futures:
+                data, problems = future.result()
+                self._addTemplates(loadCompiled(self, data))
+                for problem in problems:
+                    if problem[0] == 'error':
+                        self._listener.error(problem[1], problem[2])
+                    else:
+                        self._listener.warning(problem[1])
+        self.compileDeferredTemplates()
+
     def verifyInterfaceImplementations(self):
         """verify that this group satisfies its interfaces"""
 
@@ -693,6 +1124,11 @@ class StringTemplateGroup(object):
     def errorListener(self, listener):
         self._listener = listener
 
+    @property
+    def lineSeparator(self):
+        """ What a newline in a template is written as. """
+        return self._lineSeparator
+
     @property
     def userSpecifiedWriter(self):
         """
@@ -720,16 +1156,29 @@ class StringTemplateGroup(object):
             stw = AutoIndentWriter(w, line_sep=self._lineSeparator)
         return stw
 
-    def registerRenderer(self, attributeClassType, renderer):
+    def registerRenderer(self, attributeClassType, renderer, memoSize=None):
         """
         Register a renderer for all objects of a particular type for all templates in this group.
+        It also renders objects of subclasses that have no renderer of their own.
+        With memoSize, the renderer is wrapped in a MemoizingRenderer
+        remembering that many results.
         """
+        if memoSize is not None:
+            renderer = MemoizingRenderer(renderer, maxSize=memoSize)
         self._attributeRenderers[attributeClassType] = renderer
+        StringTemplateGroup._renderersChanged()
+
+    @staticmethod
+    def _renderersChanged():
+        with StringTemplateGroup._registryLock:
+            StringTemplateGroup._rendererGeneration += 1
 
     def getAttributeRenderer(self, attributeClassType):
         """
         Return the renderer registered for this attributeClassType for this group.
         If not found, return attribute from superGroup if it has one.
+        A renderer registered for a base class is used when the class itself,
+        or a nearer base class, has none.
 
         This function is backed by a Map<class,object> which holds registered a renderers.
         Registration is by the particular kind of object to be displayed for any template in this group.
@@ -740,21 +1189,24 @@ class StringTemplateGroup(object):
 
         These render objects are used way down in the evaluation chain
         right before an attribute's str() method would normally be called in ASTExpr.write().
+        The answer for each class, including None, is remembered until a
+        renderer is registered or a super group set in any group.
         """
-        if not self._attributeRenderers:
-            if not self._superGroup:
-                return None  # no renderers and no parent?  Stop.
-            # no renderers; consult super group
-            return self._superGroup.getAttributeRenderer(attributeClassType)
-
-        if attributeClassType in self._attributeRenderers:
-            return self._attributeRenderers[attributeClassType]
-
-        elif self._superGroup is not None:
-            # no renderer registered for this class, check super group
-            return self._superGroup.getAttributeRenderer(attributeClassType)
-
-        return None
+        generation = StringTemplateGroup._rendererGeneration
+        if self._rendererCacheGeneration != generation:
+            self._rendererCacheGeneration = generation
+            self._rendererCache = {}
+        cache = self._rendererCache
+        renderer = cache.get(attributeClassType, _NO_RENDERER)
+        if renderer is _NO_RENDERER:
+            renderer = None
+            group = self
+            while group is not None and renderer is None:
+                if group._attributeRenderers:
+                    renderer = findRenderer(group._attributeRenderers, attributeClassType)
+                group = group._superGroup
+            cache[attributeClassType] = renderer
+        return renderer
 
     def getMap(self, name):
         if not self._maps:
@@ -780,10 +1232,30 @@ class StringTemplateGroup(object):
     def registerGroupLoader(cls, loader):
         cls._groupLoader = loader
 
+    @classmethod
+    def registerCompileCache(cls, cache):
+        cls._compileCache = cache
+
+    @classmethod
+    def registerDirectoryIndex(cls, index):
+        cls._directoryIndex = index
+
+    @classmethod
+    def registerCompileExecutor(cls, executor):
+        cls._compileExecutor = executor
+
+    @classmethod
+    def registerLazyCompilation(cls, lazy=True):
+        cls.defaultLazyCompilation = lazy
+
     @classmethod
     def registerDefaultLexer(cls, lexerClass):
         cls.defaultTemplateLexerClass = lexerClass
 
+    @classmethod
+    def registerDefaultActionEvaluator(cls, evaluatorClass):
+        cls.defaultActionEvaluatorClass = evaluatorClass
+
     @classmethod
     def loadGroup(cls, name, superGroup=None, lexer=None):
         if cls._groupLoader is not None:
@@ -900,3 +1372,137 @@ class StringTemplateGroup(object):
         for ix, (key, template) in enumerate(self._templates.items()):
             template.printDebugString(out)
         out.write("]\n")
+
+
+class _RecordingListener(StringTemplateErrorListener):
+    """ Keep the problems reported in a worker process to report them again in the parent. """
+
+    def __init__(self):
+        super().__init__()
+        self.problems = []
+
+    def error(self, msg, e=None):
+        if e is not None:
+            try:
+                pickle.loads(pickle.dumps(e))
+            except Exception:
+                try:
+                    text = str(e)
+                except Exception:
+                    text = type(e).__name__
+                e = RuntimeError(text)
+        self.problems.append(('error', msg, e))
+
+    def warning(self, msg):
+        self.problems.append(('warning', msg))
+
+
+def compileTemplateBatch(groupName, lexerClass, data):
+    """
+    Compile a batch of deferred templates of group groupName in a worker
+    process; see StringTemplateGroup.compileExecutor.
+    Return the templates, with the regions they defined, pickled for the
+    group, and the problems reported while compiling them.
+    """
+    listener = _RecordingListener()
+    group = StringTemplateGroup(errors=listener)
+    group._name = groupName
+    group._templatesDefinedInGroupFile = True
+    group.templateLexerClass = lexerClass
+    templates = loadCompiled(group, data)
+    group._addTemplates(templates)
+    for st in templates.values():
+        st.compileDeferred()
+    return dumpCompiled(group, group.templates), listener.problems
+
+
+class StringTemplateGroupHandle(object):
+    """
+    The current version of a group that can be replaced while it is
+    being rendered, say when its group file is deployed again.
+
+    A new version is built by calling build(errors), off the render path
+    with reload(), and swapped in with a single reference assignment.
+    The groups it builds are registered by name only when it is swapped
+    in, so nameToGroupMap never holds a version that was rejected.
+    Renders that already got templates from the previous version finish
+    with it; nothing refers to it afterwards, so it is then freed.
+    A version whose build reported errors is never swapped in.
+
+        handle = StringTemplateGroupHandle.fromFile('site.stg')
+        st = handle.getInstanceOf('page')
+        ...
+        handle.reload()   # returns a Future
+    """
+
+    def __init__(self, build, errors=None):
+        self._build = build
+        self._listener = DEFAULT_ERROR_LISTENER if errors is None else errors
+        # (version number, group) replaced as one, so both always match
+        self._current = (0, None)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.load()
+
+    @classmethod
+    def fromFile(cls, fileName, errors=None, **kwargs):
+        """ A handle on the group defined in fileName, which reload() reads again. """
+        return cls(lambda listener: StringTemplateGroup(fileName=fileName, errors=listener, **kwargs),
+                   errors)
+
+    @property
+    def group(self):
+        return self._current[1]
+
+    @property
+    def version(self):
+        """ How many versions of the group were swapped in. """
+        return self._current[0]
+
+    def getInstanceOf(self, name, attributes=None):
+        return self.group.getInstanceOf(name, attributes=attributes)
+
+    def load(self):
+        """
+        Build a new version of the group and swap it in; return it.
+        Raise ValueError, keeping the current version, if the build reported errors.
+        """
+        counter = ErrorCountingListener(self._listener)
+        _heldRegistrations.groups = built = []
+        try:
+            group = self._build(counter)
+            # do all the work now, off the render path
+            group.compileDeferredTemplates()
+        finally:
+            _heldRegistrations.groups = None
+        if counter.errors != 0:
+            raise ValueError(f'{counter.errors} error(s) building group {group.name}; '
+                             f'keeping version {self.version}')
+        group._replaceListener(counter, self._listener)
+        self.swap(group, built)
+        return group
+
+    def reload(self):
+        """
+        Load a new version in a background thread.
+        Return a Future for the new group; reloads happen one at a time, in order.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reload')
+        return self._executor.submit(self.load)
+
+    def swap(self, group, built=()):
+        """
+        Make group the current version; return the previous one.
+        The groups built along with it are registered by name too.
+        """
+        with self._lock:
+            version, previous = self._current
+            with StringTemplateGroup._registryLock:
+                for other in built:
+                    StringTemplateGroup.nameToGroupMap[other.name] = other
+                if group.name is not None:
+                    StringTemplateGroup.nameToGroupMap[group.name] = group
+            self._current = (version + 1, group)
+        return previous
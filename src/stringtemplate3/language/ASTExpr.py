@@ -1,5 +1,6 @@
 from builtins import str
 from builtins import range
+import itertools
 from io import StringIO
 
 from stringtemplate3 import antlr
@@ -9,10 +10,79 @@ from stringtemplate3.language import ActionEvaluator
 from stringtemplate3.language.StringTemplateAST import StringTemplateAST
 from stringtemplate3.language.FormalArgument import UNKNOWN_ARGS
 import stringtemplate3
+from stringtemplate3 import caches
+from stringtemplate3.writers import AutoIndentWriter
 
 from stringtemplate3.language.CatIterator import (isiterable,
                                                   convertAnyCollectionToList,
-                                                  convertAnythingToList)
+                                                  convertAnythingToList,
+                                                  convertAnythingToIterator)
+
+
+# How ASTExpr.getObjectProperty reads a property; see caches.AccessorCache.
+_AGGREGATE, _MAP, _TEMPLATE, _METHOD, _ATTRIBUTE = range(5)
+
+
+# How ASTExpr._write writes a value, remembered per type in _writeKinds
+#  so scalars skip the isiterable() probe and the TypeError it raises.
+_WRITE_SCALAR, _WRITE_ITERABLE, _WRITE_TEMPLATE = range(3)
+_writeKinds = {str: _WRITE_SCALAR, int: _WRITE_SCALAR, float: _WRITE_SCALAR, bool: _WRITE_SCALAR}
+
+# Types whose values ASTExpr._joinScalars can join in a single write.
+_JOINABLE_TYPES = frozenset([str, int, float])
+
+
+def writeKind(o):
+    """ Work out how _write writes o; whether it is iterable depends only on its type. """
+    if isinstance(o, stringtemplate3.StringTemplate):
+        kind = _WRITE_TEMPLATE
+    elif isiterable(o):
+        kind = _WRITE_ITERABLE
+    else:
+        kind = _WRITE_SCALAR
+    if len(_writeKinds) >= 1024:
+        _writeKinds.clear()
+    _writeKinds[type(o)] = kind
+    return kind
+
+
+class ExprOptions(object):
+    """
+    The option values of one write of an ASTExpr.  handleExprOptions makes
+    one per write, and the evaluator is handed it in place of the ASTExpr:
+    writeAttribute and applyListOfAlternatingTemplates use its values,
+    every other helper is the expression's own.
+    """
+
+    __slots__ = ('_expr', 'wrapString', 'nullValue', 'separatorString', 'formatString')
+
+    def __init__(self, expr, wrapString=None, nullValue=None, separatorString=None,
+                 formatString=None):
+        self._expr = expr
+        # wrap=expr, written before a value when the line might wrap
+        self.wrapString = wrapString
+        # null=expr, written for null values, single or in a list, instead
+        #  of skipping them; <name; null="n/a"> is shorthand for
+        #  <if(name)><name><else>n/a<endif>
+        self.nullValue = nullValue
+        # separator=expr, written between the values of a list
+        self.separatorString = separatorString
+        # format=expr, handed to the renderer
+        self.formatString = formatString
+
+    def __getattr__(self, name):
+        return getattr(self._expr, name)
+
+    def writeAttribute(self, this, o, out):
+        return self._expr._write(this, o, out, self)
+
+    def applyListOfAlternatingTemplates(self, this, attributeValue, templatesToApply):
+        return self._expr.applyListOfAlternatingTemplates(
+            this, attributeValue, templatesToApply, self.nullValue)
+
+
+# The options of an expression written without any.
+NO_OPTIONS = ExprOptions(None)
 
 
 class IllegalStateException(Exception):
@@ -58,30 +128,23 @@ class ASTExpr(Expr):
         super(ASTExpr, self).__init__(enclosingTemplate)
         self._exprTree = exprTree
 
-        # # store separator etc...
+        # # store separator etc...; their values for a write are worked
+        #  out by handleExprOptions
         self._options = options
 
-        # # A cached value of wrap=expr from the <...> expression.
-        #  Computed in write(StringTemplate, StringTemplateWriter) and used
-        #  in writeAttribute.
-        self._wrapString = None
-
-        # # For null values in iterated attributes and single attributes that
-        #  are null, use this value instead of skipping.  For single valued
-        #  attributes like <name; null="n/a"> it's a shorthand for
-        #  <if(name)><name><else>n/a<endif>
-        #  For iterated values <values; null="0", separator=",">, you get 0
-        #  for null list values.  Works for template application like:
-        #  <values:{v| <v>}; null="0"> also.
-        self._nullValue = None
-
-        # # A cached value of separator=expr from the <...> expression.
-        #  Computed in write(StringTemplate, StringTemplateWriter) and used
-        #  in writeAttribute.
-        self._separatorString = None
-
-        # A cached value of option format=expr
-        self._formatString = None
+        # Options given as a string literal, with their text; their value
+        #  needs no evaluator, see evaluateOption.
+        self._literalOptions = {}
+        # Options given as a lone attribute reference, with its name.
+        self._referenceOptions = {}
+        if options is not None:
+            for name in options:
+                ast = self.getOption(name)
+                if isinstance(ast, StringTemplateAST) and ast.firstChild is None:
+                    if ast.type == ActionEvaluator.STRING:
+                        self._literalOptions[name] = ast.text
+                    elif ast.type == ActionEvaluator.ID:
+                        self._referenceOptions[name] = ast.text
 
     # # Return the tree interpreted when self template is written out.
     @property
@@ -111,10 +174,10 @@ class ASTExpr(Expr):
         if anchorAST is not None:  # any non-empty expr means true; check presence
             out.pushAnchorPoint()
 
-        self.handleExprOptions(this)
+        chunk = self.handleExprOptions(this)
 
-        evaluator = ActionEvaluator.Walker()
-        evaluator.initialize(this, self, out)
+        evaluator = this.group.actionEvaluatorClass()
+        evaluator.initialize(this, chunk, out)
         n = 0
         try:
             # eval and write out tree
@@ -128,32 +191,62 @@ class ASTExpr(Expr):
         return n
 
     def handleExprOptions(self, this):
-        """Grab and cache options; verify options are valid"""
-
-        # make sure options don't use format / renderer.  They are usually
-        # strings which might invoke a string renderer etc...
-        self._formatString = None
-
-        wrapAST = self.getOption("wrap")
-        if wrapAST is not None:
-            self._wrapString = self.evaluateExpression(this, wrapAST)
-
-        nullValueAST = self.getOption("null")
-        if nullValueAST is not None:
-            self._nullValue = self.evaluateExpression(this, nullValueAST)
-
-        separatorAST = self.getOption("separator")
-        if separatorAST is not None:
-            self._separatorString = self.evaluateExpression(this, separatorAST)
-
-        formatAST = self.getOption("format")
-        if formatAST is not None:
-            self._formatString = self.evaluateExpression(this, formatAST)
-
-        if self._options is not None:
-            for option in list(self._options.keys()):
-                if option not in self.supportedOptions:
-                    this.warning("ignoring unsupported option: " + option)
+        """
+        Evaluate the options for one write; verify options are valid.
+        Return the chunk to evaluate the tree with: self when there are
+        no options, otherwise an ExprOptions holding this write's values.
+        The shared chunk is never changed, so several threads (or a
+        recursive template) may write it at the same time.
+        """
+        if self._options is None:
+            return self
+
+        # options are evaluated by self, which writes without options, so they
+        # don't use format / renderer.  They are usually strings which might
+        # invoke a string renderer etc...
+        plain = this.group.userSpecifiedWriter is None and this.getAttributeRenderer(str) is None
+        options = ExprOptions(self,
+                              self.evaluateOption(this, "wrap", plain),
+                              self.evaluateOption(this, "null", plain),
+                              self.evaluateOption(this, "separator", plain),
+                              self.evaluateOption(this, "format", plain))
+
+        for option in list(self._options.keys()):
+            if option not in self.supportedOptions:
+                this.warning("ignoring unsupported option: " + option)
+
+        return options
+
+    def evaluateOption(self, this, name, plain):
+        """
+        The value of option name for a write in this, or None if not given.
+        When plain, strings are written by an AutoIndentWriter without a
+        renderer, so a string literal, or an attribute reference whose value
+        is a string or missing, is worked out here as evaluateExpression
+        would, without a buffer, writer and evaluator.
+        """
+        ast = self.getOption(name)
+        if ast is None:
+            return None
+        if plain:
+            if name in self._literalOptions:
+                return self._plainText(this, self._literalOptions[name])
+            if name in self._referenceOptions and this._scope is not None:
+                value = this.getAttribute(self._referenceOptions[name])
+                if value is None:
+                    return ''
+                if type(value) is str:
+                    return self._plainText(this, value)
+        return self.evaluateExpression(this, ast)
+
+    @staticmethod
+    def _plainText(this, text):
+        """ text as an AutoIndentWriter of this's group writes it into a fresh buffer. """
+        if '\r' in text:
+            text = text.replace('\r', '')
+        if '\n' in text:
+            text = text.replace('\n', this.group.lineSeparator)
+        return text
 
     # -----------------------------------------------------------------------------
     #             HELP ROUTINES CALLED BY EVALUATOR TREE WALKER
@@ -165,20 +258,14 @@ class ASTExpr(Expr):
         """
         if (not attributes) or (not templateToApply):
             return None  # do not apply if missing templates or empty values
-        argumentContext = None
 
         # indicate it's an ST-created list
         results = stringtemplate3.STAttributeList()
 
-        # convert all attributes to iterators even if just one value
-        attributesList = []
-        for o in attributes:
-            if o is not None:
-                o = convertAnythingToList(o)
-                attributesList.append(o)
-        attributes = attributesList
-
-        numAttributes = len(attributesList)
+        # walk all attributes as iterators even if just one value;
+        # nothing is copied, so generators and long lists stream through
+        iterators = [convertAnythingToIterator(o) for o in attributes if o is not None]
+        numAttributes = len(iterators)
 
         # ensure arguments line up
         formalArgumentNames = templateToApply.formalArgumentKeys
@@ -195,34 +282,29 @@ class ASTExpr(Expr):
             shorterSize = min(len(formalArgumentNames), numAttributes)
             numAttributes = shorterSize
             formalArgumentNames = formalArgumentNames[:shorterSize]
+            iterators = iterators[:shorterSize]
 
-        # keep walking while at least one attribute has values
-        i = 0  # iteration number from 0
-        while True:
-            argumentContext = {}
+        # keep walking while at least one attribute has values;
+        # an attribute that ran out is left out of the arg context
+        exhausted = object()
+        lockstep = itertools.zip_longest(*iterators, fillvalue=exhausted)
+        for i, values in enumerate(lockstep):  # iteration number from 0
             # get a value for each attribute in list; put into arg context
             # to simulate template invocation of anonymous template
-            numEmpty = 0
-            for a in range(numAttributes):
-                if attributes[a]:
-                    argName = formalArgumentNames[a]
-                    argumentContext[argName] = attributes[a][0]
-                    attributes[a] = attributes[a][1:]
-                else:
-                    numEmpty += 1
-            if numEmpty == numAttributes:  # No attribute values given
-                break
+            argumentContext = {argName: value
+                               for argName, value in zip(formalArgumentNames, values)
+                               if value is not exhausted}
             argumentContext[self.DEFAULT_INDEX_VARIABLE_NAME] = i + 1
             argumentContext[self.DEFAULT_INDEX0_VARIABLE_NAME] = i
             embedded = templateToApply.instanceOf
             embedded.enclosingInstance = this
             embedded._argumentContext = argumentContext
             results.append(embedded)
-            i += 1
 
         return results
 
-    def applyListOfAlternatingTemplates(self, this, attributeValue, templatesToApply):
+    def applyListOfAlternatingTemplates(self, this, attributeValue, templatesToApply,
+                                        nullValue=None):
         if not attributeValue or not templatesToApply or templatesToApply == []:
             # do not apply if missing templates or empty value
             return None
@@ -235,9 +317,9 @@ class ASTExpr(Expr):
             resultVector = stringtemplate3.STAttributeList()
             for i, ithValue in enumerate(attributeValue):
                 if ithValue is None:
-                    if self._nullValue is None:
+                    if nullValue is None:
                         continue
-                    ithValue = self._nullValue
+                    ithValue = nullValue
 
                 templateIndex = i % len(templatesToApply)  # rotate through
                 embedded = templatesToApply[templateIndex]
@@ -329,17 +411,45 @@ class ASTExpr(Expr):
         (don't check any of the enclosing scopes; look directly into that object).
         Also try isXXX() for booleans.
         Allow HashMap, Hashtable as special case (grab value for key).
+        How the property is read is remembered per (class, property name)
+        in caches.PROPERTY_ACCESSORS.
         """
         if obj is None or propertyName is None:
             return None
-        value = None
 
         propertyNameStr = str(propertyName)
+        cls = type(obj)
+        if cls is dict:
+            return self._getMapProperty(obj, propertyName, propertyNameStr)
+        accessor = caches.PROPERTY_ACCESSORS.get((cls, propertyNameStr))
+        if accessor is None:
+            accessor = self._resolveAccessor(obj, propertyNameStr)
+            if accessor is None:
+                self._propertyError(this, obj, propertyNameStr)
+                return None
+        kind, name = accessor
+
+        if kind == _METHOD:
+            try:
+                return getattr(obj, name)()
+            except Exception as e:
+                self._propertyError(this, obj, propertyNameStr, e)
+                return None
+
+        if kind == _ATTRIBUTE:
+            try:
+                return getattr(obj, name)
+            except AttributeError:
+                self._propertyError(this, obj, propertyNameStr)
+                return None
+
+        # Or: if it's a dictionary then pull using key not the property method.
+        if kind == _MAP:
+            return self._getMapProperty(obj, propertyName, propertyNameStr)
 
         # Special case: our automatically created Aggregates via
         # attribute name: "{obj.{prop1,prop2}}"
-        if isinstance(obj, stringtemplate3.Aggregate):
-            # sys.stderr.write("[getObjectProperty] o = " + str(o) + '\n')
+        if kind == _AGGREGATE:
             value = obj.get(propertyNameStr, None)
             if value is None:
                 # no property defined; if a map in this group
@@ -347,57 +457,70 @@ class ASTExpr(Expr):
                 value = obj.get(self.DEFAULT_MAP_VALUE_NAME, None)
             return value
 
-        # Or: if it's a dictionary then pull using key not the property method.
-        if isinstance(obj, dict):
-            if propertyNameStr == 'keys':
-                value = list(obj.keys())
+        # Special case: if it's a template, pull property from its attribute table.
+        # TODO: TJP just asked himself why we can't do inherited attr here?
+        if obj.attributes is not None:
+            return obj.attributes.get(propertyNameStr, None)
+        return None
 
-            elif propertyNameStr == 'values':
-                value = list(obj.values())
+    def _getMapProperty(self, obj, propertyName, propertyNameStr):
+        if propertyNameStr == 'keys':
+            value = list(obj.keys())
 
-            else:
-                value = obj.get(propertyName, None)
-                if value is None:
-                    value = obj.get(propertyNameStr, None)
-                if value is None:
-                    value = obj.get(self.DEFAULT_MAP_VALUE_NAME, None)
+        elif propertyNameStr == 'values':
+            value = list(obj.values())
 
-            if value is self.MAP_KEY_VALUE:
-                value = propertyName
+        else:
+            value = obj.get(propertyName, None)
+            if value is None:
+                value = obj.get(propertyNameStr, None)
+            if value is None:
+                value = obj.get(self.DEFAULT_MAP_VALUE_NAME, None)
 
-            return value
+        if value is self.MAP_KEY_VALUE:
+            value = propertyName
 
-        # Special case: if it's a template, pull property from its attribute table.
-        # TODO: TJP just asked himself why we can't do inherited attr here?
-        if isinstance(obj, stringtemplate3.StringTemplate):
-            if obj.attributes is not None:
-                value = obj.attributes.get(str(property), None)
-            return value
+        return value
 
-        # Special case: none of the other cases.
-        methodSuffix = propertyNameStr[0].upper() + propertyNameStr[1:]
-        m = None
-        if callable(getattr(obj, f'get{methodSuffix}', None)):
-            m = getattr(obj, f'get{methodSuffix}')
-        elif callable(getattr(obj, f'is{methodSuffix}', None)):
-            m = getattr(obj, f'is{methodSuffix}')
-        elif hasattr(obj, propertyNameStr):
-            return getattr(obj, propertyNameStr)
+    @staticmethod
+    def _resolveAccessor(obj, propertyNameStr):
+        """ Work out how getObjectProperty reads propertyNameStr from obj:
+        a (kind, name) pair, or None if obj has no such property.
+        The pair is remembered when obj's class alone decides it.
+        """
+        cls = type(obj)
+        if isinstance(obj, stringtemplate3.Aggregate):
+            accessor = (_AGGREGATE, propertyNameStr)
+        elif isinstance(obj, dict):
+            accessor = (_MAP, propertyNameStr)
+        elif isinstance(obj, stringtemplate3.StringTemplate):
+            accessor = (_TEMPLATE, propertyNameStr)
         else:
-            this.error('Can\'t get property ' + propertyName +
-                       ' using method get/is' + methodSuffix +
-                       ' or direct field access from ' +
-                       obj.__class__.__name__ + ' instance')
+            methodSuffix = propertyNameStr[0].upper() + propertyNameStr[1:]
+            getter = f'get{methodSuffix}'
+            tester = f'is{methodSuffix}'
+            if callable(getattr(obj, getter, None)):
+                accessor = (_METHOD, getter)
+                if not callable(getattr(cls, getter, None)):
+                    return accessor
+            elif callable(getattr(obj, tester, None)):
+                accessor = (_METHOD, tester)
+                if not callable(getattr(cls, tester, None)):
+                    return accessor
+            elif hasattr(obj, propertyNameStr):
+                accessor = (_ATTRIBUTE, propertyNameStr)
+            else:
+                return None
+        caches.PROPERTY_ACCESSORS.put((cls, propertyNameStr), accessor)
+        return accessor
 
-        if m is not None:
-            try:
-                value = m()
-            except Exception as e:
-                this.error('Can\'t get property ' + propertyName +
-                           ' using method get/is' + methodSuffix +
-                           ' or direct field access from ' +
-                           obj.__class__.__name__ + ' instance', e)
-        return value
+    @staticmethod
+    def _propertyError(this, obj, propertyNameStr, e=None):
+        methodSuffix = propertyNameStr[0].upper() + propertyNameStr[1:]
+        this.error('Can\'t get property ' + propertyNameStr +
+                   ' using method get/is' + methodSuffix +
+                   ' or direct field access from ' +
+                   obj.__class__.__name__ + ' instance', e)
 
     def testAttributeTrue(self, a):
         """ Normally StringTemplate tests presence or absence of attributes
@@ -463,31 +586,41 @@ class ASTExpr(Expr):
 
         If this is an embedded template, you might have specified a separator arg;
         used when is a sequence."""
-        return self._write(this, o, out)
+        return self._write(this, o, out, NO_OPTIONS)
 
-    def _write(self, this, o, out):
+    def _write(self, this, o, out, options):
         """
-        Write o relative to self to out.
+        Write o relative to self to out, with the ExprOptions of this write.
 
         John Snyders fixes here for formatString.  Basically, any time
         you are about to write a value, check formatting.
         """
 
         if o is None:
-            if self._nullValue is None:
+            if options.nullValue is None:
                 return 0
-            o = self._nullValue
+            o = options.nullValue
+
+        kind = _writeKinds.get(type(o))
+        if kind is None:
+            kind = writeKind(o)
 
         n = 0
         try:
-            if isinstance(o, stringtemplate3.StringTemplate):
+            if kind == _WRITE_TEMPLATE:
                 # failsafe: perhaps enclosing instance not set
                 # Or, it could be set to another context!  This occurs
                 # when you store a template instance as an attribute of more
                 # than one template (like both a header file and C file when
                 # generating C code).  It must execute within the context of
                 # the enclosing template.
-                o.enclosingInstance = this
+                if o.enclosingInstance is not this:
+                    if o._attributes is None and o._argumentContext is None:
+                        # nothing of its own (a group map value, say), so
+                        # write a fresh instance instead of changing a
+                        # template that other renders may be writing too
+                        o = o.instanceOf
+                    o.enclosingInstance = this
                 # if this is found up the enclosing instance chain, then
                 # infinite recursion
                 if stringtemplate3.lintMode and \
@@ -501,11 +634,11 @@ class ASTExpr(Expr):
                 else:
                     # if we have a wrap string, then inform writer it
                     # might need to wrap
-                    if self._wrapString is not None:
-                        n = out.writeWrapSeparator(self._wrapString)
+                    if options.wrapString is not None:
+                        n = out.writeWrapSeparator(options.wrapString)
 
                     # check if formatting needs to be applied to the stToWrite
-                    if self._formatString is not None:
+                    if options.formatString is not None:
                         renderer = this.getAttributeRenderer(str)
                         if renderer is not None:
                             # you pay a penalty for applying format option to a
@@ -515,41 +648,48 @@ class ASTExpr(Expr):
                             buf = StringIO(u'')
                             sw = this.group.getStringTemplateWriter(buf)
                             o.write(sw)
-                            n = out.write(renderer.toString(buf.getvalue(), self._formatString))
+                            n = out.write(renderer.toString(buf.getvalue(), options.formatString))
                             return n
 
                     n = o.write(out)
                 return n
 
-            if isiterable(o):
+            if kind == _WRITE_ITERABLE:
                 if isinstance(o, dict):
                     # for mapping we want to iterate over the values
                     lst = list(o.values())
                 else:
                     lst = o
+                    if (options.wrapString is None and
+                            isinstance(o, (list, tuple)) and len(o) > 1 and
+                            type(out).write is AutoIndentWriter.write and
+                            type(out).writeSeparator is AutoIndentWriter.writeSeparator):
+                        text = self._joinScalars(this, o, options.separatorString)
+                        if text is not None:
+                            return out.write(text)
 
                 seenPrevValue = False
                 for iterValue in lst:
                     if iterValue is None:
-                        iterValue = self._nullValue
+                        iterValue = options.nullValue
 
                     if iterValue is not None:
                         if (seenPrevValue and
-                                self._separatorString is not None):
-                            n += out.writeSeparator(self._separatorString)
+                                options.separatorString is not None):
+                            n += out.writeSeparator(options.separatorString)
 
                         seenPrevValue = True
-                        n += self._write(this, iterValue, out)
+                        n += self._write(this, iterValue, out, options)
 
             else:
                 renderer = this.getAttributeRenderer(o.__class__)
                 if renderer is not None:
-                    v = renderer.toString(o, self._formatString)
+                    v = renderer.toString(o, options.formatString)
                 else:
                     v = str(o)
 
-                if self._wrapString is not None:
-                    n = out.write(v, self._wrapString)
+                if options.wrapString is not None:
+                    n = out.write(v, options.wrapString)
                 else:
                     n = out.write(v)
 
@@ -559,6 +699,26 @@ class ASTExpr(Expr):
             this.error('problem writing object: ' + o, io)
         return n
 
+    def _joinScalars(self, this, values, separator):
+        """
+        Join values with the separator, as writing them one at a time
+        with writeSeparator between would, when all are str, int or float
+        without a renderer and the result has no newline to indent after.
+        Otherwise return None.
+        """
+        types = set(map(type, values))
+        if not types <= _JOINABLE_TYPES:
+            return None
+        for cls in types:
+            if this.getAttributeRenderer(cls) is not None:
+                return None
+        if len(types) > 1 or str not in types:
+            values = [str(v) for v in values]
+        text = (separator or '').join(values)
+        if '\n' in text:
+            return None
+        return text
+
     def evaluateExpression(self, this, expr):
         """
         An expr is normally just a string literal,
@@ -579,7 +739,7 @@ class ASTExpr(Expr):
             buf = StringIO(u'')
 
             sw = this.group.getStringTemplateWriter(buf)
-            evaluator = ActionEvaluator.Walker()
+            evaluator = this.group.actionEvaluatorClass()
             evaluator.initialize(this, self, sw)
             try:
                 evaluator.action(expr)  # eval tree
@@ -624,7 +784,7 @@ class ASTExpr(Expr):
         argContextST.enclosingInstance = enclosing
         argContextST._argumentContext = this._argumentContext
 
-        eval_ = ActionEvaluator.Walker()
+        eval_ = this.group.actionEvaluatorClass()
         eval_.initialize(argContextST, self, None)
         # sys.stderr.write('eval args: ' + argumentsAST.toStringList() + '\n')
         # sys.stderr.write('ctx is ' + this.getArgumentContext())
@@ -0,0 +1,494 @@
+
+from builtins import str
+from builtins import object
+from io import StringIO
+
+from stringtemplate3.language import ActionEvaluator
+from stringtemplate3.language.ActionEvaluator import (
+    APPLY, MULTI_APPLY, ARGS, INCLUDE, VALUE, TEMPLATE, FUNCTION,
+    SINGLEVALUEARG, LIST, NOTHING, ID, ASSIGN, COLON, NOT, PLUS, DOT,
+    LITERAL_first, LITERAL_rest, LITERAL_last, LITERAL_length,
+    LITERAL_strip, LITERAL_trunc, ANONYMOUS_TEMPLATE, STRING, INT,
+    DOTDOTDOT, anonymousTemplateArgument, anonymousTemplateToApply
+)
+from stringtemplate3.language.CatIterator import CatList
+
+# Node types that start an expression (the walker's expr rule).
+EXPRESSION_TYPES = frozenset([
+    APPLY, MULTI_APPLY, INCLUDE, VALUE, FUNCTION, LIST, ID, PLUS, DOT,
+    ANONYMOUS_TEMPLATE, STRING, INT
+])
+
+FUNCTIONS = {
+    LITERAL_first: lambda chunk, a: chunk.first(a),
+    LITERAL_rest: lambda chunk, a: chunk.rest(a),
+    LITERAL_last: lambda chunk, a: chunk.last(a),
+    LITERAL_length: lambda chunk, a: chunk.length(a),
+    LITERAL_strip: lambda chunk, a: chunk.strip(a),
+    LITERAL_trunc: lambda chunk, a: chunk.trunc(a),
+}
+
+
+class _CannotCompile(Exception):
+    """ The tree is not shaped the way the compiler expects. """
+    pass
+
+
+def _interpreted(node, rule):
+    """
+    Evaluate node with the tree walker.
+    Used for anything the compiler does not handle,
+    so odd trees are evaluated (and their errors reported) exactly as before.
+    """
+    def interpret(this, chunk, out, *args):
+        walker = ActionEvaluator.Walker()
+        walker.initialize(this, chunk, out)
+        return getattr(walker, rule)(node, *args)
+    return interpret
+
+
+def compileExpression(node):
+    """
+    Return a function(this, chunk, out) computing the value
+    of the expression rooted at node, as the walker's expr rule would.
+    The function is kept on the node, so each tree is compiled once.
+    """
+    if node is None:
+        return _interpreted(node, 'expr')
+
+    closure = node.closure
+    if closure is None:
+        compiler = _EXPRESSION_COMPILERS.get(node.type, None)
+        try:
+            if compiler is None:
+                raise _CannotCompile()
+            closure = compiler(node)
+        except _CannotCompile:
+            closure = _interpreted(node, 'expr')
+        node.closure = closure
+    return closure
+
+
+def compileArguments(node):
+    """
+    Return a function(this, chunk, out, embedded, argumentContext)
+    filling in and returning the argument context, like the walker's argList rule.
+    """
+    if node is None:
+        return _interpreted(node, 'argList')
+
+    closure = node.closure
+    if closure is None:
+        try:
+            if node.type == ARGS:
+                closure = _compileArgumentAssignments(node)
+            elif node.type == SINGLEVALUEARG:
+                closure = _compileSingleTemplateArg(node)
+            else:
+                raise _CannotCompile()
+        except _CannotCompile:
+            closure = _interpreted(node, 'argList')
+        node.closure = closure
+    return closure
+
+
+def writtenValue(this, chunk, e):
+    """ The text of e as written by chunk, or None if that is empty; the value of (e). """
+    buf = StringIO(u'')
+    sw = this.group.getStringTemplateWriter(buf)
+    n = chunk.writeAttribute(this, e, sw)
+    if n > 0:
+        return buf.getvalue()
+    return None
+
+
+def setSoleArgument(this, embedded, argumentContext, e):
+    """ Pass e as the single formal argument of embedded, as in <x:bold(name)>. """
+    soleArgName = None
+    error = False
+    if e:
+        # find the sole defined formal argument for embedded
+        formalArgs = embedded.formalArguments
+        if formalArgs:
+            argNames = list(formalArgs.keys())
+            if len(argNames) == 1:
+                soleArgName = argNames[0]
+            else:
+                error = True
+    else:
+        error = True
+    if error:
+        this.error("template " + embedded.name +
+                   " must have exactly one formal arg in" +
+                   " template context " +
+                   this.enclosingInstanceStackString)
+    else:
+        this.rawSetArgumentAttribute(embedded, argumentContext, soleArgName, e)
+
+
+def _compileNegation(node):
+    """ The closure for !(expr) in an IF condition. """
+    closure = node.closure
+    if closure is None:
+        if node.firstChild is None:
+            closure = _interpreted(node, 'ifCondition')
+        else:
+            value = compileExpression(node.firstChild)
+
+            def negation(this, chunk, out):
+                return not chunk.testAttributeTrue(value(this, chunk, out))
+            closure = negation
+        node.closure = closure
+    return closure
+
+
+def _children(node):
+    child = node.firstChild
+    while child is not None:
+        yield child
+        child = child.nextSibling
+
+
+def _compilePlus(node):
+    a = node.firstChild
+    if a is None or a.nextSibling is None:
+        raise _CannotCompile()
+    left = compileExpression(a)
+    right = compileExpression(a.nextSibling)
+
+    def plus(this, chunk, out):
+        return chunk.add(left(this, chunk, out), right(this, chunk, out))
+    return plus
+
+
+def _compileTemplate(node):
+    """
+    The closure for one TEMPLATE node of a template application;
+    it appends the template to apply, if any, to templatesToApply.
+    """
+    child = node.firstChild
+    if child is None:
+        raise _CannotCompile()
+
+    if child.type == ID:
+        args = child.nextSibling
+        if args is None:
+            raise _CannotCompile()
+        templateName = child.text
+
+        def named(this, chunk, out, templatesToApply):
+            embedded = this.group.getEmbeddedInstanceOf(templateName, this)
+            if embedded:
+                embedded._argumentsAST = args
+                templatesToApply.append(embedded)
+        return named
+
+    if child.type == ANONYMOUS_TEMPLATE:
+        def anonymous(this, chunk, out, templatesToApply):
+            # to properly see overridden templates, always set
+            # anonymous' group to be self's group
+            templatesToApply.append(anonymousTemplateToApply(this, child.stringTemplate))
+        return anonymous
+
+    if child.type == VALUE:
+        nameExpr = child.firstChild
+        if nameExpr is None or nameExpr.nextSibling is None:
+            raise _CannotCompile()
+        nameValue = compileExpression(nameExpr)
+        args = nameExpr.nextSibling
+
+        def indirect(this, chunk, out, templatesToApply):
+            n = nameValue(this, chunk, out)
+            if n:
+                embedded = this.group.getEmbeddedInstanceOf(str(n), this)
+                if embedded:
+                    embedded._argumentsAST = args
+                    templatesToApply.append(embedded)
+        return indirect
+
+    raise _CannotCompile()
+
+
+def _compileApply(node):
+    a = node.firstChild
+    if a is None:
+        raise _CannotCompile()
+    attribute = compileExpression(a)
+    templates = []
+    t = a.nextSibling
+    while t is not None and t.type == TEMPLATE:
+        templates.append(_compileTemplate(t))
+        t = t.nextSibling
+    if not templates:
+        raise _CannotCompile()
+
+    def apply(this, chunk, out):
+        value = attribute(this, chunk, out)
+        templatesToApply = []
+        for template in templates:
+            template(this, chunk, out, templatesToApply)
+        return chunk.applyListOfAlternatingTemplates(this, value, templatesToApply)
+    return apply
+
+
+def _compileMultiApply(node):
+    attributes = []
+    child = node.firstChild
+    while child is not None and child.type in EXPRESSION_TYPES:
+        attributes.append(compileExpression(child))
+        child = child.nextSibling
+    if not attributes or child is None or child.type != COLON:
+        raise _CannotCompile()
+    anon = child.nextSibling
+    if anon is None or anon.type != ANONYMOUS_TEMPLATE:
+        raise _CannotCompile()
+
+    def multiApply(this, chunk, out):
+        values = [attribute(this, chunk, out) for attribute in attributes]
+        return chunk.applyTemplateToListOfAttributes(this, values, anon.stringTemplate)
+    return multiApply
+
+
+def _compileDot(node):
+    obj = node.firstChild
+    if obj is None or obj.nextSibling is None:
+        raise _CannotCompile()
+    objectValue = compileExpression(obj)
+    prop = obj.nextSibling
+
+    if prop.type == ID:
+        propName = prop.text
+
+        def dot(this, chunk, out):
+            return chunk.getObjectProperty(this, objectValue(this, chunk, out), propName)
+        return dot
+
+    if prop.type == VALUE:
+        propValue = compileExpression(prop.firstChild)
+
+        def computedDot(this, chunk, out):
+            o = objectValue(this, chunk, out)
+            return chunk.getObjectProperty(this, o, propValue(this, chunk, out))
+        return computedDot
+
+    raise _CannotCompile()
+
+
+def _compileId(node):
+    name = node.text
+
+    def attribute(this, chunk, out):
+        return this.getAttribute(name)
+    return attribute
+
+
+def _compileConstant(value):
+    def constant(this, chunk, out):
+        return value
+    return constant
+
+
+def _compileInt(node):
+    try:
+        value = int(node.text)
+    except (TypeError, ValueError):
+        raise _CannotCompile()
+    return _compileConstant(value)
+
+
+def _compileString(node):
+    return _compileConstant(node.text)
+
+
+def _compileAnonymousTemplate(node):
+    if not node.text:
+        return _compileConstant(node.text)
+
+    def anonymousTemplate(this, chunk, out):
+        return anonymousTemplateArgument(this, node)
+    return anonymousTemplate
+
+
+def _compileInclude(node):
+    child = node.firstChild
+    if child is None:
+        raise _CannotCompile()
+
+    if child.type == ID:
+        args = child.nextSibling
+        if args is None:
+            raise _CannotCompile()
+        templateName = child.text
+        if not templateName:
+            return _compileConstant(None)
+
+        def include(this, chunk, out):
+            return chunk.getTemplateInclude(this, templateName, args)
+        return include
+
+    if child.type == VALUE:
+        nameExpr = child.firstChild
+        if nameExpr is None or nameExpr.nextSibling is None:
+            raise _CannotCompile()
+        nameValue = compileExpression(nameExpr)
+        args = nameExpr.nextSibling
+
+        def indirectInclude(this, chunk, out):
+            n = nameValue(this, chunk, out)
+            if n:
+                templateName = str(n)
+                if templateName:
+                    return chunk.getTemplateInclude(this, templateName, args)
+            return None
+        return indirectInclude
+
+    raise _CannotCompile()
+
+
+def _compileFunction(node):
+    name = node.firstChild
+    if name is None or name.type not in FUNCTIONS:
+        raise _CannotCompile()
+    arg = name.nextSibling
+    if arg is None or arg.type != SINGLEVALUEARG:
+        raise _CannotCompile()
+    function = FUNCTIONS[name.type]
+    argument = compileExpression(arg.firstChild)
+
+    def call(this, chunk, out):
+        return function(chunk, argument(this, chunk, out))
+    return call
+
+
+def _compileList(node):
+    elements = []
+    for child in _children(node):
+        if child.type in EXPRESSION_TYPES:
+            elements.append(compileExpression(child))
+        elif child.type == NOTHING:
+            raise _CannotCompile()
+        else:
+            break
+    if not elements:
+        raise _CannotCompile()
+
+    def catList(this, chunk, out):
+        values = []
+        for element in elements:
+            e = element(this, chunk, out)
+            if e is not None:
+                values.append(e)
+        return CatList(values)
+    return catList
+
+
+def _compileValue(node):
+    if node.firstChild is None:
+        raise _CannotCompile()
+    expression = compileExpression(node.firstChild)
+
+    def value(this, chunk, out):
+        return writtenValue(this, chunk, expression(this, chunk, out))
+    return value
+
+
+def _compileArgumentAssignments(node):
+    assignments = []
+    for child in _children(node):
+        if child.type == ASSIGN:
+            arg = child.firstChild
+            if arg is None or arg.type != ID:
+                raise _CannotCompile()
+            assignments.append((arg.text, compileExpression(arg.nextSibling)))
+        elif child.type == DOTDOTDOT:
+            assignments.append((None, None))
+        else:
+            break
+
+    def argList(this, chunk, out, embedded, argumentContext):
+        for name, expression in assignments:
+            if expression is None:
+                embedded._passThroughAttributes = True
+                continue
+            e = expression(this, chunk, out)
+            if e:
+                this.rawSetArgumentAttribute(embedded, argumentContext, name, e)
+        return argumentContext
+    return argList
+
+
+def _compileSingleTemplateArg(node):
+    expression = compileExpression(node.firstChild)
+
+    def singleTemplateArg(this, chunk, out, embedded, argumentContext):
+        setSoleArgument(this, embedded, argumentContext, expression(this, chunk, out))
+        return argumentContext
+    return singleTemplateArg
+
+
+_EXPRESSION_COMPILERS = {
+    PLUS: _compilePlus,
+    APPLY: _compileApply,
+    MULTI_APPLY: _compileMultiApply,
+    DOT: _compileDot,
+    ID: _compileId,
+    INT: _compileInt,
+    STRING: _compileString,
+    ANONYMOUS_TEMPLATE: _compileAnonymousTemplate,
+    INCLUDE: _compileInclude,
+    FUNCTION: _compileFunction,
+    LIST: _compileList,
+    VALUE: _compileValue,
+}
+
+
+class Evaluator(object):
+    """
+    Evaluate action trees by compiling them into nested Python closures
+    instead of walking them with ActionEvaluator.Walker each time.
+
+    It has the same interface as the walker and gives the same results;
+    the closures call the same ASTExpr helpers the walker does.
+    Each tree is compiled the first time it is evaluated and the closure
+    is kept on the tree, so every later evaluation, in any template
+    sharing the tree, skips the matching and dispatching on node types.
+    Trees the compiler does not expect are handed to the walker.
+
+    Select it for a group with group.actionEvaluatorClass = 'closure',
+    or for all groups with
+    StringTemplateGroup.registerDefaultActionEvaluator(ActionCompiler.Evaluator).
+    """
+
+    def __init__(self):
+        self._this = None
+        self._chunk = None
+        self._out = None
+
+    def initialize(self, this, chunk, out):
+        self._this = this
+        self._chunk = chunk
+        self._out = out
+
+    def reportError(self, e):
+        self._this.error("eval tree parse error", e)
+
+    def action(self, tree):
+        this = self._this
+        chunk = self._chunk
+        out = self._out
+        e = compileExpression(tree)(this, chunk, out)
+        return chunk.writeAttribute(this, e, out)
+
+    def ifCondition(self, tree):
+        if tree is not None and tree.type == NOT:
+            return _compileNegation(tree)(self._this, self._chunk, self._out)
+        if tree is not None and tree.type in EXPRESSION_TYPES:
+            value = compileExpression(tree)(self._this, self._chunk, self._out)
+            return self._chunk.testAttributeTrue(value)
+        return _interpreted(tree, 'ifCondition')(self._this, self._chunk, self._out)
+
+    def argList(self, tree, embedded, initialContext):
+        argumentContext = initialContext
+        if not argumentContext:
+            argumentContext = {}
+        return compileArguments(tree)(self._this, self._chunk, self._out, embedded, argumentContext)
@@ -88,6 +88,43 @@ WS_CHAR = 43
 
 
 # ## user code>>>
+def anonymousTemplateExemplar(group, at):
+    """
+    The compiled {...} template passed as an argument value.
+    The body is compiled once for the template lexer of group
+    and kept on the tree node.
+    """
+    exemplar = at.stringTemplate
+    if exemplar is None or exemplar.group.templateLexerClass is not group.templateLexerClass:
+        from stringtemplate3.templates import StringTemplate
+        exemplar = StringTemplate(group=group, template=at.text)
+        exemplar._name = "<anonymous template argument>"
+        at.stringTemplate = exemplar
+    return exemplar
+
+
+def anonymousTemplateArgument(this, at):
+    """
+    Instantiate the {...} template passed as an argument value.
+    Each evaluation only makes a fresh instance of the compiled body.
+    """
+    group = this.group
+    valueST = anonymousTemplateExemplar(group, at).instanceOf
+    valueST.group = group
+    valueST.enclosingInstance = this
+    return valueST
+
+
+def anonymousTemplateToApply(this, exemplar):
+    """
+    Instantiate the {...} template applied to an attribute.
+    The instance, not the shared exemplar, is given this template's group
+    so that overridden templates are seen without changing the exemplar.
+    """
+    anonymous = exemplar.instanceOf
+    anonymous._group = this.group
+    return anonymous
+
 
 # ## user code<<<
 
@@ -112,6 +149,9 @@ class Walker(antlr.TreeParser):
     def reportError(self, e):
         self._this.error("eval tree parse error", e)
 
+    def anonymousTemplateArgument(self, at):
+        return anonymousTemplateArgument(self._this, at)
+
     # ## user action <<<
     def action(self, _t):
         numCharsWritten = 0
@@ -377,14 +417,7 @@ class Walker(antlr.TreeParser):
                 _t = _t.nextSibling
                 value = at.text
                 if at.text:
-                    from stringtemplate3.templates import StringTemplate
-                    valueST = StringTemplate(
-                        group=self._this.group,
-                        template=at.text
-                    )
-                    valueST.enclosingInstance = self._this
-                    valueST._name = "<anonymous template argument>"
-                    value = valueST
+                    value = self.anonymousTemplateArgument(at)
             else:
                 raise antlr.NoViableAltException(_t)
 
@@ -642,10 +675,9 @@ class Walker(antlr.TreeParser):
                 anon = _t
                 self.match(_t, ANONYMOUS_TEMPLATE)
                 _t = _t.nextSibling
-                anonymous = anon.stringTemplate
                 # to properly see overridden templates, always set
                 # anonymous' group to be self's group
-                anonymous._group = self._this.group
+                anonymous = anonymousTemplateToApply(self._this, anon.stringTemplate)
                 templatesToApply.append(anonymous)
             elif la1 and la1 in [VALUE]:
                 pass
@@ -70,6 +70,7 @@ class Parser(antlr.LLkParser):
         if stringtemplate3.crashOnActionParseError:
            raise ex
 
+        self._errorCount += 1
         group = self._this.group
         if group.name == stringtemplate3.DEFAULT_GROUP_NAME:
             self._this.error("action parse error; template context is " +
@@ -93,8 +94,14 @@ class Parser(antlr.LLkParser):
             self._this = args[1]
         else:
             raise ValueError("ActionParser requires a StringTemplate instance")
+        self._errorCount = 0
         # ## __init__ header action <<<
 
+    @property
+    def errorCount(self):
+        """ How many syntax errors were reported and recovered from. """
+        return self._errorCount
+
     def action(self):
         opts = None
 
@@ -0,0 +1,207 @@
+import re
+
+from stringtemplate3 import antlr
+from stringtemplate3.language.ActionLexer import (
+    literals, ID, INT, STRING, ANONYMOUS_TEMPLATE,
+    LBRACK, RBRACK, LPAREN, RPAREN, COMMA, DOT, ASSIGN, COLON, PLUS, SEMI, NOT, DOTDOTDOT
+)
+from stringtemplate3.language.StringTemplateToken import StringTemplateToken
+from stringtemplate3.language.TemplateChunker import scannerColumn, TokenListStream
+
+# characters ActionLexer rejects, and carriage returns, whose
+#  handling differs between its rules
+_UNSUPPORTED = re.compile('[\x00-\x02\r\uffff\U00010000-\U0010ffff]')
+
+_ID = re.compile('[A-Za-z_][A-Za-z0-9_/]*')
+_INT = re.compile('[0-9]+')
+_WS = re.compile('[ \t\n]+')
+_STRING_TEXT = re.compile('[^"\\\\]+')
+_TEMPLATE_TEXT = re.compile('[^\\\\{}]+')
+# {a, b | ...}: each whitespace is the single WS_CHAR the grammar allows
+_TEMPLATE_ARGS = re.compile('[ \t\n]?([A-Za-z_][A-Za-z0-9_/]*)'
+                            '((?:[ \t\n]?,[ \t\n]?[A-Za-z_][A-Za-z0-9_/]*)*)[ \t\n]?\\|')
+_ARG = re.compile('[A-Za-z_][A-Za-z0-9_/]*')
+
+_SINGLE = {
+    '[': LBRACK, ']': RBRACK, '(': LPAREN, ')': RPAREN, ',': COMMA, '=': ASSIGN,
+    ':': COLON, '+': PLUS, ';': SEMI, '!': NOT,
+}
+_STRING_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', 'b': '\b', 'f': '\f'}
+
+
+class _Unsupported(Exception):
+    """ Raised when ActionLexer has to tokenize the action. """
+
+
+class ActionTokenizer(object):
+    """
+    Turn the text of an action into the tokens ActionParser reads,
+    the same types, text, arguments, line and column the generated
+    ActionLexer produces, without ActionLexer's per-character
+    CharScanner overhead; most actions are a few identifiers and
+    punctuation.
+    tokenize() returns None for anything it does not handle, like
+    carriage returns or input ActionLexer would reject, so the caller
+    runs ActionLexer, which also reports the errors.
+    """
+
+    def __init__(self, action):
+        self._s = action
+        self._n = len(action)
+        self._line = 1
+        self._lineStart = 0
+        self._tokens = []
+
+    @classmethod
+    def tokenize(cls, action):
+        """ Return the tokens, ending with EOF, or None if ActionLexer has to be used. """
+        if _UNSUPPORTED.search(action):
+            return None
+        try:
+            return cls(action)._tokenize()
+        except _Unsupported:
+            return None
+
+    @classmethod
+    def tokenStream(cls, action):
+        """ A token stream over tokenize()'s tokens, or None. """
+        tokens = cls.tokenize(action)
+        if tokens is None:
+            return None
+        return TokenListStream(tokens)
+
+    def _token(self, type_, text, pos):
+        """ A token made the way CharScanner.makeToken makes them, starting at pos. """
+        token = StringTemplateToken(type_, text)
+        token.line = self._line
+        token.column = scannerColumn(self._s, self._lineStart, pos)
+        return token
+
+    def _newlines(self, begin, end):
+        """ Count the newline() calls for the newlines between begin and end. """
+        count = self._s.count('\n', begin, end)
+        if count:
+            self._line += count
+            self._lineStart = self._s.rindex('\n', begin, end) + 1
+
+    def _tokenize(self):
+        s = self._s
+        n = self._n
+        tokens = self._tokens
+        pos = 0
+        while pos < n:
+            c = s[pos]
+            type_ = _SINGLE.get(c)
+            if type_ is not None:
+                tokens.append(self._token(type_, c, pos))
+                pos += 1
+            elif c == ' ' or c == '\t' or c == '\n':
+                end = _WS.match(s, pos).end()
+                self._newlines(pos, end)
+                pos = end
+            elif c == '.':
+                if s.startswith('...', pos):
+                    tokens.append(self._token(DOTDOTDOT, '...', pos))
+                    pos += 3
+                elif s.startswith('..', pos):
+                    raise _Unsupported()
+                else:
+                    tokens.append(self._token(DOT, c, pos))
+                    pos += 1
+            elif c == '"':
+                pos = self._string(pos)
+            elif c == '{':
+                pos = self._anonymousTemplate(pos)
+            else:
+                m = _ID.match(s, pos)
+                if m:
+                    text = m.group()
+                    tokens.append(self._token(literals.get(text, ID), text, pos))
+                    pos = m.end()
+                    continue
+                m = _INT.match(s, pos)
+                if m is None:
+                    raise _Unsupported()
+                tokens.append(self._token(INT, m.group(), pos))
+                pos = m.end()
+        tokens.append(self._token(antlr.EOF_TYPE, '', n))
+        return tokens
+
+    def _string(self, pos):
+        s = self._s
+        n = self._n
+        begin = pos
+        pos += 1
+        text = []
+        while pos < n:
+            m = _STRING_TEXT.match(s, pos)
+            if m:
+                text.append(m.group())
+                pos = m.end()
+            elif s[pos] == '\\':
+                if pos + 2 >= n:
+                    raise _Unsupported()
+                c = s[pos + 1]
+                text.append(_STRING_ESCAPES.get(c, c))
+                pos += 2
+            else:
+                break
+        if pos >= n:
+            raise _Unsupported()
+        self._tokens.append(self._token(STRING, ''.join(text), begin))
+        return pos + 1
+
+    def _anonymousTemplate(self, pos):
+        s = self._s
+        begin = pos
+        pos += 1
+        args = None
+        m = _TEMPLATE_ARGS.match(s, pos)
+        if m:
+            args = [m.group(1)] + _ARG.findall(m.group(2))
+            end = m.end()
+            if end + 1 < self._n and s[end] in ' \t\n':
+                end += 1
+            self._newlines(pos, end)
+            pos = end
+        text = []
+        pos = self._templateText(pos, text)
+        text = ''.join(text)
+        if args is None:
+            self._tokens.append(self._token(ANONYMOUS_TEMPLATE, text, begin))
+        else:
+            self._tokens.append(StringTemplateToken(ANONYMOUS_TEMPLATE, text, args))
+        return pos + 1
+
+    def _templateText(self, pos, text):
+        """ Gather the text of a template, returning the position of its closing brace. """
+        s = self._s
+        n = self._n
+        while pos < n:
+            m = _TEMPLATE_TEXT.match(s, pos)
+            if m:
+                text.append(m.group())
+                pos = m.end()
+                continue
+            c = s[pos]
+            if c == '\\':
+                if pos + 1 >= n:
+                    break
+                c2 = s[pos + 1]
+                if c2 == '{' or c2 == '}':
+                    text.append(c2)
+                elif pos + 2 < n:
+                    text.append(s[pos:pos + 2])
+                else:
+                    raise _Unsupported()
+                pos += 2
+            elif c == '{':
+                text.append(c)
+                pos = self._templateText(pos + 1, text)
+                text.append('}')
+                pos += 1
+            else:
+                break
+        if pos >= n or s[pos] != '}':
+            raise _Unsupported()
+        return pos
@@ -337,31 +337,31 @@ class Lexer(antlr.CharScanner):
                   and (self.LA(5) == u'e') and (self.LA(6) == u'i')
                   and (self.LA(7) == u'f')):
                 pass
-                _saveIndex = self.text.length()
+                _saveIndex = self._text.length()
                 self.match('<')
-                self.text.setLength(_saveIndex)
+                self._text.setLength(_saveIndex)
                 self.match("elseif")
                 while True:
                     if self.LA(1) == u' ':
                         pass
-                        _saveIndex = self.text.length()
+                        _saveIndex = self._text.length()
                         self.match(' ')
-                        self.text.setLength(_saveIndex)
+                        self._text.setLength(_saveIndex)
                     else:
                         break
 
                 self.match("(")
                 self.mIF_EXPR(False)
                 self.match(")")
-                _saveIndex = self.text.length()
+                _saveIndex = self._text.length()
                 self.match('>')
-                self.text.setLength(_saveIndex)
+                self._text.setLength(_saveIndex)
                 _ttype = ELSEIF
                 if self.LA(1) == u'\n' or self.LA(1) == u'\r':
                     pass
-                    _saveIndex = self.text.length()
+                    _saveIndex = self._text.length()
                     self.mNL(False)
-                    self.text.setLength(_saveIndex)
+                    self._text.setLength(_saveIndex)
                     self.newline()
                 else:  # <m4>
                     pass
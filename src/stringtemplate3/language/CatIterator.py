@@ -52,6 +52,17 @@ def convertAnythingToList(obj):
     return list_
 
 
+def convertAnythingToIterator(obj):
+    """
+    Iterate over the values of a mapping or the elements of any other
+    iterable without copying them; anything else is a single value.
+    """
+    if isinstance(obj, dict):
+        return iter(obj.values())
+    if isiterable(obj):
+        return iter(obj)
+    return iter((obj,))
+
 
 class CatList(object):
     """ Given a list of lists, yield the combined elements one by one."""
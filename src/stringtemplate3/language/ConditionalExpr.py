@@ -3,7 +3,6 @@ from builtins import object
 from stringtemplate3 import antlr
 
 from stringtemplate3.language import ASTExpr
-from stringtemplate3.language import ActionEvaluator
 
 
 class ElseIfClauseData(object):
@@ -62,7 +61,7 @@ class ConditionalExpr(ASTExpr):
         if self._exprTree is None or this is None or out is None:
             return 0
 
-        evaluator = ActionEvaluator.Walker()
+        evaluator = this.group.actionEvaluatorClass()
         evaluator.initialize(this, self, out)
         n = 0
         try:
@@ -488,7 +488,7 @@ class Lexer(antlr.CharScanner):
                         _saveIndex = self._text.length()
                         self.match('\n')
                         self._text.setLength(_saveIndex)
-                        newline()
+                        self.newline()
                     elif ((u'\u0001' <= self.LA(1) <= u'\ufffe')
                           and (u'\u0001' <= self.LA(2) <= u'\ufffe')
                           and True and True and True and True and True):
@@ -522,7 +522,7 @@ class Lexer(antlr.CharScanner):
 
                                 self.match('\n')
                                 self.newline()
-                                atLeft = Frue
+                                atLeft = True
                             elif ((u'\u0001' <= self.LA(1) <= u'\ufffe')
                                   and (u'\u0001' <= self.LA(2) <= u'\ufffe')
                                   and True and True and True and True and True):
@@ -558,7 +558,7 @@ class Lexer(antlr.CharScanner):
                         _saveIndex = self._text.length()
                         self.match('\n')
                         self._text.setLength(_saveIndex)
-                        self.newline()()
+                        self.newline()
                         atLeft = True
                     elif ((u'\u0001' <= self.LA(1) <= u'\ufffe')
                           and True and True and True and True and True and True):
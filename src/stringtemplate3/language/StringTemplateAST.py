@@ -15,6 +15,9 @@ class StringTemplateAST(antlr.CommonAST):
         # track template for ANONYMOUS blocks
         self._st = None
 
+        # what ActionCompiler made of this subtree; never pickled
+        self._closure = None
+
     @property
     def text(self):
         return self._text
@@ -30,3 +33,16 @@ class StringTemplateAST(antlr.CommonAST):
     @stringTemplate.setter
     def stringTemplate(self, st):
         self._st = st
+
+    @property
+    def closure(self):
+        return self._closure
+
+    @closure.setter
+    def closure(self, closure):
+        self._closure = closure
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_closure'] = None
+        return state
@@ -0,0 +1,445 @@
+import re
+
+from stringtemplate3 import antlr
+from stringtemplate3.language import DefaultTemplateLexer, AngleBracketTemplateLexer
+from stringtemplate3.language.ChunkToken import ChunkToken
+from stringtemplate3.language.TemplateParser import (
+    LITERAL, NEWLINE, ACTION, IF, ELSEIF, ELSE, ENDIF, REGION_REF, REGION_DEF
+)
+
+# the generated lexers' CharScanner tab stops
+TAB_SIZE = 8
+
+# characters the generated lexers reject, and carriage returns,
+#  whose handling differs between the two lexers
+_UNSUPPORTED = re.compile('[\x00\r\uffff\U00010000-\U0010ffff]')
+
+_ESC_CHARS = {'n': '\n', 'r': '\r', 't': '\t', ' ': ' '}
+_HEX = re.compile('[0-9A-Fa-f]{4}')
+
+
+def scannerColumn(text, lineStart, pos):
+    """ The column CharScanner reports at pos, the line starting at lineStart. """
+    line = text[lineStart:pos]
+    if '\t' not in line:
+        return len(line) + 1
+    col = 1
+    for c in line:
+        if c == '\t':
+            col = ((col - 1) // TAB_SIZE + 1) * TAB_SIZE + 1
+        else:
+            col += 1
+    return col
+
+
+class _Unsupported(Exception):
+    """ Raised when the generated lexer has to chunk the template. """
+
+
+class _Delimiters(object):
+    """ The expressions used to skip ordinary text for one pair of delimiters. """
+
+    def __init__(self, start, stop):
+        self.start = start
+        self.stop = stop
+        # literal escapes, besides \\ which always stands for \
+        self.escapes = {start, stop} if start != stop else {start}
+        self.literal = re.compile('[^\\\\ \t\n\r' + re.escape(start) + ']+')
+        self.expr = re.compile('[^\\\\\n\r{+=' + re.escape(stop) + ']+')
+        self.regionName = re.compile('[^(' + re.escape(stop) + ']+')
+        self.escChar = re.compile('[0-9A-Fa-f\\\\' + re.escape(stop) + ']')
+        self.regionEnd = start + '@end' + stop
+
+
+_SUBTEMPLATE = re.compile('[^\\\\{}]+')
+_STRING = re.compile('[^"\\\\]+')
+_NESTED_PARENS = re.compile('[^()\\\\]+')
+_IF_EXPR = re.compile('[^\n\r()\\\\{]+')
+
+
+class TemplateChunker(object):
+    """
+    Break a template into the ChunkToken stream TemplateParser reads,
+    jumping between delimiters with compiled regular expressions
+    rather than matching one character at a time.
+    It produces exactly the tokens of the generated DefaultTemplateLexer
+    or AngleBracketTemplateLexer, down to their indentation, line and
+    column, including the generated lexers' quirks.
+    Anything it does not handle, like carriage returns, <<...>>
+    templates within actions and whatever the generated lexer
+    would reject, makes tokenize() return None;
+    the caller then runs the generated lexer, which reports any errors.
+    """
+
+    delimiters = {
+        DefaultTemplateLexer.Lexer: _Delimiters('$', '$'),
+        AngleBracketTemplateLexer.Lexer: _Delimiters('<', '>'),
+    }
+
+    def __init__(self, pattern, delimiters):
+        self._s = pattern
+        self._n = len(pattern)
+        self._d = delimiters
+        self._line = 1
+        self._lineStart = 0
+        self._currentIndent = None
+        self._tokens = []
+
+    @classmethod
+    def tokenize(cls, lexerClass, pattern):
+        """
+        Return the list of tokens, ending with EOF, lexerClass would
+        produce for pattern, or None if that lexer has to be used.
+        """
+        delimiters = cls.delimiters.get(lexerClass)
+        if delimiters is None or _UNSUPPORTED.search(pattern):
+            return None
+        try:
+            return cls(pattern, delimiters)._chunk()
+        except _Unsupported:
+            return None
+
+    @classmethod
+    def chunkStream(cls, lexerClass, pattern):
+        """ A token stream over tokenize()'s tokens, or None. """
+        tokens = cls.tokenize(lexerClass, pattern)
+        if tokens is None:
+            return None
+        return TokenListStream(tokens)
+
+    def _newline(self, pos):
+        """ The generated lexer called newline() with pos following the newline. """
+        self._line += 1
+        self._lineStart = pos
+
+    def _token(self, type_, text, pos):
+        """ A token made the way CharScanner.makeToken makes them, starting at pos. """
+        token = ChunkToken()
+        token.type = type_
+        token.text = text
+        token.line = self._line
+        token.column = scannerColumn(self._s, self._lineStart, pos)
+        return token
+
+    def _chunk(self):
+        s = self._s
+        n = self._n
+        start = self._d.start
+        tokens = self._tokens
+        pos = 0
+        while pos < n:
+            c = s[pos]
+            if c == '\n':
+                tokens.append(self._token(NEWLINE, '\n', pos))
+                pos += 1
+                self._newline(pos)
+                self._currentIndent = None
+            elif c == start:
+                pos = self._action(pos)
+            else:
+                pos = self._literal(pos)
+        tokens.append(self._token(antlr.EOF_TYPE, '', n))
+        return tokens
+
+    def _literal(self, pos):
+        s = self._s
+        n = self._n
+        d = self._d
+        begin = pos
+        text = []
+        while pos < n:
+            m = d.literal.match(s, pos)
+            if m:
+                text.append(m.group())
+                pos = m.end()
+                continue
+            c = s[pos]
+            if c == '\\':
+                if pos + 1 >= n:
+                    text.append(c)
+                    pos += 1
+                else:
+                    c2 = s[pos + 1]
+                    text.append(c2 if c2 == '\\' or c2 in d.escapes else c + c2)
+                    pos += 2
+            elif c == ' ' or c == '\t':
+                end = pos + 1
+                while end < n and s[end] in ' \t':
+                    end += 1
+                if pos == self._lineStart and end < n and s[end] == d.start:
+                    # store indent in ASTExpr not in a literal
+                    self._currentIndent = s[pos:end]
+                else:
+                    self._currentIndent = None
+                    text.append(s[pos:end])
+                pos = end
+            else:
+                break
+        text = ''.join(text)
+        if text:
+            self._tokens.append(self._token(LITERAL, text, begin))
+        return pos
+
+    def _action(self, pos):
+        s = self._s
+        n = self._n
+        d = self._d
+        stop = d.stop
+        atLineStart = pos == self._lineStart
+        la = s[pos + 1:pos + 8]
+        if len(la) < 2:
+            raise _Unsupported()
+
+        if la[0] == '\\' and la[1] in ' nrtu' and len(la) > 2 and d.escChar.match(la[2]):
+            return self._escapedCharacters(pos)
+        if la[0] == '!' and len(la) > 2:
+            end = s.find('!' + stop, pos + 2)
+            if end < 0:
+                raise _Unsupported()
+            newlines = s.count('\n', pos + 2, end)
+            if newlines:
+                self._line += newlines
+                self._lineStart = s.rindex('\n', pos + 2, end) + 1
+            pos = end + 2
+            if atLineStart:
+                pos = self._skipNewline(pos)
+            return pos
+        if la[0] == stop:
+            raise _Unsupported()
+
+        if la.startswith('if') and len(la) >= 6 and la[2] in ' (' and la[3] != ')':
+            return self._conditional(pos, pos + 3, IF, 'if(')
+        if la.startswith('elseif'):
+            return self._conditional(pos, pos + 7, ELSEIF, 'elseif(')
+        if la[:6] == 'endif' + stop:
+            self._addAction(ENDIF, 'endif')
+            pos += 7
+            if atLineStart:
+                pos = self._skipNewline(pos)
+            return pos
+        if la[:5] == 'else' + stop:
+            self._addAction(ELSE, 'else')
+            return self._skipNewline(pos + 6)
+        if la[0] == '@' and len(la) >= 5 and la[1] != '(' and la[1] != stop:
+            m = d.regionName.match(s, pos + 2)
+            end = m.end()
+            if s.startswith('()' + stop, end):
+                self._addAction(REGION_REF, m.group())
+                return end + 3
+            if end < n and s[end] == stop:
+                return self._regionDefinition(m.group(), end + 1)
+            raise _Unsupported()
+
+        end = self._expr(pos + 1)
+        if end == pos + 1 or end >= n or s[end] != stop:
+            raise _Unsupported()
+        self._addAction(ACTION, s[pos + 1:end])
+        return end + 1
+
+    def _regionDefinition(self, name, pos):
+        """ <@r>...<@end>, dropping the newlines next to the tags like the generated lexers. """
+        s = self._s
+        n = self._n
+        if pos < n and s[pos] == '\n' and pos + 2 < n:
+            pos += 1
+            self._newline(pos)
+        elif pos + 1 >= n:
+            raise _Unsupported()
+        end = s.find(self._d.regionEnd, pos)
+        if end < 0:
+            raise _Unsupported()
+        stop = end - 1 if end > pos and s[end - 1] == '\n' else end
+        if stop == pos:
+            raise _Unsupported()
+        body = s[pos:stop]
+        newlines = body.count('\n')
+        if newlines:
+            self._line += newlines
+            self._lineStart = s.rindex('\n', pos, stop) + 1
+        atLeft = body.endswith('\n')
+        if stop < end:
+            self._newline(end)
+            atLeft = True
+        self._addAction(REGION_DEF, name + '::=' + body)
+        pos = end + len(self._d.regionEnd)
+        if atLeft:
+            pos = self._skipNewline(pos)
+        return pos
+
+    def _addAction(self, type_, text):
+        self._tokens.append(ChunkToken(type_, text, self._currentIndent))
+
+    def _skipNewline(self, pos):
+        if pos < self._n and self._s[pos] == '\n':
+            pos += 1
+            self._newline(pos)
+        return pos
+
+    def _escapedCharacters(self, pos):
+        """ <\\n\\t\\u00A0> and the like stand for a literal. """
+        s = self._s
+        begin = pos
+        text = []
+        pos += 1
+        while pos < self._n and s[pos] == '\\':
+            c = s[pos + 1:pos + 2]
+            if c in _ESC_CHARS:
+                text.append(_ESC_CHARS[c])
+                pos += 2
+            elif c == 'u' and _HEX.match(s, pos + 2):
+                text.append(chr(int(s[pos + 2:pos + 6], 16)))
+                pos += 6
+            else:
+                raise _Unsupported()
+        if pos >= self._n or s[pos] != self._d.stop:
+            raise _Unsupported()
+        self._tokens.append(self._token(LITERAL, ''.join(text), begin))
+        return pos + 1
+
+    def _conditional(self, pos, keywordEnd, type_, prefix):
+        s = self._s
+        n = self._n
+        pos = keywordEnd
+        while pos < n and s[pos] == ' ':
+            pos += 1
+        if pos >= n or s[pos] != '(':
+            raise _Unsupported()
+        begin = pos + 1
+        end = self._ifExpr(begin)
+        if end == begin or not s.startswith(')' + self._d.stop, end):
+            raise _Unsupported()
+        self._addAction(type_, prefix + s[begin:end] + ')')
+        return self._skipNewline(end + 2)
+
+    def _escape(self, pos):
+        if pos + 1 >= self._n:
+            raise _Unsupported()
+        return pos + 2
+
+    def _ifExpr(self, pos):
+        s = self._s
+        n = self._n
+        while pos < n:
+            m = _IF_EXPR.match(s, pos)
+            if m:
+                pos = m.end()
+                continue
+            c = s[pos]
+            if c == '\\':
+                pos = self._escape(pos)
+            elif c == '\n':
+                pos += 1
+                self._newline(pos)
+            elif c == '{':
+                pos = self._subtemplate(pos)
+            elif c == '(':
+                pos = self._nestedParens(pos)
+            else:
+                break
+        return pos
+
+    def _expr(self, pos):
+        s = self._s
+        n = self._n
+        d = self._d
+        while pos < n:
+            m = d.expr.match(s, pos)
+            if m:
+                pos = m.end()
+                continue
+            c = s[pos]
+            if c == '\\':
+                pos = self._escape(pos)
+            elif c == '\n':
+                pos += 1
+                self._newline(pos)
+            elif c == '{':
+                pos = self._subtemplate(pos)
+            elif c == '+' or c == '=':
+                c2 = s[pos + 1:pos + 2]
+                if c2 == '"':
+                    pos = self._string(pos + 1)
+                elif c2 == '{':
+                    pos = self._subtemplate(pos + 1)
+                elif c2 == '<':
+                    # <<...>> templates
+                    raise _Unsupported()
+                elif c2:
+                    pos += 2
+                else:
+                    break
+            else:
+                break
+        return pos
+
+    def _subtemplate(self, pos):
+        s = self._s
+        n = self._n
+        pos += 1
+        while pos < n:
+            m = _SUBTEMPLATE.match(s, pos)
+            if m:
+                pos = m.end()
+                continue
+            c = s[pos]
+            if c == '{':
+                pos = self._subtemplate(pos)
+            elif c == '\\':
+                pos = self._escape(pos)
+            else:
+                break
+        if pos >= n or s[pos] != '}':
+            raise _Unsupported()
+        return pos + 1
+
+    def _string(self, pos):
+        s = self._s
+        n = self._n
+        pos += 1
+        while pos < n:
+            m = _STRING.match(s, pos)
+            if m:
+                pos = m.end()
+            elif s[pos] == '\\':
+                pos = self._escape(pos)
+            else:
+                break
+        if pos >= n or s[pos] != '"':
+            raise _Unsupported()
+        return pos + 1
+
+    def _nestedParens(self, pos):
+        s = self._s
+        n = self._n
+        pos += 1
+        begin = pos
+        while pos < n:
+            m = _NESTED_PARENS.match(s, pos)
+            if m:
+                pos = m.end()
+                continue
+            c = s[pos]
+            if c == '(':
+                pos = self._nestedParens(pos)
+            elif c == '\\':
+                pos = self._escape(pos)
+            else:
+                break
+        if pos == begin or pos >= n or s[pos] != ')':
+            raise _Unsupported()
+        return pos + 1
+
+
+class TokenListStream(antlr.TokenStream):
+    """ Hand a parser a list of tokens ending with EOF, as if they came from its lexer. """
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._index = 0
+
+    @property
+    def nextToken(self):
+        token = self._tokens[self._index]
+        if self._index < len(self._tokens) - 1:
+            self._index += 1
+        return token
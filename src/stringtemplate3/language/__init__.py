@@ -1,5 +1,6 @@
 from stringtemplate3.language.ASTExpr import *
 from stringtemplate3.language.ActionEvaluator import *
+from stringtemplate3.language.ActionCompiler import *
 from stringtemplate3.language.ActionLexer import *
 from stringtemplate3.language.ActionParser import *
 from stringtemplate3.language.AngleBracketTemplateLexer import *
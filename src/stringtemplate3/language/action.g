@@ -8,6 +8,7 @@ header "ActionParser.__init__" {
         self.this = args[1]
     else:
         raise ValueError("ActionParser requires a StringTemplate instance")
+    self._errorCount = 0
 }
 
 options {
@@ -41,6 +42,7 @@ tokens {
         if stringtemplate3.crashOnActionParseError:
             raise e
 
+        self._errorCount += 1
         group = self.this.group
         if group.name == stringtemplate3.DEFAULT_GROUP_NAME:
             self.this.error("action parse error; template context is "+self.this.enclosingInstanceStackString, e)
@@ -48,6 +50,10 @@ tokens {
         else:
             self.this.error("action parse error in group "+self.this.group.name+" line "+str(self.this.groupFileLine)+"; template context is "+self.this.enclosingInstanceStackString, e)
 
+    @property
+    def errorCount(self):
+        """ How many syntax errors were reported and recovered from. """
+        return self._errorCount
 }
 
 
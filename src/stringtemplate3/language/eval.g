@@ -10,6 +10,44 @@ class NameValuePair(object):
         self.name = None
         self.value = None
 
+
+def anonymousTemplateExemplar(group, at):
+    """
+    The compiled {...} template passed as an argument value.
+    The body is compiled once for the template lexer of group
+    and kept on the tree node.
+    """
+    exemplar = at.stringTemplate
+    if exemplar is None or exemplar.group.templateLexerClass is not group.templateLexerClass:
+        from stringtemplate3.templates import StringTemplate
+        exemplar = StringTemplate(group=group, template=at.text)
+        exemplar._name = "<anonymous template argument>"
+        at.stringTemplate = exemplar
+    return exemplar
+
+
+def anonymousTemplateArgument(this, at):
+    """
+    Instantiate the {...} template passed as an argument value.
+    Each evaluation only makes a fresh instance of the compiled body.
+    """
+    group = this.group
+    valueST = anonymousTemplateExemplar(group, at).instanceOf
+    valueST.group = group
+    valueST.enclosingInstance = this
+    return valueST
+
+
+def anonymousTemplateToApply(this, exemplar):
+    """
+    Instantiate the {...} template applied to an attribute.
+    The instance, not the shared exemplar, is given this template's group
+    so that overridden templates are seen without changing the exemplar.
+    """
+    anonymous = exemplar.instanceOf
+    anonymous._group = this.group
+    return anonymous
+
 }
 
 header "ActionEvaluator.__init__" {
@@ -37,6 +75,9 @@ options {
 
     def reportError(self, e):
         self.this.error("eval tree parse error", e)
+
+    def anonymousTemplateArgument(self, at):
+        return anonymousTemplateArgument(self.this, at)
 }
 
 action returns [numCharsWritten = 0]
@@ -174,10 +215,9 @@ template[templatesToApply]
              }
            | anon:ANONYMOUS_TEMPLATE
              {
-                 anonymous = anon.getStringTemplate()
                  // to properly see overridden templates, always set
                  // anonymous' group to be self's group
-                 anonymous.group = self.this.group
+                 anonymous = anonymousTemplateToApply(self.this, anon.getStringTemplate())
                  templatesToApply.append(anonymous)
              }
            | #( VALUE n=expr args2:.
@@ -236,14 +276,7 @@ attribute returns [value = None]
         {
             value = at.text
             if at.text:
-                from stringtemplate3.templates import StringTemplate
-                valueST = StringTemplate(
-                    group=self.this.group,
-                    template=at.text
-                    )
-                valueST.enclosingInstance = self.this
-                valueST.name = "<anonymous template argument>"
-                value = valueST
+                value = self.anonymousTemplateArgument(at)
         }
     ;
 
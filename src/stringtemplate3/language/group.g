@@ -124,8 +124,8 @@ template[g]
         ( args[st] | { st.defineEmptyFormalArgumentList() } )
         RPAREN
         DEFINED_TO_BE
-        ( t:STRING { st.template = t.text }
-        | bt:BIGSTRING { st.template = bt.text }
+        ( t:STRING { g._setTemplatePattern(st, t.text) }
+        | bt:BIGSTRING { g._setTemplatePattern(st, bt.text) }
         )
     |   alias:ID DEFINED_TO_BE target:ID
         { g.defineTemplateAlias(alias.text, target.text) }
@@ -292,7 +292,7 @@ ACTION
                     t = $getText
                     $setText(t+"::=")
                 }
-                ( options {greedy=true;} : ('\r'!)? '\n'! {newline();})?
+                ( options {greedy=true;} : ('\r'!)? '\n'! {$newline})?
                 { atLeft = False }
                 (
                     options {greedy=true;} // handle greedy=false with predicate
@@ -300,14 +300,14 @@ ACTION
                     ( ('\r')? '\n' 
                         {
                             $newline
-                            atLeft = Frue
+                            atLeft = True
                         }
                     | . {atLeft = False}
                     )
                 )+
                 ( ('\r'!)? '\n'! 
                     {
-                        $newline()
+                        $newline
                         atLeft = True
                     } 
                 )?
@@ -29,6 +29,7 @@ from builtins import str
 from builtins import object
 import sys
 import io
+import itertools
 from copy import copy
 import logging
 
@@ -38,19 +39,41 @@ from stringtemplate3.language import (
     FormalArgument,
     ChunkToken,
     ASTExpr, StringTemplateAST,
-    TemplateParser,
-    ActionLexer, ActionParser,
+    TemplateParser, TemplateChunker,
+    ActionLexer, ActionParser, ActionTokenizer,
     ConditionalExpr, NewlineRef,
     StringTemplateToken,
 )
 from stringtemplate3.language.FormalArgument import UNKNOWN_ARGS
 
-from stringtemplate3.writers import StringTemplateWriter
+from stringtemplate3.writers import StringTemplateWriter, MemoizingRenderer
+from stringtemplate3 import caches
 import stringtemplate3
 
 logger = logging.getLogger(__name__)
 
 
+def isShareableAction(tree, options=None):
+    """
+    Can this parsed action be shared between templates?
+    Not if it holds an anonymous subtemplate, which is compiled
+    in the context of the template the action appeared in.
+    """
+    pending = [tree]
+    if options:
+        pending.extend(value for value in options.values() if isinstance(value, antlr.BaseAST))
+    while pending:
+        node = pending.pop()
+        while node is not None:
+            if node.type == ActionParser.ANONYMOUS_TEMPLATE or node.stringTemplate is not None:
+                return False
+            child = node.firstChild
+            if child is not None:
+                pending.append(child)
+            node = node.nextSibling
+    return True
+
+
 class STAttributeList(list):
     """
     Just an alias for list, but this way I can track whether a
@@ -157,14 +180,13 @@ REGION_EXPLICIT = 3
 ANONYMOUS_ST_NAME = "anonymous"
 DEFAULT_GROUP_NAME = 'defaultGroup'
 
-# incremental counter for templates IDs
-templateCounter = 0
+# incremental counter for templates IDs; next() on it is atomic,
+#  so templates may be created from several threads at once
+templateCounter = itertools.count(1)
 
 
 def getNextTemplateCounter():
-    global templateCounter
-    templateCounter += 1
-    return templateCounter
+    return next(templateCounter)
 
 
 def resetTemplateCounter():
@@ -173,7 +195,146 @@ def resetTemplateCounter():
     can access but not really of interest to the user.
     """
     global templateCounter
-    templateCounter = 0
+    templateCounter = itertools.count(1)
+
+
+class CompiledTemplate(object):
+    """
+    The parts of a template fixed by compiling its pattern:
+    the chunks, formal arguments and regions.
+
+    An exemplar and every instance made from it share one CompiledTemplate,
+    so making an instance does not copy them.
+    Once shared, it is copied before any change (copy-on-write),
+    so changing one template never affects the others.
+    """
+
+    __slots__ = ('pattern', 'chunks', 'formalArgumentKeys', 'formalArguments',
+                 'numberOfDefaultArgumentValues', 'regions', 'isRegion', 'regionDefType',
+                 'shared', 'writeChunks')
+
+    def __init__(self):
+        self.pattern = None
+        self.chunks = None
+        self.formalArgumentKeys = None
+        self.formalArguments = UNKNOWN_ARGS
+        self.numberOfDefaultArgumentValues = 0
+        self.regions = set()
+        self.isRegion = False
+        self.regionDefType = None
+        # set once a second template refers to this
+        self.shared = False
+        # function(template, out) doing what write does with the chunks,
+        # generated ahead of time by stringtemplate3.compilers; None to walk them
+        self.writeChunks = None
+
+    def copy(self):
+        c = CompiledTemplate()
+        c.pattern = self.pattern
+        c.chunks = copy(self.chunks)
+        c.formalArgumentKeys = copy(self.formalArgumentKeys)
+        if self.formalArguments is not UNKNOWN_ARGS:
+            c.formalArguments = copy(self.formalArguments)
+        c.numberOfDefaultArgumentValues = self.numberOfDefaultArgumentValues
+        c.regions = set(self.regions)
+        c.isRegion = self.isRegion
+        c.regionDefType = self.regionDefType
+        return c
+
+
+# Blank templates share this until they are compiled.
+EMPTY_COMPILED_TEMPLATE = CompiledTemplate()
+EMPTY_COMPILED_TEMPLATE.shared = True
+
+
+def findRenderer(renderers, attributeClassType):
+    """
+    The renderer in renderers for attributeClassType or else for the
+    nearest of its base classes, in method resolution order; None if none.
+    """
+    for cls in getattr(attributeClassType, '__mro__', (attributeClassType,)):
+        renderer = renderers.get(cls)
+        if renderer is not None:
+            return renderer
+    return None
+
+
+# Marks a class whose renderer is not resolved yet.
+_NO_RENDERER = object()
+
+
+class AttributeScope(object):
+    """
+    The attribute references of one write() of a template, resolved as
+    StringTemplate.get resolves them and remembered until the write ends.
+
+    Names not found in the template's attributes or argument context, and
+    not hidden by one of its formal arguments, are looked up in the scope
+    of the enclosing instance.  While that instance is being written its
+    scope is shared by every template it encloses, so each name is
+    resolved once per enclosing write instead of once per reference.
+    Renderers are remembered the same way, per class written.
+    """
+
+    __slots__ = ('_template', '_values', '_renderers', '_enclosing')
+
+    def __init__(self, template):
+        self._template = template
+        self._values = {}
+        self._renderers = {}
+        self._enclosing = None
+
+    def renderer(self, attributeClassType):
+        renderers = self._renderers
+        renderer = renderers.get(attributeClassType, _NO_RENDERER)
+        if renderer is _NO_RENDERER:
+            this = self._template
+            renderer = None
+            if this._attributeRenderers:
+                renderer = findRenderer(this._attributeRenderers, attributeClassType)
+            if renderer is None:
+                if this._enclosingInstance is not None:
+                    renderer = this._enclosingInstance.getAttributeRenderer(attributeClassType)
+                else:
+                    renderer = this.group.getAttributeRenderer(attributeClassType)
+            renderers[attributeClassType] = renderer
+        return renderer
+
+    def lookup(self, name):
+        values = self._values
+        if name in values:
+            return values[name]
+        value = self._resolve(name)
+        values[name] = value
+        return value
+
+    def _resolve(self, name):
+        this = self._template
+        attributes = this._attributes
+        if attributes and name in attributes:
+            return attributes[name]
+
+        argContext = this._argumentContext
+        if argContext and name in argContext:
+            return argContext[name]
+
+        if not this._passThroughAttributes and this.hasFormalArgument(name):
+            return None
+
+        enclosing = this._enclosingInstance
+        if not enclosing:
+            return this.group.getMap(name)
+
+        scope = self._enclosing
+        if scope is None:
+            scope = enclosing._scope
+            if scope is None:
+                scope = AttributeScope(enclosing)
+            self._enclosing = scope
+        value = scope.lookup(name)
+        if not value:
+            this.checkNullAttributeAgainstFormalArguments(this, name)
+        return value
 
 
 class StringTemplate(object):
@@ -183,6 +344,15 @@ class StringTemplate(object):
     StringTemplate< ignores everything outside of attribute expressions,
     treating it as just text to spit out when you call StringTemplate.toString().
     """
+
+    # Instances are made for every template invocation, so they keep no
+    # __dict__.  _lineSeparator, _referencedAttributes and _groupFileLine
+    # stay unset until something gives them a value.
+    __slots__ = ('_name', '_templateID', '_group', '_nativeGroup', '_compiled', '_deferred',
+                 '_attributes', '_attributeRenderers', '_enclosingInstance', '_argumentContext',
+                 '_argumentsAST', '_passThroughAttributes', '_listener', '_scope',
+                 '_lineSeparator', '_referencedAttributes', '_groupFileLine', '__weakref__')
+
     @property
     def defaultGroup(self):
         return StringTemplateGroup(name='defaultGroup', rootDir='.')
@@ -198,39 +368,30 @@ class StringTemplate(object):
         Or:
           Create a template
         """
-        self._lineSeparator = lineSeparator
-        self._referencedAttributes = None
+        if lineSeparator != os.linesep:
+            self._lineSeparator = lineSeparator
         self._name = ANONYMOUS_ST_NAME if name is None else name
         self._templateID = getNextTemplateCounter()
         self._enclosingInstance = None
         self._argumentContext = None
         self._argumentsAST = None
-        self._formalArgumentKeys = None
-        self._formalArguments = UNKNOWN_ARGS
-        self._numberOfDefaultArgumentValues = 0
         self._passThroughAttributes = False
         self._nativeGroup = None
+        self._deferred = False
 
-        if group is not None:
-            assert isinstance(group, StringTemplateGroup)
-            self._group = group
-        else:
-            self._group = StringTemplateGroup(
-                name=DEFAULT_GROUP_NAME, rootDir='.', lineSeparator=self._lineSeparator)
+        # without a group, a default group is made when first needed
+        assert group is None or isinstance(group, StringTemplateGroup)
+        self._group = group
 
         if lexer is not None:
-            self._group.templateLexerClass = lexer
-
-        self._groupFileLine = None
+            self.group.templateLexerClass = lexer
 
         self._listener = None
-        self._pattern = None
         self._attributes = None
         self._attributeRenderers = None
-        self._chunks = None
-        self._regionDefType = None
-        self._isRegion = False
-        self._regions = set()
+        self._compiled = EMPTY_COMPILED_TEMPLATE
+        # the AttributeScope of the write() in progress, if any
+        self._scope = None
 
         if template is not None:
             assert isinstance(template, str)
@@ -257,7 +418,7 @@ class StringTemplate(object):
 
     @property
     def referencedAttributes(self):
-        return self._referencedAttributes
+        return getattr(self, '_referencedAttributes', None)
 
     @property
     def attributes(self):
@@ -312,11 +473,11 @@ class StringTemplate(object):
         """
         Does this template come from a <@region>...<@end> embedded in another template?
         """
-        return self._isRegion
+        return self._compiled.isRegion
 
     @isRegion.setter
     def isRegion(self, value):
-        self._isRegion = value
+        self._mutableCompiled.isRegion = value
 
     @property
     def attributeRenderers(self):
@@ -342,11 +503,11 @@ class StringTemplate(object):
         Not really used again after initial "compilation", setup/parsing.
         Equivalent to the 'template' property?
         """
-        return self._pattern
+        return self._compiled.pattern
 
     @pattern.setter
     def pattern(self, pattern):
-        self._pattern = pattern
+        self._mutableCompiled.pattern = pattern
 
     @property
     def chunks(self):
@@ -355,11 +516,11 @@ class StringTemplate(object):
         This is compiled when the template is loaded/defined and walked
         to write out a template instance.
         """
-        return self._chunks
+        return self._compiled.chunks
 
     @chunks.setter
     def chunks(self, chunks):
-        self._chunks = chunks
+        self._mutableCompiled.chunks = chunks
 
     @property
     def formalArgumentKeys(self):
@@ -373,30 +534,30 @@ class StringTemplate(object):
         When actually rendering the template, the cardinality is checked.
         This is a {str:FormalArgument} dictionary.
         """
-        return self._formalArgumentKeys
+        return self._compiled.formalArgumentKeys
 
     @formalArgumentKeys.setter
     def formalArgumentKeys(self, formalArgumentKeys):
-        self._formalArgumentKeys = formalArgumentKeys
+        self._mutableCompiled.formalArgumentKeys = formalArgumentKeys
 
     @property
     def formalArguments(self):
-        return self._formalArguments
+        return self._compiled.formalArguments
 
     @formalArguments.setter
     def formalArguments(self, formalArgument):
-        self._formalArguments = formalArgument
+        self._mutableCompiled.formalArguments = formalArgument
 
     @property
     def numberOfDefaultArgumentValues(self):
         """
         How many formal arguments to this template have default values specified?
         """
-        return self._numberOfDefaultArgumentValues
+        return self._compiled.numberOfDefaultArgumentValues
 
     @numberOfDefaultArgumentValues.setter
     def numberOfDefaultArgumentValues(self, values):
-        self._numberOfDefaultArgumentValues = values
+        self._mutableCompiled.numberOfDefaultArgumentValues = values
 
     @property
     def name(self):
@@ -439,6 +600,10 @@ class StringTemplate(object):
         its group will be the subgroup.
         That's the way polymorphism works.
         """
+        if self._group is None:
+            self._group = StringTemplateGroup(
+                name=DEFAULT_GROUP_NAME, rootDir='.',
+                lineSeparator=getattr(self, '_lineSeparator', os.linesep))
         return self._group
 
     @group.setter
@@ -458,11 +623,11 @@ class StringTemplate(object):
         """
         Set of implicit and embedded regions for this template.
         """
-        return self._regions
+        return self._compiled.regions
 
     @regions.setter
     def regions(self, value):
-        self._regions = value
+        self._mutableCompiled.regions = value
 
     @property
     def regionDefType(self):
@@ -475,33 +640,45 @@ class StringTemplate(object):
         We need to prevent more than one manual def though.
         Between this var and isEmbeddedRegion we can determine these cases.
         """
-        return self._regionDefType
+        return self._compiled.regionDefType
 
     @regionDefType.setter
     def regionDefType(self, value):
-        self._regionDefType = value
+        self._mutableCompiled.regionDefType = value
+
+    @property
+    def compiled(self):
+        """
+        The CompiledTemplate holding this template's chunks, formal arguments and regions.
+        Treat it as read-only; it may be shared with other instances.
+        """
+        return self._compiled
+
+    @property
+    def _mutableCompiled(self):
+        """ The compiled parts, first copied if other templates share them. """
+        if self._compiled.shared:
+            self._compiled = self._compiled.copy()
+        # a generated writer only knows the parts it was generated from
+        self._compiled.writeChunks = None
+        return self._compiled
 
     def dup(self, fr, to):
         """
         Make the 'to' template look exactly like the 'from' template except for the attributes.
         This is like creating an instance of a class in that the executable code is the same
         (the template chunks), but the instance data is blank (the attributes).
+        The compiled parts are shared, not copied.
         Do not copy the enclosingInstance pointer since you will want self
         template to eval in a context different from the exemplar.
         """
-        to.attributeRenderers = fr.attributeRenderers
-        to.pattern = copy(fr.pattern)
-        to.chunks = copy(fr.chunks)
-        to.formalArgumentKeys = copy(fr.formalArgumentKeys)
-        to.formalArguments = copy(fr.formalArguments)
-        to.numberOfDefaultArgumentValues = fr.numberOfDefaultArgumentValues
-        to.name = copy(fr.name)
-        to.nativeGroup = fr.nativeGroup
-        to.group = fr.group
-        to.listener = copy(fr.listener)
-        to.regions = fr.regions
-        to.isRegion = fr.isRegion
-        to.regionDefType = fr.regionDefType
+        fr._compiled.shared = True
+        to._compiled = fr._compiled
+        to._attributeRenderers = fr._attributeRenderers
+        to._name = fr._name
+        to._nativeGroup = fr._nativeGroup
+        to._group = fr.group
+        to._listener = fr._listener
 
     @property
     def instanceOf(self):
@@ -518,7 +695,7 @@ class StringTemplate(object):
             t = self._nativeGroup.createStringTemplate()
 
         else:
-            t = self._group.createStringTemplate()
+            t = self.group.createStringTemplate()
 
         self.dup(self, t)
         return t
@@ -561,7 +738,7 @@ class StringTemplate(object):
         if self.enclosingInstance is not None:
             return self.enclosingInstance.groupFileLine
 
-        return self._groupFileLine
+        return getattr(self, '_groupFileLine', None)
 
     @groupFileLine.setter
     def groupFileLine(self, groupFileLine):
@@ -569,20 +746,38 @@ class StringTemplate(object):
 
     @property
     def template(self):
-        return self._pattern
+        return self._compiled.pattern
 
     @template.setter
     def template(self, template):
-        self._pattern = template
+        self._mutableCompiled.pattern = template
         self.breakTemplateIntoChunks()
 
+    def deferTemplate(self, template):
+        """
+        Set the pattern without breaking it into chunks yet;
+        compileDeferred does that, when the group first looks this template up.
+        """
+        self._mutableCompiled.pattern = template
+        self._deferred = True
+
+    @property
+    def isDeferred(self):
+        return self._deferred
+
+    def compileDeferred(self):
+        """ Break a deferred pattern into chunks, reporting any errors now; only ever once. """
+        if self._deferred:
+            self._deferred = False
+            self.breakTemplateIntoChunks()
+
     @property
     def errorListener(self):
         """
         Where to report errors
         """
         if not self._listener:
-            return self._group.errorListener
+            return self.group.errorListener
         return self._listener
 
     @errorListener.setter
@@ -730,7 +925,7 @@ class StringTemplate(object):
         Throw KeyError if the named attribute is not formally defined
         in self's specific template and a formal argument list exists.
         """
-        if self._formalArguments != UNKNOWN_ARGS and not self.hasFormalArgument(name):
+        if self._compiled.formalArguments != UNKNOWN_ARGS and not self.hasFormalArgument(name):
             # a normal call to setAttribute with unknown attribute
             raise KeyError(f"no such attribute: {name} in template context " +
                            self.enclosingInstanceStackString)
@@ -759,41 +954,53 @@ class StringTemplate(object):
         The chunks will be identical (point at same list) for all instances of self template.
         """
 
-        if self._group.debugTemplateOutput:
-            self._group.emitTemplateStartDebugString(self, out)
+        group = self.group
+        if group.debugTemplateOutput:
+            group.emitTemplateStartDebugString(self, out)
 
         n = 0
         self.predefinedAttributes = None
         self.setDefaultArgumentValues()
-        if self._chunks:
-            i = 0
-            while i < len(self._chunks):
-                a = self._chunks[i]
-                chunkN = 0 if a is None else a.write(self, out)
-
-                # expr-on-first-line-with-no-output NEWLINE => NEWLINE
-                if (chunkN == 0 and
-                        i == 0 and
-                        i + 1 < len(self._chunks) and
-                        isinstance(self._chunks[i + 1], NewlineRef)):
-                    # skip next NEWLINE
-                    i += 2  # skip *and* advance!
-                    continue
-
-                # NEWLINE expr-with-no-output NEWLINE => NEWLINE
-                # Indented $...$ have the indent stored with the ASTExpr
-                # so the indent does not come out as a StringRef
-                if (not chunkN) and (i - 1) >= 0 and \
-                        isinstance(self._chunks[i - 1], NewlineRef) and \
-                        (i + 1) < len(self._chunks) and \
-                        isinstance(self._chunks[i + 1], NewlineRef):
-                    logger.debug('found pure \\n blank \\n pattern\n')
-                    i += 1  # make it skip over the next chunk, the NEWLINE
-                n += chunkN
-                i += 1
+        # resolve references through a scope for this write, unless
+        # get() is overridden or lint mode tracks every reference
+        previousScope = self._scope
+        if type(self).get is StringTemplate.get and not stringtemplate3.lintMode:
+            self._scope = AttributeScope(self)
+        chunks = self._compiled.chunks
+        try:
+            if self._compiled.writeChunks is not None:
+                n = self._compiled.writeChunks(self, out)
+            elif chunks:
+                i = 0
+                while i < len(chunks):
+                    a = chunks[i]
+                    chunkN = 0 if a is None else a.write(self, out)
+
+                    # expr-on-first-line-with-no-output NEWLINE => NEWLINE
+                    if (chunkN == 0 and
+                            i == 0 and
+                            i + 1 < len(chunks) and
+                            isinstance(chunks[i + 1], NewlineRef)):
+                        # skip next NEWLINE
+                        i += 2  # skip *and* advance!
+                        continue
+
+                    # NEWLINE expr-with-no-output NEWLINE => NEWLINE
+                    # Indented $...$ have the indent stored with the ASTExpr
+                    # so the indent does not come out as a StringRef
+                    if (not chunkN) and (i - 1) >= 0 and \
+                            isinstance(chunks[i - 1], NewlineRef) and \
+                            (i + 1) < len(chunks) and \
+                            isinstance(chunks[i + 1], NewlineRef):
+                        logger.debug('found pure \\n blank \\n pattern\n')
+                        i += 1  # make it skip over the next chunk, the NEWLINE
+                    n += chunkN
+                    i += 1
+        finally:
+            self._scope = previousScope
 
-        if self._group.debugTemplateOutput:
-            self._group.emitTemplateStopDebugString(self, out)
+        if group.debugTemplateOutput:
+            group.emitTemplateStopDebugString(self, out)
 
         if stringtemplate3.lintMode:
             self.checkForTrouble()
@@ -873,6 +1080,13 @@ class StringTemplate(object):
         return o
 
     def getAttribute(self, name):
+        scope = self._scope
+        if scope is not None:
+            try:
+                return scope.lookup(name)
+            except KeyError:
+                # let get() report the missing attribute
+                pass
         return self.get(self, name)
 
     __getitem__ = getAttribute
@@ -883,8 +1097,9 @@ class StringTemplate(object):
         chunks: Strings and actions/expressions.
         """
 
-        logger.debug(f'parsing template: {self._pattern}')
-        if not self._pattern:
+        pattern = self._compiled.pattern
+        logger.debug(f'parsing template: {pattern}')
+        if not pattern:
             return
         try:
             # instead of creating a specific template lexer, use
@@ -892,10 +1107,14 @@ class StringTemplate(object):
             # The default is DefaultTemplateLexer.
             # The only constraint is that you use an ANTLR lexer,
             # so I can use the special ChunkToken.
-            lexerClass = self._group.templateLexerClass
-            chunkStream = lexerClass(io.StringIO(self._pattern))
-            chunkStream._this = self
-            chunkStream.setTokenObjectClass(ChunkToken)
+            # The built-in lexers' chunks usually come from the
+            # much faster TemplateChunker instead.
+            lexerClass = self.group.templateLexerClass
+            chunkStream = TemplateChunker.TemplateChunker.chunkStream(lexerClass, pattern)
+            if chunkStream is None:
+                chunkStream = lexerClass(antlr.StringCharBuffer(pattern))
+                chunkStream._this = self
+                chunkStream.setTokenObjectClass(ChunkToken)
             chunkifier = TemplateParser.Parser(chunkStream)
             chunkifier.template(self)
         except Exception as ex:
@@ -913,20 +1132,35 @@ class StringTemplate(object):
             self.error('problem parsing template \'' + name + '\' ', ex)
 
     def parseAction(self, action):
-        lexer = ActionLexer.Lexer(io.StringIO(str(action)))
+        """
+        Parse the text of an action into an expression chunk.
+        Parsed actions are shared through caches.ACTION_CACHE, so the
+        trees and option tables must never be modified once built.
+        Actions holding anonymous subtemplates are bound to this template
+        and are never shared, nor are actions that had syntax errors.
+        """
+        action = str(action)
+        lexerClass = self.group.templateLexerClass
+        key = (lexerClass, action)
+        parsed = caches.ACTION_CACHE.get(key)
+        if parsed is not None:
+            return self._newActionExpr(*parsed)
+
+        lexer = ActionTokenizer.ActionTokenizer.tokenStream(action)
+        if lexer is None:
+            lexer = ActionLexer.Lexer(antlr.StringCharBuffer(action))
+            lexer.setTokenObjectClass(StringTemplateToken)
         parser = ActionParser.Parser(lexer, self)
         parser.setASTNodeClass(StringTemplateAST)
-        lexer.setTokenObjectClass(StringTemplateToken)
         try:
             options = parser.action()
             tree = parser.AST
             if not tree:
                 return None
 
-            if tree.type == ActionParser.CONDITIONAL:
-                return ConditionalExpr(self, tree)
-            else:
-                return ASTExpr(self, tree, options)
+            if parser.errorCount == 0 and isShareableAction(tree, options):
+                caches.ACTION_CACHE.put(key, (tree, options))
+            return self._newActionExpr(tree, options)
 
         except antlr.RecognitionException as re:
             if stringtemplate3.crashOnActionParseError:
@@ -939,10 +1173,16 @@ class StringTemplate(object):
 
         return None
 
+    def _newActionExpr(self, tree, options):
+        if tree.type == ActionParser.CONDITIONAL:
+            return ConditionalExpr(self, tree)
+        return ASTExpr(self, tree, options)
+
     def addChunk(self, e):
-        if not self._chunks:
-            self._chunks = []
-        self._chunks.append(e)
+        compiled = self._mutableCompiled
+        if not compiled.chunks:
+            compiled.chunks = []
+        compiled.chunks.append(e)
 
     # ----------------------------------------------------------------------------
     #                      F o r m a l  A r g  S t u f f
@@ -961,15 +1201,16 @@ class StringTemplate(object):
         the template attributes table just for consistency's sake.
         """
 
-        if not self._numberOfDefaultArgumentValues:
+        compiled = self._compiled
+        if not compiled.numberOfDefaultArgumentValues:
             return
         if not self._argumentContext:
             self._argumentContext = {}
-        if self._formalArguments != UNKNOWN_ARGS:
-            argNames = self._formalArgumentKeys
+        if compiled.formalArguments != UNKNOWN_ARGS:
+            argNames = compiled.formalArgumentKeys
             for argName in argNames:
                 # use the default value then
-                arg = self._formalArguments[argName]
+                arg = compiled.formalArguments[argName]
                 if arg.defaultValueST:
                     existingValue = self.getAttribute(argName)
                     if not existingValue:  # value unset?
@@ -995,42 +1236,48 @@ class StringTemplate(object):
         return arg
 
     def getFormalArgument(self, name):
-        return self._formalArguments[name]
+        return self._compiled.formalArguments[name]
 
     def hasFormalArgument(self, name):
-        return name in self._formalArguments
+        return name in self._compiled.formalArguments
 
     def defineEmptyFormalArgumentList(self):
-        self._formalArgumentKeys = []
-        self._formalArguments = {}
+        compiled = self._mutableCompiled
+        compiled.formalArgumentKeys = []
+        compiled.formalArguments = {}
 
     def defineFormalArgument(self, names, defaultValue=None):
         if not names:
             return
+        compiled = self._mutableCompiled
         if isinstance(names, str):
             name = names
             if defaultValue:
-                self._numberOfDefaultArgumentValues += 1
+                compiled.numberOfDefaultArgumentValues += 1
             a = FormalArgument(name, defaultValue)
-            if self._formalArguments == UNKNOWN_ARGS:
-                self._formalArguments = {}
-            self._formalArgumentKeys = [name]
-            self._formalArguments[name] = a
+            if compiled.formalArguments == UNKNOWN_ARGS:
+                compiled.formalArguments = {}
+            compiled.formalArgumentKeys = [name]
+            compiled.formalArguments[name] = a
         elif isinstance(names, list):
             for name in names:
                 a = FormalArgument(name, defaultValue)
-                if self._formalArguments == UNKNOWN_ARGS:
-                    self._formalArgumentKeys = []
-                    self._formalArguments = {}
-                self._formalArgumentKeys.append(name)
-                self._formalArguments[name] = a
+                if compiled.formalArguments == UNKNOWN_ARGS:
+                    compiled.formalArgumentKeys = []
+                    compiled.formalArguments = {}
+                compiled.formalArgumentKeys.append(name)
+                compiled.formalArguments[name] = a
 
-    def registerRenderer(self, attributeClassType, renderer):
+    def registerRenderer(self, attributeClassType, renderer, memoSize=None):
         """
         Register a renderer for all objects of a particular type.  This
         overrides any renderer set in the group for this class type.
+        With memoSize, the renderer is wrapped in a MemoizingRenderer
+        remembering that many results.
         """
 
+        if memoSize is not None:
+            renderer = MemoizingRenderer(renderer, maxSize=memoSize)
         if not self._attributeRenderers:
             self._attributeRenderers = {}
         self._attributeRenderers[attributeClassType] = renderer
@@ -1039,11 +1286,16 @@ class StringTemplate(object):
         """
         What renderer is registered for this attributeClassType for
         this template.  If not found, the template's group is queried.
+        A renderer registered for a base class applies to its subclasses.
         """
 
+        scope = self._scope
+        if scope is not None:
+            return scope.renderer(attributeClassType)
+
         renderer = None
-        if self._attributeRenderers is not None:
-            renderer = self._attributeRenderers.get(attributeClassType, None)
+        if self._attributeRenderers:
+            renderer = findRenderer(self._attributeRenderers, attributeClassType)
 
         if renderer is not None:
             # found it
@@ -1055,7 +1307,7 @@ class StringTemplate(object):
             return self.enclosingInstance.getAttributeRenderer(attributeClassType)
 
         # else check group
-        return self._group.getAttributeRenderer(attributeClassType)
+        return self.group.getAttributeRenderer(attributeClassType)
 
     # ----------------------------------------------------------------------------
     #                      U t i l i t y  R o u t i n e s
@@ -1080,10 +1332,11 @@ class StringTemplate(object):
         Indicates that 'name' has been referenced in self template.
         """
 
-        if not self._referencedAttributes:
-            self._referencedAttributes = []
-        if name not in self._referencedAttributes:
-            self._referencedAttributes.append(name)
+        referenced = getattr(self, '_referencedAttributes', None)
+        if referenced is None:
+            referenced = self._referencedAttributes = []
+        if name not in referenced:
+            referenced.append(name)
 
     @classmethod
     def isRecursiveEnclosingInstance(cls, st):
@@ -1159,7 +1412,7 @@ class StringTemplate(object):
 
     @property
     def templateDeclaratorString(self):
-        return f'<{self._name}({self._formalArgumentKeys})@{self._templateID}>'
+        return f'<{self._name}({self._compiled.formalArgumentKeys})@{self._templateID}>'
 
     def getTemplateHeaderString(self, showAttributes):
         if showAttributes and self._attributes is not None:
@@ -1198,9 +1451,9 @@ class StringTemplate(object):
         # compare, looking for SET BUT NOT REFERENCED ATTRIBUTES
         if not self._attributes:
             return
+        referenced = getattr(self, '_referencedAttributes', None)
         for name in list(self._attributes.keys()):
-            if self._referencedAttributes and \
-                    name not in self._referencedAttributes:
+            if referenced and name not in referenced:
                 self.warning(self._name + ': set but not used: ' + name)
 
         # can do the reverse, but will have lots of False warnings :(
@@ -1228,17 +1481,17 @@ class StringTemplate(object):
         return s + ']'
 
     def addRegionName(self, name):
-        self._regions.add(name)
+        self._mutableCompiled.regions.add(name)
 
     def containsRegionName(self, name):
-        return name in self._regions
+        return name in self._compiled.regions
 
     def toDebugString(self):
         buf = io.StringIO(u'')
         buf.write('template-' + self.templateDeclaratorString + ': ')
         buf.write('chunks=')
-        if self._chunks:
-            buf.write(str(self._chunks))
+        if self._compiled.chunks:
+            buf.write(str(self._compiled.chunks))
         buf.write('\n')
         buf.write('attributes=[')
         if self._attributes:
@@ -1263,7 +1516,7 @@ class StringTemplate(object):
         Returns a string representation of the
         """
         out = io.StringIO(u'')
-        wr = self._group.getStringTemplateWriter(out)
+        wr = self.group.getStringTemplateWriter(out)
         wr.lineWidth = lineWidth
         try:
             self.write(wr)
@@ -1381,7 +1634,7 @@ class StringTemplate(object):
                                 o.getDependencyGraph(edges, showAttributes)  # descend
 
         # look in chunks too for template refs
-        for chunk in self._chunks:
+        for chunk in self._compiled.chunks or []:
             if not isinstance(chunk, ASTExpr):
                 continue
 
@@ -1395,7 +1648,7 @@ class StringTemplate(object):
                 templateInclude = t.firstChild.text
                 # System.out.println("found include "+templateInclude);
                 self.putToMultiValuedMap(edges, srcNode, templateInclude)
-                group = self._group
+                group = self.group
                 if group is not None:
                     st = group.getInstanceOf(templateInclude)
                     # descend into the reference template
@@ -1411,15 +1664,16 @@ class StringTemplate(object):
     def printDebugString(self, out=sys.stderr):
         out.write('template-' + self._name + ':\n')
         out.write('chunks=')
-        if self._chunks:
-            totalChunks = len(self._chunks)
-            for ix, chunk in enumerate(self._chunks):
+        chunks = self._compiled.chunks
+        if chunks:
+            totalChunks = len(chunks)
+            for ix, chunk in enumerate(chunks):
                 chunkN = out.write(str(chunk))
                 if ((not chunkN) and
                         (ix - 1) >= 0 and
-                        isinstance(self._chunks[ix - 1], NewlineRef) and
+                        isinstance(chunks[ix - 1], NewlineRef) and
                         (ix + 1) < totalChunks and
-                        isinstance(self._chunks[ix + 1], NewlineRef)):
+                        isinstance(chunks[ix + 1], NewlineRef)):
                     logger.debug('found pure \\n blank \\n pattern\n')
         else:
             out.write('no chunks found\n')
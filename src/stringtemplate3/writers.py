@@ -24,10 +24,15 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
+import datetime
+import decimal
+import fractions
 import os
 from builtins import object
 from collections import abc
 
+from stringtemplate3.caches import LRUCache
+
 
 class AttributeRenderer(object):
     """
@@ -54,6 +59,71 @@ class AttributeRenderer(object):
         pass
 
 
+# Marks a value the memo has not seen.
+_NOT_REMEMBERED = object()
+
+
+class MemoizingRenderer(AttributeRenderer):
+    """
+    Wrap a renderer, remembering what it returned for values of immutable
+    types, so formatting the same date or amount again is a lookup.
+
+    Results are kept per (type, value, formatName) in an LRUCache of
+    maxSize entries, whose hits and misses tell how much the memo saves.
+    Values equal to each other can still render differently, like
+    Decimal('1.5') and Decimal('1.50'), 0.0 and -0.0, or the same instant
+    in two time zones, so only the valueKeyedTypes are keyed by value;
+    the other immutable types are keyed by repr().
+    Values of other types always go to the renderer.  Register one with
+    StringTemplateGroup.registerRenderer(cls, renderer, memoSize=n).
+    """
+
+    defaultImmutableTypes = frozenset([
+        bool, int, float, complex, str, bytes,
+        decimal.Decimal, fractions.Fraction,
+        datetime.date, datetime.datetime, datetime.time, datetime.timedelta,
+    ])
+
+    # types whose equal values always render alike
+    valueKeyedTypes = frozenset([
+        bool, int, str, bytes, fractions.Fraction, datetime.date, datetime.timedelta,
+    ])
+
+    def __init__(self, renderer, maxSize=1024, immutableTypes=None):
+        super().__init__()
+        self._renderer = renderer
+        self._memo = LRUCache(maxSize)
+        if immutableTypes is None:
+            immutableTypes = self.defaultImmutableTypes
+        self._immutableTypes = frozenset(immutableTypes)
+
+    @property
+    def renderer(self):
+        return self._renderer
+
+    @property
+    def memo(self):
+        """ The LRUCache of results, with its hits, misses and hitRate. """
+        return self._memo
+
+    def toString(self, o, formatName=None):
+        if type(o) not in self._immutableTypes:
+            return self._renderer.toString(o, formatName)
+        if type(o) in self.valueKeyedTypes:
+            key = (type(o), o, formatName)
+        else:
+            key = (type(o), repr(o), formatName)
+        try:
+            result = self._memo.get(key, _NOT_REMEMBERED)
+        except TypeError:
+            # an unhashable value
+            return self._renderer.toString(o, formatName)
+        if result is _NOT_REMEMBERED:
+            result = self._renderer.toString(o, formatName)
+            self._memo.put(key, result)
+        return result
+
+
 # tag::string_template_writer[]
 class StringTemplateWriter(object):
     """
@@ -147,6 +217,9 @@ class AutoIndentWriter(StringTemplateWriter):
         # # stack of indents
         self._indents = [None]  # start with no indent
 
+        # # the indents joined together; None until needed after a push or pop
+        self._indentString = None
+
         # # Stack of integer anchors (char positions in line)
         self._anchors = []
 
@@ -180,16 +253,28 @@ class AutoIndentWriter(StringTemplateWriter):
         must be able to pop them back off stack.
         """
         self._indents.append(indent)
+        self._indentString = None
 
     def popIndentation(self):
+        self._indentString = None
         return self._indents.pop(-1)
 
+    @property
+    def indentation(self):
+        """
+        The whole indentation written at the start of a line.
+        """
+        if self._indentString is None:
+            self._indentString = ''.join(
+                ind for ind in self._indents if ind is not None and isinstance(ind, abc.Sized))
+        return self._indentString
+
     @property
     def indentationWidth(self):
         """
         Get the width of the total indentation.
         """
-        return sum(len(ind) for ind in self._indents if ind is not None and isinstance(ind, abc.Sized))
+        return len(self.indentation)
 
     @property
     def lastAnchor(self):
@@ -213,6 +298,11 @@ class AutoIndentWriter(StringTemplateWriter):
         before spitting out this str.
 
         If a line-separator is encountered, write it out unchanged.
+
+        The text is written a line at a time rather than a char at a time.
+        The char position is only needed for wrapping,
+        so it is not tracked when lineWidth is NO_WRAP;
+        set lineWidth before writing.
         """
         assert isinstance(text, str), repr(text)
 
@@ -221,25 +311,34 @@ class AutoIndentWriter(StringTemplateWriter):
             n += self.writeWrapSeparator(wrap)
 
         # Ignore any \r respond only to \n
-        for ch in text:
-            if ch in '\r':
-                continue
-
-            if ch in '\n':
-                self._atStartOfLine = True
-                self._charPosition = -1  # set so the write below sets to 0
-                n += len(self._line_sep)
-                self._out.write(self._line_sep)
-                self._charPosition += n
-                continue
-
-            if self._atStartOfLine:
-                n += self.indent()
-                self._atStartOfLine = False
-
-            n += 1
-            self._out.write(ch)
-            self._charPosition += 1
+        if '\r' in text:
+            text = text.replace('\r', '')
+
+        tracking = self._lineWidth != self.NO_WRAP
+        out = self._out
+        length = len(text)
+        start = 0
+        while start < length:
+            newline = text.find('\n', start)
+            end = length if newline < 0 else newline
+            if end > start:
+                if self._atStartOfLine:
+                    n += self.indent()
+                    self._atStartOfLine = False
+                out.write(text if end - start == length else text[start:end])
+                n += end - start
+                if tracking:
+                    self._charPosition += end - start
+
+            if newline < 0:
+                break
+
+            self._atStartOfLine = True
+            n += len(self._line_sep)
+            out.write(self._line_sep)
+            if tracking:
+                self._charPosition = n - 1
+            start = newline + 1
 
         return n
 
@@ -290,13 +389,11 @@ class AutoIndentWriter(StringTemplateWriter):
 
     def indent(self, spaces=None):
         if spaces is None:
-            n = 0
-            for ind in self._indents:
-                if ind is not None and isinstance(ind, abc.Sized):
-                    n += len(ind)
-                    self._out.write(ind)
-
-            self._charPosition += n
+            indentation = self.indentation
+            n = len(indentation)
+            if n:
+                self._out.write(indentation)
+                self._charPosition += n
             return n
 
         else:
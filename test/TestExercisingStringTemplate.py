@@ -1,20 +1,40 @@
 
+import datetime
+import decimal
+import gc
+import importlib.util
 import io
 import logging
+import os
+import pickle
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+import sys
 from textwrap import dedent
 
 import pytest
 import temppathlib
 
 import TestStringHelper as tsh
-from TestStringHelper import (ErrorBuffer)
+from TestStringHelper import (ErrorBuffer, actionTokens, chunkTokens, chunkTuples, tokenTuples)
+from stringtemplate3 import antlr, compilers
+from stringtemplate3.caches import (ACTION_CACHE, PROPERTY_ACCESSORS, CompileCache, DirectoryIndex,
+                                   NegativeCache, loadCompiled)
 from stringtemplate3.grouploaders import PathGroupLoader
 from stringtemplate3.groups import StringTemplateGroup as St3G
+from stringtemplate3.groups import StringTemplateGroupHandle as St3Gh
 from stringtemplate3.interfaces import StringTemplateGroupInterface as St3Gi
-from stringtemplate3.language import (DefaultTemplateLexer,
+from stringtemplate3.language import (ActionEvaluator, DefaultTemplateLexer,
                                       AngleBracketTemplateLexer)
+from stringtemplate3.language.ActionTokenizer import ActionTokenizer
+from stringtemplate3.language.ASTExpr import (ASTExpr, ExprOptions, _writeKinds, _WRITE_ITERABLE,
+                                              _WRITE_SCALAR)
+from stringtemplate3.language.TemplateChunker import TemplateChunker
 from stringtemplate3.templates import StringTemplate as St3T
+from stringtemplate3.writers import AutoIndentWriter, MemoizingRenderer
 
 """
  [The "BSD licence"]
@@ -1342,3 +1362,1015 @@ def test_ComputedPropertyName():
     assert "" == str(errors)
     assert str(t) == "variable property type=int"
 
+
+
+def test_QueueWrapsAroundAndGrows():
+    q = antlr.Queue()
+    for i in range(10):
+        q.append(i)
+    for _ in range(8):
+        q.removeFirst()
+    for i in range(10, 40):
+        q.append(i)
+    assert q.length() == 32
+    assert q.elementAt(0) == 8
+    assert q.elementAt(31) == 39
+    assert q.toList() == list(range(8, 40))
+
+
+def test_StringCharBufferMatchesCharBuffer():
+    """ the string backed buffer must produce the same chunks as the char-by-char one """
+    template = "a $x$ b\n$if(y)$ $y; separator=\", \"$ $else$ none $endif$\r\n$z:{<$it$>}$ tail\n"
+    tokens = []
+    for source in (antlr.CharBuffer(antlr.Reader(io.StringIO(template))),
+                   antlr.StringCharBuffer(template)):
+        lexer = DefaultTemplateLexer.Lexer(source)
+        lexer._this = St3T()
+        tokens.append([(t.type, t.text) for t in lexer])
+    assert tokens[0] == tokens[1]
+    assert len(tokens[1]) > 5
+
+
+def test_CompileCacheReusesCompiledGroupFile():
+    templates = dedent("""\
+        group cached;
+        typeInit ::= ["int":"0", default:key]
+        page(title, items) ::= <<
+        <title>: <items:{<it>}; separator=", "><if(!items)>none<endif>
+        <@footer()>
+        >>
+        @page.footer() ::= "(<typeInit.(title)>)"
+        """)
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        cache = CompileCache(tmp_dir.path / "cache")
+        St3G.registerCompileCache(cache)
+        try:
+            first = St3G(file=io.StringIO(templates), errors=ErrorBuffer())
+            second = St3G(file=io.StringIO(templates), errors=ErrorBuffer())
+        finally:
+            St3G.registerCompileCache(None)
+
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert second.templates["page"] is not first.templates["page"]
+    assert second.templates["page"].group is second
+    for group in (first, second):
+        st = group.getInstanceOf("page")
+        st["title"] = "int"
+        st["items"] = [1, 2]
+        assert str(st) == "int: 1, 2\n(0)"
+        st = group.getInstanceOf("page")
+        st["title"] = "x"
+        assert str(st) == "x: none\n(x)"
+
+
+def test_CompileCacheReusesCompiledTemplateFile():
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        tsh.write_file(tmp_dir.path / "page.st", "[$@body$default$@end$] $names:{n|<$n$>}$")
+        cache = CompileCache(tmp_dir.path / "cache")
+        groups = []
+        for _ in range(2):
+            group = St3G("cachedDir", tmp_dir.path)
+            group.compileCache = cache
+            st = group.getInstanceOf("page")
+            st["names"] = ["a", "b"]
+            assert str(st) == "[default] <a><b>"
+            groups.append(group)
+
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert groups[1].isDefinedInThisGroup("region__page__body")
+
+
+class _PlantedEntry:
+    def __init__(self, marker):
+        self.marker = marker
+
+    def __reduce__(self):
+        return Path.touch, (self.marker,)
+
+
+def test_CompileCacheRefusesForeignClasses():
+    templates = "group planted;\npage(x) ::= \"<x>\"\n"
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        cache = CompileCache(tmp_dir.path / "cache")
+        St3G.registerCompileCache(cache)
+        try:
+            St3G(file=io.StringIO(templates), errors=ErrorBuffer())
+            assert (cache.directory.stat().st_mode & 0o777) == 0o700
+            marker = tmp_dir.path / "ran"
+            for entry in cache.directory.iterdir():
+                entry.write_bytes(pickle.dumps(_PlantedEntry(marker)))
+            group = St3G(file=io.StringIO(templates), errors=ErrorBuffer())
+        finally:
+            St3G.registerCompileCache(None)
+
+        assert not marker.exists()
+        assert cache.hits == 0
+        assert str(group.getInstanceOf("page", attributes={"x": 1})) == "1"
+
+
+def _globalCall(module, name, argument):
+    """ A protocol 4 pickle calling module.name(argument), naming it with STACK_GLOBAL. """
+    def text(s):
+        data = s.encode()
+        return pickle.SHORT_BINUNICODE + bytes([len(data)]) + data
+    return (pickle.PROTO + b"\x04" + text(module) + text(name) + pickle.STACK_GLOBAL +
+            text(argument) + pickle.TUPLE1 + pickle.REDUCE + pickle.STOP)
+
+
+def test_CachesExportOnlyItsPublicNames():
+    namespace = {}
+    exec("from stringtemplate3.caches import *", namespace)
+    del namespace["__builtins__"]
+    assert sorted(namespace) == sorted(["LRUCache", "NegativeCache", "AccessorCache", "DirectoryIndex",
+                                        "CompileCache", "dumpCompiled", "loadCompiled"])
+
+
+def test_CompileCacheRefusesDottedNames():
+    templates = "group plantedDotted;\npage(x) ::= \"<x>\"\n"
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        marker = tmp_dir.path / "ran"
+        # caches imports os, so caches.os.mkdir would reach os.mkdir
+        payload = _globalCall("stringtemplate3.caches", "os.mkdir", str(marker))
+        with pytest.raises(pickle.UnpicklingError):
+            loadCompiled(St3G("dotted"), payload)
+        with pytest.raises(pickle.UnpicklingError):
+            loadCompiled(St3G("reexported"), _globalCall("stringtemplate3.caches", "Path", "x"))
+
+        cache = CompileCache(tmp_dir.path / "cache")
+        St3G.registerCompileCache(cache)
+        try:
+            St3G(file=io.StringIO(templates), errors=ErrorBuffer())
+            for entry in cache.directory.iterdir():
+                entry.write_bytes(payload)
+            group = St3G(file=io.StringIO(templates), errors=ErrorBuffer())
+        finally:
+            St3G.registerCompileCache(None)
+
+        assert not marker.exists()
+        assert cache.hits == 0
+        assert str(group.getInstanceOf("page", attributes={"x": 1})) == "1"
+
+
+def test_ActionParsesAreSharedBetweenTemplates():
+    ACTION_CACHE.clear()
+    group = St3G("actionCache")
+    a = St3T(group=group, template="$name; separator=\", \"$ and $names:{n|[$n$]}$")
+    b = St3T(group=group, template="<$name; separator=\", \"$> $names:{n|[$n$]}$")
+    assert ACTION_CACHE.hits >= 1
+    assert 0.0 < ACTION_CACHE.hitRate < 1.0
+    assert a.chunks[0].AST is b.chunks[1].AST
+    # anonymous templates are compiled for their enclosing template
+    assert a.chunks[2].AST is not b.chunks[3].AST
+    for t in (a, b):
+        t["name"] = ["x", "y"]
+        t["names"] = ["p", "q"]
+    assert str(a) == "x, y and [p][q]"
+    assert str(b) == "<x, y> [p][q]"
+
+
+def test_AnonymousTemplateArgumentCompiledOnce():
+    group = St3G("anonArg")
+    group.defineTemplate("bold", "<b>$it$</b>")
+    t = St3T(group=group, template='$names:{n|$bold(it={$n$!})$}$')
+    t["names"] = ["a", "b", "c"]
+    assert str(t) == "<b>a!</b><b>b!</b><b>c!</b>"
+
+    applied = next(n for n in _walkAST(t.chunks[0].AST) if n.type == ActionEvaluator.ANONYMOUS_TEMPLATE)
+    nodes = _walkAST(applied.stringTemplate.chunks[0].AST)
+    node = next(n for n in nodes if n.type == ActionEvaluator.ANONYMOUS_TEMPLATE)
+    exemplar = node.stringTemplate
+    assert exemplar is not None
+    assert str(t) == "<b>a!</b><b>b!</b><b>c!</b>"
+    assert node.stringTemplate is exemplar
+
+
+def _walkAST(node):
+    while node is not None:
+        yield node
+        yield from _walkAST(node.firstChild)
+        node = node.nextSibling
+
+
+def test_InstancesShareCompiledTemplate():
+    group = St3G("sharedCompiled")
+    exemplar = group.defineTemplate("item", "<$it$>")
+    exemplar.defineFormalArgument(["it"])
+    a = group.getInstanceOf("item")
+    b = group.getInstanceOf("item")
+    assert a.compiled is exemplar.compiled
+    assert b.chunks is exemplar.chunks
+
+    # changing one instance copies its compiled parts first
+    a.defineFormalArgument(["extra"])
+    assert a.compiled is not exemplar.compiled
+    assert exemplar.formalArgumentKeys == ["it"]
+    assert b.formalArgumentKeys == ["it"]
+    b["it"] = "x"
+    assert str(b) == "<x>"
+
+
+def test_BlankTemplateGroupCreatedOnDemand():
+    t = St3T()
+    assert t._group is None
+    assert t.group.name == "defaultGroup"
+    assert t.group is t.group
+
+
+def test_InstancesKeepNoDictionary():
+    group = St3G("slottedInstances", lineSeparator="\n")
+    group.defineTemplate("item", "<$it$>")
+    t = group.getInstanceOf("item")
+    assert not hasattr(t, "__dict__")
+    assert t.referencedAttributes is None
+    assert t.groupFileLine is None
+    t["it"] = "x"
+    assert str(t) == "<x>"
+
+    blank = St3T("a\nb", lineSeparator="\r\n")
+    assert blank.group.lineSeparator == "\r\n"
+
+
+class CharAtATimeWriter(AutoIndentWriter):
+    """ the original char by char AutoIndentWriter.write, kept as a reference """
+
+    def write(self, text, wrap=None):
+        n = 0
+        if wrap is not None:
+            n += self.writeWrapSeparator(wrap)
+        for ch in text:
+            if ch == '\r':
+                continue
+            if ch == '\n':
+                self._atStartOfLine = True
+                self._charPosition = -1
+                n += len(self._line_sep)
+                self._out.write(self._line_sep)
+                self._charPosition += n
+                continue
+            if self._atStartOfLine:
+                n += self.indent()
+                self._atStartOfLine = False
+            n += 1
+            self._out.write(ch)
+            self._charPosition += 1
+        return n
+
+
+@pytest.mark.parametrize("lineWidth", [AutoIndentWriter.NO_WRAP, 12])
+def test_AutoIndentWriterMatchesCharAtATime(lineWidth):
+    group = St3G("writerConformance")
+    group.defineTemplate("item", "  $it$\r\n\n$it$:\t")
+    t = St3T(group=group, template=dedent("""\
+        begin
+            $names:item(); wrap, separator=", "$
+          $if(names)$
+            x$names; wrap="\\n--"$y
+          $endif$
+        end"""))
+    t["names"] = ["alpha", "beta", "gamma delta", "\n", "eps"]
+
+    outputs = []
+    for writerClass in (AutoIndentWriter, CharAtATimeWriter):
+        buf = io.StringIO()
+        writer = writerClass(buf, line_sep="\r\n")
+        writer.lineWidth = lineWidth
+        count = t.write(writer)
+        outputs.append((count, buf.getvalue()))
+    assert outputs[0] == outputs[1]
+
+
+def test_ClosureEvaluatorMatchesWalker():
+    source = dedent("""\
+        group evaluators;
+        page(names, pairs, user, which) ::= <<
+        <names:item(); separator=", ">
+        <names,pairs:{n, p | <n>=<p>}; separator=";">
+        <user.name> <user.("name")> <length(names)> <first(names)> <last(rest(names))>
+        <[names, "extra", 3]:{x | (<x>)}>
+        <if(!user.admin)>guest<else>admin <user.name><endif> <if(user.name)>named<endif>
+        <(which)(it=user.name)> <box(...)> <box(names)> <strip(["a", which])>
+        <names:{n | <n:(which)()>}:item()> <["a" + "b", (user.name + "!")]>
+        >>
+        item(it) ::= "[<it>]"
+        wrapped(it) ::= "{<it>}"
+        box(names) ::= "|<trunc(names); separator=\\"|\\">|"
+        """)
+
+    class User:
+        name = "ter"
+        admin = False
+
+    outputs = []
+    for evaluator in ("walker", "closure"):
+        errors = ErrorBuffer()
+        group = St3G(file=io.StringIO(source), errors=errors)
+        group.actionEvaluatorClass = evaluator
+        t = group.getInstanceOf("page")
+        t["names"] = ["a", "b", "c"]
+        t["pairs"] = [1, 2]
+        t["user"] = User()
+        t["which"] = "wrapped"
+        outputs.append((str(t), str(errors)))
+    assert outputs[0] == outputs[1]
+    assert outputs[0] == (dedent("""\
+        [a], [b], [c]
+        a=1;b=2;c=
+        ter ter 3 a c
+        (a)(b)(c)(extra)(3)
+        guest named
+        {ter} |a|b| |a|b| awrapped
+        [{a}][{b}][{c}] abter!"""), "")
+
+    action = group.lookupTemplate("item").chunks[1].AST
+    assert action.closure is not None
+
+
+def _importGeneratedModule(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_GroupCompiledToModuleRendersLikeInterpreter():
+    source = dedent("""\
+        group precompiled;
+        page(title, names, which) ::= <<
+        <@header>== <title> ==<@end>
+        <names:item(); separator=", "> <names:{n | <n>!}>
+        <if(!names)>none<else><length(names)> <first(names)><endif>
+        <(which)(it=title)> <boxed(x={<title>?})> <colors.(title)> <colors.green>
+        <defaulted()>
+        >>
+        item(it) ::= "[<it>]"
+        wrapped(it) ::= "{<it>}"
+        boxed(x) ::= "|<x>|"
+        defaulted(a="A") ::= "<a>"
+        colors ::= ["red":"#f00", default:key]
+        """)
+    attributes = dict(title="red", names=["a", "b"], which="wrapped")
+
+    interpreted = St3G(file=io.StringIO(source))
+    st = interpreted.getInstanceOf("page")
+    for name, value in attributes.items():
+        st[name] = value
+    expected = str(st)
+
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        path = tmp_dir.path / "precompiled_st.py"
+        path.write_text(compilers.compileGroup(St3G(file=io.StringIO(source))))
+        module = _importGeneratedModule("precompiled_st", path)
+
+    assert expected == dedent("""\
+        == red ==
+        [a], [b] a!b!
+        2 a
+        {red} |red?| #f00 green
+        A""")
+    assert module.page(**attributes) == expected
+    assert module.render("item", {"it": 1}) == "[1]"
+    page = module.group.templates["page"]
+    assert page.compiled.writeChunks is not None
+    assert page.chunks[0].AST.closure is not None
+
+
+def test_TemplateDirectoryCompiledToModule():
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        root = tmp_dir.path / "site"
+        (root / "parts").mkdir(parents=True)
+        (root / "hello.st").write_text("Hello $name$ $parts/em(x=name)$")
+        (root / "parts" / "em.st").write_text("*$x$*")
+        output = tmp_dir.path / "site_st.py"
+
+        assert compilers.main([str(root), "-o", str(output)]) == 0
+        module = _importGeneratedModule("site_st", output)
+
+    assert module.NAME == "site"
+    assert module.hello(name="ter") == "Hello ter *ter*"
+    assert module.parts_em(x=1) == "*1*"
+
+
+@pytest.mark.parametrize("evaluator", ["walker", "closure"])
+def test_GroupRenderedFromManyThreads(evaluator):
+    base = St3G(file=io.StringIO(dedent("""\
+        group threadedBase;
+        page(names, sep) ::= <<
+        <names:{n | <item(it=n)>}; separator=sep, null="?"> <units.(sep)>
+        >>
+        item(it) ::= "[<it>]"
+        units ::= [",":"<sep><sep>", default:"none"]
+        """)))
+    sub = St3G(file=io.StringIO('group threadedSub; item(it) ::= "(<it>)"\n'))
+    sub.superGroup = base
+    for group in (base, sub):
+        group.actionEvaluatorClass = evaluator
+
+    def render(i):
+        group = sub if i % 2 else base
+        st = group.getInstanceOf("page")
+        st["names"] = [str(i), None, "x"]
+        st["sep"] = ","[:i % 3]
+        return str(st)
+
+    expected = [render(i) for i in range(24)]
+    assert expected[:2] == ["[0][?][x] none", "(1),(?),(x) ,,"]
+
+    start = threading.Barrier(8)
+
+    def renderAll(offset):
+        start.wait()
+        return [render(i) for i in range(offset, 24)] * 20
+
+    # switch threads as often as possible to interleave the renders
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(renderAll, range(8)))
+    finally:
+        sys.setswitchinterval(interval)
+    for offset, rendered in enumerate(results):
+        assert rendered == expected[offset:] * 20
+
+
+def test_ParallelAttributeIterationStreamsIterables():
+    st = St3T(template='$names,phones,salaries:{n,p,s | $i$:$n$@$p$:$s$}; separator=", "$')
+    st["names"] = (name for name in ["Ter", "Tom", "Sriram"])
+    st["phones"] = iter(["1", "2"])
+    st["salaries"] = {"ter": "big"}
+    assert str(st) == "1:Ter@1:big, 2:Tom@2:, 3:Sriram@:"
+
+
+def test_MissingTemplatesAreLookedForOnce(monkeypatch):
+    looked = []
+    load = St3G.loadTemplateFromBeneathRootDir
+
+    def countingLoad(group, fileName):
+        looked.append((group.name, fileName))
+        return load(group, fileName)
+
+    monkeypatch.setattr(St3G, "loadTemplateFromBeneathRootDir", countingLoad)
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        errors = ErrorBuffer()
+        base = St3G(name="missingBase", rootDir=tmp_dir.path, errors=errors)
+        sub = St3G(name="missingSub", rootDir=tmp_dir.path, errors=errors, superGroup=base)
+
+        assert not sub.isDefined("nope")
+        assert not sub.isDefined("nope")
+        assert sub.lookupTemplate("nope") is None
+        assert not base.isDefined("nope")
+        assert looked == [("missingSub", "nope.st"), ("missingBase", "nope.st")]
+        assert "nope" not in sub.templates
+
+        base.defineTemplate("nope", "found")
+        assert str(sub.getInstanceOf("nope")) == "found"
+
+        looked.clear()
+        sub.missingTemplates = NegativeCache(ttl=0)
+        assert not sub.isDefined("ghost")
+        assert not sub.isDefined("ghost")
+        assert looked.count(("missingSub", "ghost.st")) == 2
+
+
+def test_DirectoryIndexAnswersFileLookups(monkeypatch):
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        root = tmp_dir.path / "site"
+        (root / "parts").mkdir(parents=True)
+        (root / "hello.st").write_text("Hello $parts/em(x=name)$")
+        (root / "parts" / "em.st").write_text("*$x$*")
+        (root / "base.stg").write_text('group base;\nbold(x) ::= "**<x>**"\n')
+
+        index = DirectoryIndex()
+        assert index.isFile(root / "hello.st")
+        assert not index.isFile(root / "late.st")
+        (root / "late.st").write_text("late")
+        assert not index.isFile(root / "late.st")
+        index.refresh()
+        assert index.isFile(root / "late.st")
+
+        manifest = tmp_dir.path / "site.manifest"
+        index.writeManifest(manifest, root)
+        index = DirectoryIndex.fromManifest(manifest, root=root)
+
+        def noScan(path):
+            raise AssertionError(f"listed {path}")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(os, "scandir", noScan)
+            errors = ErrorBuffer()
+            group = St3G(name="indexed", rootDir=root, errors=errors)
+            group.directoryIndex = index
+            st = group.getInstanceOf("hello")
+            st["name"] = "ter"
+            assert str(st) == "Hello *ter*"
+
+            loader = PathGroupLoader(dirs=str(root), errors=errors, directoryIndex=index)
+            assert str(loader.loadGroup("base").getInstanceOf("bold", attributes={"x": 1})) == "**1**"
+            assert loader.loadGroup("nope") is None
+        assert not group.isDefined("nope")
+
+
+def test_RefreshIntervalReloadsOnlyChangedTemplates():
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        baseDir = tmp_dir.path / "base"
+        subDir = tmp_dir.path / "sub"
+        baseDir.mkdir()
+        subDir.mkdir()
+        (baseDir / "page.st").write_text("[$@body$ $part()$]")
+        (baseDir / "part.st").write_text("part")
+        (subDir / "other.st").write_text("other")
+
+        errors = ErrorBuffer()
+        base = St3G(name="reloadBase", rootDir=baseDir, errors=errors)
+        sub = St3G(name="reloadSub", rootDir=subDir, errors=errors, superGroup=base)
+        assert str(sub.getInstanceOf("page")) == "[part]"
+        part = base.lookupTemplate("part")
+        assert not sub.isDefined("late")
+
+        (baseDir / "page.st").write_text("[$@body$body$@end$ $part()$ edited]")
+        (subDir / "late.st").write_text("late")
+        assert str(sub.getInstanceOf("page")) == "[part]"
+
+        base.refreshInterval = 0
+        sub.refreshInterval = 0
+        assert str(sub.getInstanceOf("page")) == "[body part edited]"
+        assert base.lookupTemplate("part") is part
+        assert str(sub.getInstanceOf("late")) == "late"
+
+        (baseDir / "page.st").unlink()
+        assert not sub.isDefined("page")
+        assert "region__page__body" not in base.templates
+
+
+def test_GroupHandleSwapsVersionsUnderRenders():
+    with temppathlib.TemporaryDirectory() as tmp_dir:
+        path = tmp_dir.path / "deployed.stg"
+        path.write_text('group deployed;\npage(x) ::= "v1 <x>"\n')
+        errors = ErrorBuffer()
+        handle = St3Gh.fromFile(str(path), errors=errors)
+        assert handle.version == 1
+
+        inFlight = handle.getInstanceOf("page", attributes={"x": 1})
+        previous = weakref.ref(handle.group)
+        path.write_text('group deployed;\npage(x) ::= "v2 <x>"\n')
+        assert handle.reload().result().name == "deployed"
+
+        assert handle.version == 2
+        assert St3G.nameToGroupMap["deployed"] is handle.group
+        assert str(handle.getInstanceOf("page", attributes={"x": 2})) == "v2 2"
+        assert str(inFlight) == "v1 1"
+        del inFlight
+        gc.collect()
+        assert previous() is None
+
+        path.write_text('group deployed;\npage(x) ::= "v3 <x"\n')
+        with pytest.raises(ValueError):
+            handle.reload().result()
+        assert handle.version == 2
+        assert St3G.nameToGroupMap["deployed"] is handle.group
+        assert str(handle.getInstanceOf("page", attributes={"x": 3})) == "v2 3"
+
+
+def test_LazyCompilationDefersTemplateBodies(monkeypatch):
+    monkeypatch.setattr(St3G, "defaultLazyCompilation", True)
+    errors = ErrorBuffer()
+    group = St3G(file=io.StringIO(dedent("""\
+        group lazy;
+        page(x) ::= "<@title>T<@end> <x>"
+        other() ::= "other"
+        broken() ::= "<foo(>"
+        """)), errors=errors)
+    templates = group.templates
+    assert templates["page"].isDeferred and templates["broken"].isDeferred
+    assert "region__page__title" not in templates
+    assert str(errors) == ""
+
+    assert group.isDefinedInThisGroup("region__page__title")
+    assert not templates["page"].isDeferred and templates["other"].isDeferred
+    assert str(group.getInstanceOf("page", attributes={"x": 1})) == "T 1"
+
+    group.getInstanceOf("broken")
+    reported = str(errors)
+    assert reported.startswith("unexpected token")
+    group.getInstanceOf("broken")
+    assert str(errors) == reported
+
+
+def test_CompileExecutorCompilesGroupFileInProcesses(monkeypatch):
+    monkeypatch.setattr(St3G, "defaultLazyCompilation", False)
+    monkeypatch.setattr(St3G, "minParallelTemplates", 1)
+    source = dedent("""\
+        group parallel;
+        page(x) ::= "<@title>T<@end> <x:item(); separator=\\",\\">"
+        item(it) ::= "[<it>]"
+        wrap(x) ::= <<
+        <x:{y | (<y>)}>
+        >>
+        broken() ::= "<foo(>"
+        """) + "".join(f'line{i}() ::= "{i}"\n' for i in range(40))
+
+    serialErrors = ErrorBuffer()
+    serial = St3G(file=io.StringIO(source), errors=serialErrors)
+    with ProcessPoolExecutor(2) as executor:
+        St3G.registerCompileExecutor(executor)
+        try:
+            errors = ErrorBuffer()
+            group = St3G(file=io.StringIO(source), errors=errors)
+        finally:
+            St3G.registerCompileExecutor(None)
+    assert sorted(group.templates) == sorted(serial.templates)
+    assert all(not st.isDeferred for st in group.templates.values())
+    assert str(errors) == str(serialErrors)
+    assert str(errors).startswith("unexpected token")
+    attributes = {"x": [1, 2]}
+    for name in ("page", "wrap", "line7"):
+        assert (str(group.getInstanceOf(name, attributes=attributes)) ==
+                str(serial.getInstanceOf(name, attributes=attributes)))
+
+
+@pytest.mark.parametrize("lexerClass, delimiters", [
+    (DefaultTemplateLexer.Lexer, "$$"),
+    (AngleBracketTemplateLexer.Lexer, "<>"),
+])
+def test_TemplateChunkerMatchesGeneratedLexers(lexerClass, delimiters):
+    patterns = [
+        "",
+        "plain text, no actions",
+        "Hi <name>!\n  <items:{it | <it>\t}; separator=\", \">\n\t<x.(\"y\")>\n",
+        "  <a><b>\n<if(x)>\n  yes\n<elseif((y))>\nmaybe<else>\nno\n<endif>\nend",
+        "<! a comment\n over lines !>\n<if (x)>1<endif>\n",
+        "\\<escaped\\> \\\\ \\z <\\n\\t\\ \\u00e9><x:t(arg={<it>})> <a+{b}>",
+        "X<@r()>Y<@s>\nbody\n<@end>\nZ",
+        "tail \\",
+    ]
+    for pattern in patterns:
+        pattern = pattern.replace("<", delimiters[0]).replace(">", delimiters[1])
+        tokens = TemplateChunker.tokenize(lexerClass, pattern)
+        assert tokens is not None, pattern
+        assert chunkTuples(tokens) == chunkTuples(chunkTokens(lexerClass, pattern)), pattern
+
+    for pattern in ["a\r\nb", "<x", "<x:{y>", "a <@r>no end"]:
+        pattern = pattern.replace("<", delimiters[0]).replace(">", delimiters[1])
+        assert TemplateChunker.tokenize(lexerClass, pattern) is None, pattern
+
+
+ACTIONS = [
+    "name",
+    "p.lastName",
+    "v.(propName)",
+    "(name)()",
+    "super.font()",
+    "first([names,phones])",
+    "last(rest(names))",
+    "trunc(names); separator=\"|\"",
+    "item:bold(),italics():listItem()",
+    "names:{n | <n>!}",
+    "A,B:{a,b|$i0$. $a$@$b$}; separator=\"\\n\"",
+    "A:{\n  <i>$it:{\n    <b>$it$</b>\n  }$</i>\n}",
+    "A:foo(x=\"dog\\\"g\")",
+    "\"literal\":{a|$a$\\}}",
+    "foo(t={Hi, $super.name$}, name=\"parrt\")",
+    "users:{$if(it.ok)$$it.name$$else$$endif$}; separator=\",\"",
+    "if(!(a.b))",
+    "x+\"y\"+3; null=\"-\", wrap, anchor",
+    "elseif(a.b)",
+    "a/b/c(...)",
+    "\t{\n x ,\ty\n| <x>}",
+]
+
+
+def test_ActionTokenizerMatchesActionLexer(monkeypatch):
+    parsed = []
+    tokenize = ActionTokenizer.tokenize.__func__
+
+    def recordingTokenize(cls, action):
+        parsed.append(action)
+        return tokenize(cls, action)
+
+    monkeypatch.setattr(ActionTokenizer, "tokenize", classmethod(recordingTokenize))
+    templates = Path(__file__).parent / "templates"
+    for path in sorted(templates.iterdir()):
+        text = path.read_text()
+        if not text.strip():
+            continue
+        if path.suffix == ".stg":
+            St3G(file=io.StringIO(text))
+        else:
+            St3T(template=text)
+    assert parsed
+
+    for action in ACTIONS + parsed:
+        tokens = tokenize(ActionTokenizer, action)
+        assert tokens is not None, action
+        assert tokenTuples(tokens) == tokenTuples(actionTokens(action)), action
+
+    for action in ["a\\", "{x", "a..b", "\"open", "a\r\nb", "a # b"]:
+        assert tokenize(ActionTokenizer, action) is None, action
+
+
+@pytest.mark.benchmark
+def test_ActionTokenizerOutrunsActionLexer():
+    def best(tokenize):
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(20):
+                for action in ACTIONS:
+                    tokenize(action)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    assert best(ActionTokenizer.tokenize) * 2 < best(actionTokens)
+
+
+def test_PropertyAccessorsAreRememberedPerClass():
+    class Row:
+        def __init__(self, id_):
+            self.name = f"n{id_}"
+            self._id = id_
+
+        def getId(self):
+            return self._id
+
+    def render():
+        t = St3T("$rows:{r|$r.id$=$r.name$}; separator=\",\"$")
+        t["rows"] = [Row(1), Row(2)]
+        return str(t)
+
+    assert render() == "1=n1,2=n2"
+    assert PROPERTY_ACCESSORS.get((Row, "id")) is not None
+    assert PROPERTY_ACCESSORS.get((Row, "name")) is not None
+
+    Row.getName = lambda self: self.name.upper()
+    PROPERTY_ACCESSORS.invalidate(Row)
+    assert PROPERTY_ACCESSORS.get((Row, "name")) is None
+    assert render() == "1=N1,2=N2"
+
+    PROPERTY_ACCESSORS.exclude(Row)
+    assert render() == "1=N1,2=N2"
+    assert PROPERTY_ACCESSORS.get((Row, "id")) is None
+
+
+def test_AttributeScopeKeepsDynamicScoping():
+    group = St3G(file=io.StringIO(dedent("""\
+        group scopes;
+        page(rows, title) ::= "<rows:{r|<row(items=r)>}>"
+        row(items, title) ::= "[<items:{c|<cell()>}>]"
+        cell() ::= "<title>=<c>;"
+        outer(rows, title) ::= "<rows:{r|<title><r>}>"
+        missing(rows) ::= "<rows:{r|<nosuch>}>"
+        """)))
+    page = group.getInstanceOf("page", attributes={"rows": [[1, 2], [3]], "title": "T"})
+    # row's formal argument hides page's title
+    assert str(page) == "[=1;=2;][=3;]"
+    assert page._scope is None
+
+    outer = group.getInstanceOf("outer", attributes={"title": "T"})
+    outer["rows"] = [1, 2]
+    assert str(outer) == "T1T2"
+
+    missing = group.getInstanceOf("missing", attributes={"rows": [1]})
+    with pytest.raises(KeyError) as scoped:
+        str(missing)
+    assert "no such attribute: nosuch" in str(scoped.value)
+
+
+class TaggingRenderer:
+    def __init__(self, tag):
+        self.tag = tag
+
+    def toString(self, o, formatString=None):
+        return f"{self.tag}({o})"
+
+
+def test_RenderersResolveThroughBaseClasses():
+    class Name(str):
+        pass
+
+    superGroup = St3G("renderersSuper")
+    group = St3G("renderers", superGroup=superGroup)
+    t = St3T("$n$ $b$ $s$ $f$", group=group)
+    t["n"] = 3
+    t["b"] = True
+    t["s"] = Name("x")
+    t["f"] = 1.5
+    assert str(t) == "3 True x 1.5"
+    assert group.getAttributeRenderer(int) is None
+
+    # remembered misses are forgotten once a renderer is registered
+    superGroup.registerRenderer(int, TaggingRenderer("int"))
+    group.registerRenderer(str, TaggingRenderer("str"))
+    assert str(t) == "int(3) int(True) str(x) 1.5"
+
+    group.registerRenderer(bool, TaggingRenderer("bool"))
+    group.registerRenderer(object, TaggingRenderer("obj"))
+    assert str(t) == "obj(3) bool(True) str(x) obj(1.5)"
+
+    t.registerRenderer(int, TaggingRenderer("local"))
+    assert str(t) == "local(3) local(True) str(x) obj(1.5)"
+
+
+def test_SuperGroupChangeInvalidatesRenderersAfterAssignment(monkeypatch):
+    superGroup = St3G("renderersNewSuper")
+    superGroup.registerRenderer(int, TaggingRenderer("int"))
+    group = St3G("renderersNewSub")
+    assert group.getAttributeRenderer(int) is None
+
+    seen = []
+    changed = St3G._renderersChanged
+    monkeypatch.setattr(St3G, "_renderersChanged",
+                        staticmethod(lambda: (seen.append(group.superGroup), changed())))
+    group.superGroup = superGroup
+    assert seen == [superGroup]
+    assert isinstance(group.getAttributeRenderer(int), TaggingRenderer)
+
+
+def test_MemoizingRendererRemembersImmutableValues():
+    class CountingRenderer(TaggingRenderer):
+        calls = 0
+
+        def toString(self, o, formatString=None):
+            CountingRenderer.calls += 1
+            return f"{self.tag}({o}:{formatString})"
+
+    class Money:
+        def __init__(self, amount):
+            self.amount = amount
+
+        def __str__(self):
+            return f"${self.amount}"
+
+    group = St3G("memoizedRenderers")
+    group.registerRenderer(float, CountingRenderer("f"), memoSize=16)
+    assert isinstance(group.getAttributeRenderer(float), MemoizingRenderer)
+    renderer = MemoizingRenderer(CountingRenderer("r"), maxSize=2)
+    group.registerRenderer(int, renderer)
+    group.registerRenderer(Money, renderer)
+
+    t = St3T("$xs; separator=\",\"$|$xs; format=\"f\", separator=\",\"$", group=group)
+    t["xs"] = [1, 1, True, 1, Money(2)]
+    assert str(t) == ("r(1:None),r(1:None),r(True:None),r(1:None),r($2:None)|"
+                      "r(1:f),r(1:f),r(True:f),r(1:f),r($2:f)")
+    # 1 and True are remembered apart; Money is always rendered
+    assert CountingRenderer.calls == 6
+    assert (renderer.memo.hits, renderer.memo.misses) == (4, 4)
+    assert len(renderer.memo) == 2
+
+
+def test_WriteDispatchesOnValueType():
+    class Point:
+        def __str__(self):
+            return "pt"
+
+    class Squares:
+        def __getitem__(self, i):
+            if i >= 3:
+                raise IndexError(i)
+            return i * i
+
+    for value, expected in [
+        (7, "7"), (2.5, "2.5"), (True, "True"), ("abc", "abc"), (Point(), "pt"),
+        ([1, "a", 2.0], "1,a,2.0"), ((1, 2), "1,2"), ({"k": 1, "j": 2}, "1,2"),
+        ((i for i in range(3)), "0,1,2"), (Squares(), "0,1,4"),
+        ([St3T("x"), [St3T("y"), 3]], "x,y,3"),
+    ]:
+        t = St3T("$v; separator=\",\"$", attributes={"v": value})
+        assert str(t) == expected
+    assert _writeKinds[Point] == _WRITE_SCALAR
+    assert _writeKinds[Squares] == _WRITE_ITERABLE
+
+
+def test_SeparatedScalarListsJoinInOneWrite(monkeypatch):
+    writes = []
+    write = AutoIndentWriter.write
+
+    def countingWrite(self, text, wrap=None):
+        writes.append(text)
+        return write(self, text, wrap)
+
+    monkeypatch.setattr(AutoIndentWriter, "write", countingWrite)
+    group = St3G(file=io.StringIO(dedent("""\
+        group joins;
+        cols(xs) ::= <<
+        select
+          <xs; separator=", ">
+        >>
+        """)), lineSeparator="\n")
+
+    t = group.getInstanceOf("cols", attributes={"xs": ["a", 1, 2.5, ""]})
+    assert str(t) == "select\n  a, 1, 2.5, "
+    assert "a, 1, 2.5, " in writes
+
+    # values that need the element-by-element path still render the same
+    for xs, expected in [
+        (["a", None, "b"], "select\n  a, b"),
+        (["a", "b\nc"], "select\n  a, b\n  c"),
+        (["a", True], "select\n  a, True"),
+    ]:
+        writes.clear()
+        t = group.getInstanceOf("cols", attributes={"xs": xs})
+        assert str(t) == expected
+        assert ", ".join(map(str, filter(None, xs))) not in writes
+
+    group.registerRenderer(int, TaggingRenderer("int"))
+    t = group.getInstanceOf("cols", attributes={"xs": ["a", 1]})
+    assert str(t) == "select\n  a, int(1)"
+
+
+def test_LiteralAndReferenceOptionsSkipTheEvaluator(monkeypatch):
+    evaluated = []
+    evaluateExpression = ASTExpr.evaluateExpression
+
+    def recordingEvaluate(self, this, expr):
+        evaluated.append(expr.toStringList())
+        return evaluateExpression(self, this, expr)
+
+    monkeypatch.setattr(ASTExpr, "evaluateExpression", recordingEvaluate)
+    group = St3G(file=io.StringIO(dedent("""\
+        group options;
+        page(rows, sep) ::= <<
+        <rows:{r|<r; separator=", ", null="-">;<r; separator=sep>}; separator="\\n">
+        >>
+        cat(xs, sep) ::= "<xs; separator=sep+\\"!\\">"
+        """)), lineSeparator="\r\n")
+
+    page = group.getInstanceOf("page", attributes={"rows": [["a", None], ["b"]], "sep": "|"})
+    assert str(page) == "a, -;a\r\nb;b"
+    assert evaluated == []
+
+    page = group.getInstanceOf("page", attributes={"rows": [["a", "c"]]})
+    assert str(page) == "a, c;ac"
+    assert evaluated == []
+
+    cat = group.getInstanceOf("cat", attributes={"xs": ["a", "b"], "sep": ","})
+    assert str(cat) == "a,!b"
+    assert len(evaluated) == 1
+
+    group.registerRenderer(str, TaggingRenderer("s"))
+    page = group.getInstanceOf("page", attributes={"rows": [["a", "c"]], "sep": "|"})
+    assert str(page) == "s(a)s(, )s(c);s(a)s(|)s(c)"
+
+
+@pytest.mark.parametrize("first, second", [
+    (decimal.Decimal("1.5"), decimal.Decimal("1.50")),
+    (0.0, -0.0),
+    (datetime.datetime(2024, 5, 1, 12, tzinfo=datetime.timezone.utc),
+     datetime.datetime(2024, 5, 1, 13, tzinfo=datetime.timezone(datetime.timedelta(hours=1)))),
+])
+def test_MemoizingRendererKeepsEqualValuesApart(first, second):
+    class IsoRenderer:
+        def toString(self, o, formatName=None):
+            return o.isoformat() if isinstance(o, datetime.datetime) else str(o)
+
+    assert first == second
+    renderer = MemoizingRenderer(IsoRenderer())
+    assert renderer.toString(first) == IsoRenderer().toString(first)
+    assert renderer.toString(second) == IsoRenderer().toString(second)
+    assert renderer.toString(first) != renderer.toString(second)
+    assert (renderer.memo.hits, renderer.memo.misses) == (2, 2)
+
+
+def test_ExprOptionsHoldOneWritesValues():
+    group = St3G("exprOptions")
+    group.defineTemplate("t", '$names; separator=sep, null="-", wrap="~"$')
+    plain = group.defineTemplate("plain", "$names$")
+    t = group.getInstanceOf("t")
+    t["names"] = ["a", None, "b"]
+    t["sep"] = "/"
+    expr = next(chunk for chunk in t.chunks if isinstance(chunk, ASTExpr))
+    options = expr.handleExprOptions(t)
+    assert isinstance(options, ExprOptions)
+    assert (options.separatorString, options.nullValue, options.wrapString) == ("/", "-", "~")
+    assert options.formatString is None
+    assert options.AST is expr.AST
+    assert str(t) == "a/-/b"
+
+    expr = next(chunk for chunk in plain.chunks if isinstance(chunk, ASTExpr))
+    assert expr.handleExprOptions(plain) is expr
+
+
+def test_RefreshCheckWaitsUntilDue(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    checked = []
+    reload = St3G._reloadChangedTemplates
+    monkeypatch.setattr(St3G, "_reloadChangedTemplates",
+                        lambda self: (checked.append(self.name), reload(self)))
+    base = St3G("refreshDueBase")
+    sub = St3G("refreshDueSub", superGroup=base)
+    sub.defineTemplate("t", "x")
+
+    sub.lookupTemplate("t")
+    assert checked == []
+
+    base.refreshInterval = 10
+    sub.refreshInterval = 60
+    clock[0] += 30
+    sub.lookupTemplate("t")
+    assert checked == []
+
+    clock[0] += 30
+    sub.lookupTemplate("t")
+    assert checked == ["refreshDueBase", "refreshDueSub"]
+    sub.lookupTemplate("t")
+    assert checked == ["refreshDueBase", "refreshDueSub"]
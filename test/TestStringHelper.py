@@ -5,7 +5,10 @@ import os
 
 import yaml
 
-from stringtemplate3 import StringTemplateErrorListener
+from stringtemplate3 import StringTemplateErrorListener, antlr
+from stringtemplate3.language import ActionLexer
+from stringtemplate3.language.ChunkToken import ChunkToken
+from stringtemplate3.language.StringTemplateToken import StringTemplateToken
 
 """
  [The "BSD licence"]
@@ -107,3 +110,30 @@ def write_file(file_path, content):
         logger.exception("can't write file", ioe)
     return file_path
 
+
+def chunkTokens(lexerClass, pattern):
+    """ The tokens the generated lexer breaks pattern into. """
+    lexer = lexerClass(antlr.StringCharBuffer(pattern))
+    lexer.setTokenObjectClass(ChunkToken)
+    tokens = []
+    while not tokens or tokens[-1].type != antlr.EOF_TYPE:
+        tokens.append(lexer.nextToken)
+    return tokens
+
+
+def chunkTuples(tokens):
+    return [(t.type, t.text, t.indentation, t.line, t.column) for t in tokens]
+
+
+def actionTokens(action):
+    """ The tokens ActionLexer breaks action into. """
+    lexer = ActionLexer.Lexer(antlr.StringCharBuffer(action))
+    lexer.setTokenObjectClass(StringTemplateToken)
+    tokens = []
+    while not tokens or tokens[-1].type != antlr.EOF_TYPE:
+        tokens.append(lexer.nextToken)
+    return tokens
+
+
+def tokenTuples(tokens):
+    return [(t.type, t.text, t.line, t.column, t.args) for t in tokens]
@@ -0,0 +1,59 @@
+"""
+Checks shared by the whole test session.
+
+Every action and template the suites hand to ActionTokenizer and
+TemplateChunker is recorded, and at the end of the session compared
+against what the generated lexers make of the same input.
+Timing comparisons are marked 'benchmark' and only run with --benchmarks.
+"""
+import pytest
+
+from TestStringHelper import actionTokens, chunkTokens, chunkTuples, tokenTuples
+from stringtemplate3.language.ActionTokenizer import ActionTokenizer
+from stringtemplate3.language.TemplateChunker import TemplateChunker
+
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmarks", action="store_true", default=False,
+                     help="also run the timing comparisons marked 'benchmark'")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="timing comparison, run with --benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def tokenizersMatchGeneratedLexers():
+    actions = set()
+    patterns = set()
+    tokenizeAction = ActionTokenizer.tokenize.__func__
+    tokenizePattern = TemplateChunker.tokenize.__func__
+
+    def recordAction(cls, action):
+        actions.add(action)
+        return tokenizeAction(cls, action)
+
+    def recordPattern(cls, lexerClass, pattern):
+        patterns.add((lexerClass, pattern))
+        return tokenizePattern(cls, lexerClass, pattern)
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(ActionTokenizer, "tokenize", classmethod(recordAction))
+        mp.setattr(TemplateChunker, "tokenize", classmethod(recordPattern))
+        yield
+
+    mismatches = []
+    for action in sorted(actions):
+        tokens = tokenizeAction(ActionTokenizer, action)
+        if tokens is not None and tokenTuples(tokens) != tokenTuples(actionTokens(action)):
+            mismatches.append(action)
+    for lexerClass, pattern in sorted(patterns, key=lambda p: (p[0].__module__, p[1])):
+        tokens = tokenizePattern(TemplateChunker, lexerClass, pattern)
+        if tokens is not None and chunkTuples(tokens) != chunkTuples(chunkTokens(lexerClass, pattern)):
+            mismatches.append(pattern)
+    assert not mismatches, mismatches